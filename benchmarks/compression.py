@@ -0,0 +1,121 @@
+# ARTICLES/benchmarks/compression.py
+"""File size and scan speed with and without Article.content compression.
+
+Generates one dataset with long content, copies it, converts the copy
+with the chosen codec and VACUUMs both, then compares file size, a full
+table scan that never looks at content, loading articles as models, and
+loading them and reading every ``content``.
+
+    python -m benchmarks.compression --articles 50000 --content-words 400 --codec zlib
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from lib.db import connection as db
+from lib.db.compression import CODECS, content_stats, convert, register_functions
+from lib.models.article import Article
+from lib.models.identity_map import identity_map_disabled
+
+from .datagen import DatasetSpec, ensure_dataset
+
+DEFAULT_REPEAT = 5
+
+
+def _median_seconds(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def compress_copy(source, target, codec, threshold):
+    shutil.copyfile(source, target)
+    conn = register_functions(sqlite3.connect(target, isolation_level=None))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        convert(conn, codec, threshold)
+        conn.execute("COMMIT")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def measure(database, repeat):
+    conn = register_functions(sqlite3.connect(database))
+    try:
+        stats = content_stats(conn)
+        # The magazine with the most articles (datagen's skew makes it large)
+        magazine_id = conn.execute(
+            "SELECT magazine_id FROM articles GROUP BY magazine_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ).fetchone()[0]
+        scan = _median_seconds(
+            lambda: conn.execute("SELECT COUNT(*) FROM articles NOT INDEXED WHERE title LIKE '%zzz%'").fetchone(),
+            repeat,
+        )
+    finally:
+        conn.close()
+
+    previous = db.DATABASE_NAME
+    db.DATABASE_NAME = database
+    try:
+        with identity_map_disabled():
+            load = _median_seconds(lambda: Article.find_by_magazine_id(magazine_id), repeat)
+            read = _median_seconds(
+                lambda: sum(len(a.content) for a in Article.find_by_magazine_id(magazine_id)), repeat)
+    finally:
+        db.DATABASE_NAME = previous
+    return {
+        'file_bytes': os.path.getsize(database),
+        'content': stats,
+        'scan_ms': scan * 1000,
+        'load_ms': load * 1000,
+        'load_and_read_ms': read * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the effect of compressing article content.")
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--content-words", type=int, default=400)
+    parser.add_argument("--codec", choices=sorted(CODECS), default="zlib")
+    parser.add_argument("--threshold", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--output", help="write the JSON results here")
+    args = parser.parse_args(argv)
+
+    spec = DatasetSpec(args.articles, content_words=args.content_words)
+    plain = os.path.join(tempfile.gettempdir(), f"articles-compress-{args.articles}-{args.content_words}.db")
+    ensure_dataset(plain, spec)
+    conn = sqlite3.connect(plain)
+    conn.execute("VACUUM")
+    conn.close()
+    compressed = plain.replace(".db", f"-{args.codec}.db")
+    compress_copy(plain, compressed, args.codec, args.threshold)
+
+    results = {
+        'dataset': spec.as_dict(),
+        'codec': args.codec,
+        'threshold': args.threshold,
+        'plain': measure(plain, args.repeat),
+        args.codec: measure(compressed, args.repeat),
+    }
+    for label in ('plain', args.codec):
+        r = results[label]
+        print(f"{label:<6} {r['file_bytes'] / 1e6:>9.1f} MB  scan {r['scan_ms']:>8.1f} ms  "
+              f"load {r['load_ms']:>8.1f} ms  load+read {r['load_and_read_ms']:>8.1f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
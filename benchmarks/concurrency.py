@@ -0,0 +1,158 @@
+# ARTICLES/benchmarks/concurrency.py
+"""Multi-process reader/writer stress test for the connection profiles.
+
+Runs ``--readers`` processes calling model finders and aggregates while
+one writer process inserts articles in small transactions, first with the
+old rollback-journal profile and then with the WAL profile, and reports
+reads/s, writes/s and, separately for readers and the writer, how many
+operations failed with "database is locked" and how many for any other
+reason. Readers run with the identity map and the result cache off, so
+every read reaches the database.
+
+    python -m benchmarks.concurrency --articles 50000 --readers 4 --seconds 5
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from .datagen import DatasetSpec, ensure_dataset
+
+WRITE_BATCH = 20
+
+
+def _is_lock_error(message):
+    return "database is locked" in message
+
+
+class _LockErrorCounter(logging.Handler):
+    """Counts the logged database errors that were lock errors; the models log and swallow them."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        if _is_lock_error(record.getMessage()):
+            self.count += 1
+
+
+def _setup_worker(database, profile):
+    from lib.db import connection as db
+    # Lock errors are expected here and counted; don't flood the terminal
+    logger = logging.getLogger("lib")
+    logger.setLevel(logging.ERROR)
+    logger.propagate = False
+    counter = _LockErrorCounter()
+    logger.handlers[:] = [counter]
+    db.DATABASE_NAME = database
+    db.configure_profile(profile)
+    return counter
+
+
+def _errors():
+    from lib.db.instrument import query_stats
+    return sum(stats['errors'] for name, stats in query_stats().items() if name != "pool.acquire")
+
+
+def reader(database, profile, seconds, seed, max_author, max_magazine):
+    from lib.models.article import Article
+    from lib.models.author import Author
+    from lib.models.identity_map import identity_map_disabled
+    from lib.models.magazine import Magazine
+    from lib.models.result_cache import result_cache_disabled
+    lock_errors = _setup_worker(database, profile)
+    rng = random.Random(seed)
+    operations = 0
+    deadline = time.monotonic() + seconds
+    with identity_map_disabled(), result_cache_disabled():
+        while time.monotonic() < deadline:
+            Article.find_by_author_id(rng.randint(1, max_author))
+            magazine = Magazine.find_by_id(rng.randint(1, max_magazine))
+            if magazine is not None:  # None when the lookup failed on a lock
+                magazine.contributing_authors()
+            Author.top_author()
+            operations += 3
+    errors = _errors()
+    return {'operations': operations, 'lock_errors': lock_errors.count, 'errors': errors - lock_errors.count}
+
+
+def writer(database, profile, seconds, seed, max_author, max_magazine):
+    from lib.db.connection import connection
+    _setup_worker(database, profile)
+    rng = random.Random(seed)
+    operations = lock_errors = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        rows = [
+            (f"Stress {seed}-{operations + i}", "stress test body", rng.randint(1, max_author), rng.randint(1, max_magazine))
+            for i in range(WRITE_BATCH)
+        ]
+        try:
+            with connection() as conn, conn:
+                conn.executemany(
+                    "INSERT INTO articles (title, content, author_id, magazine_id) VALUES (?, ?, ?, ?)", rows)
+            operations += len(rows)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(str(e)):
+                lock_errors += 1
+            else:
+                errors += 1
+    return {'operations': operations, 'lock_errors': lock_errors, 'errors': errors}
+
+
+def stress(database, profile, readers, seconds, max_author, max_magazine):
+    context = multiprocessing.get_context("spawn")
+    args = (database, profile, seconds)
+    # Set the journal mode before the workers start racing for it
+    _setup_worker(database, profile)
+    with context.Pool(readers + 1) as pool:
+        write = pool.apply_async(writer, args + (0, max_author, max_magazine))
+        reads = [pool.apply_async(reader, args + (i + 1, max_author, max_magazine)) for i in range(readers)]
+        write, reads = write.get(), [r.get() for r in reads]
+    return {
+        'profile': profile.as_dict(),
+        'reads_per_second': sum(r['operations'] for r in reads) / seconds,
+        'read_lock_errors': sum(r['lock_errors'] for r in reads),
+        'read_errors': sum(r['errors'] for r in reads),
+        'writes_per_second': write['operations'] / seconds,
+        'write_lock_errors': write['lock_errors'],
+        'write_errors': write['errors'],
+    }
+
+
+def main(argv=None):
+    from lib.db.connection import ROLLBACK_PROFILE, ConnectionProfile
+    parser = argparse.ArgumentParser(description="Compare rollback-journal and WAL under concurrent load.")
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--database", help="dataset file (default: a fresh one in the temp dir)")
+    parser.add_argument("--output", help="write the JSON results here")
+    args = parser.parse_args(argv)
+
+    spec = DatasetSpec(args.articles)
+    database = args.database or os.path.join(tempfile.gettempdir(), f"articles-stress-{args.articles}.db")
+    ensure_dataset(database, spec)
+    results = []
+    for label, profile in (("rollback", ROLLBACK_PROFILE), ("wal", ConnectionProfile())):
+        result = stress(database, profile, args.readers, args.seconds, spec.authors, spec.magazines)
+        result['label'] = label
+        results.append(result)
+        print(f"{label:<9} reads {result['reads_per_second']:>10,.0f}/s "
+              f"({result['read_lock_errors']} locked, {result['read_errors']} other errors)  "
+              f"writes {result['writes_per_second']:>9,.0f}/s "
+              f"({result['write_lock_errors']} locked, {result['write_errors']} other failed batches)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
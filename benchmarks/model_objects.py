@@ -0,0 +1,95 @@
+# ARTICLES/benchmarks/model_objects.py
+"""Memory and construction-speed benchmark for the model classes.
+
+Compares the __slots__ models against an equivalent dict-backed class, and
+the sqlite3.Row name-lookup path against the positional tuple path.
+
+    python -m benchmarks.model_objects --rows 200000
+"""
+import argparse
+import sqlite3
+import time
+import tracemalloc
+
+from lib.models.article import Article
+
+
+class DictArticle:
+    """The pre-__slots__ Article layout, kept here as the baseline."""
+
+    def __init__(self, title, content, author_id, magazine_id, id=None):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.author_id = author_id
+        self.magazine_id = magazine_id
+        self._author = None
+        self._magazine = None
+
+
+def make_rows(conn, count):
+    conn.execute(
+        "CREATE TABLE articles (id INTEGER PRIMARY KEY, title TEXT, content TEXT, author_id INTEGER, magazine_id INTEGER)"
+    )
+    conn.executemany(
+        "INSERT INTO articles (title, content, author_id, magazine_id) VALUES (?, ?, ?, ?)",
+        ((f"Title {i}", "x" * 64, i % 97, i % 13) for i in range(count)),
+    )
+
+
+def fetch(conn, row_factory):
+    cursor = conn.cursor()
+    cursor.row_factory = row_factory
+    return cursor.execute(f"SELECT {Article.COLUMNS} FROM articles").fetchall()
+
+
+def from_rows(cls, rows):
+    return [
+        cls(row['title'], row['content'], row['author_id'], row['magazine_id'], row['id'])
+        for row in rows
+    ]
+
+
+def measure(label, build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    objects = build()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'case': label,
+        'objects': len(objects),
+        'seconds': seconds,
+        'objects_per_second': len(objects) / seconds if seconds else 0.0,
+        'peak_bytes': peak,
+        'bytes_per_object': peak / len(objects) if objects else 0.0,
+    }
+
+
+def run(count):
+    conn = sqlite3.connect(":memory:")
+    make_rows(conn, count)
+    named = fetch(conn, sqlite3.Row)
+    plain = fetch(conn, None)
+    conn.close()
+    return [
+        measure("dict + sqlite3.Row", lambda: from_rows(DictArticle, named)),
+        measure("slots + sqlite3.Row", lambda: from_rows(Article, named)),
+        measure("slots + tuples", lambda: Article._from_tuples(plain)),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args(argv)
+    for result in run(args.rows):
+        print(
+            f"{result['case']:<22} {result['objects_per_second']:>12,.0f} obj/s "
+            f"{result['bytes_per_object']:>8.1f} B/obj (peak {result['peak_bytes'] / 1e6:.1f} MB)"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# ARTICLES/benchmarks/suite.py
+"""Time every public model method against a synthetic dataset.
+
+Each case is called ``--repeat`` times with arguments drawn from the
+dataset by a seeded RNG, so two runs on the same dataset issue the same
+queries. Results (per-call latency percentiles, the dataset spec and the
+environment) are written as JSON; ``--compare`` diffs a run against an
+earlier file and exits non-zero when a case got slower than ``--threshold``.
+
+    python -m benchmarks.suite --articles 100000 --output results.json
+    python -m benchmarks.suite --articles 100000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+
+from lib.db import connection as db
+from lib.db.instrument import query_stats, reset_query_stats
+from lib.models.article import Article
+from lib.models.author import Author
+from lib.models.identity_map import identity_map_disabled
+from lib.models.magazine import Magazine
+from lib.models.result_cache import clear_result_cache, result_cache_disabled
+
+from .datagen import DEFAULT_SEED, DEFAULT_SKEW, WORDS, DatasetSpec, ensure_dataset
+
+RESULTS_VERSION = 1
+# Cases with this suffix run with the result cache on; everything else measures the queries
+CACHED = "[cached]"
+DEFAULT_REPEAT = 50
+DEFAULT_THRESHOLD = 1.25
+
+
+def _sample(conn, sql, rng, count):
+    values = [row[0] for row in conn.execute(sql)]
+    return [rng.choice(values) for _ in range(count)] if values else []
+
+
+def build_cases(database, repeat, seed=DEFAULT_SEED):
+    """Return ``[(name, [callables])]``; argument lookups happen here, untimed."""
+    rng = random.Random(f"{seed}:cases")
+    conn = sqlite3.connect(database)
+    try:
+        def ids(table):
+            max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+            return [rng.randint(1, max_id) for _ in range(repeat)] if max_id else []
+
+        author_ids, magazine_ids, article_ids = ids("authors"), ids("magazines"), ids("articles")
+        author_names = _sample(conn, "SELECT name FROM authors LIMIT 10000", rng, repeat)
+        magazine_names = _sample(conn, "SELECT name FROM magazines LIMIT 10000", rng, repeat)
+        categories = _sample(conn, "SELECT DISTINCT category FROM magazines", rng, repeat)
+        titles = _sample(conn, "SELECT title FROM articles LIMIT 10000", rng, repeat)
+    finally:
+        conn.close()
+    terms = [" ".join(rng.sample(WORDS, 2)) for _ in range(repeat)]
+
+    # Instances are built directly so relationship timings exclude the finder
+    authors = [Author(f"author {id}", id=id) for id in author_ids]
+    magazines = [Magazine(f"magazine {id}", "", id=id) for id in magazine_ids]
+
+    def calls(fn, args):
+        return [lambda arg=arg: fn(arg) for arg in args]
+
+    def method(name, objects):
+        return [getattr(obj, name) for obj in objects]
+
+    def article_for(id):
+        # author()/magazine() need an Article; load it outside the timed call
+        return Article.find_by_id(id) or Article("", "", None, None, id=id)
+
+    articles = [article_for(id) for id in article_ids[:repeat]]
+    return [
+        ("Author.find_by_id", calls(Author.find_by_id, author_ids)),
+        ("Author.find_by_name", calls(Author.find_by_name, author_names)),
+        # All ``repeat`` ids at once, against the per-id finder above
+        ("Author.find_by_ids", [lambda: Author.find_by_ids(author_ids)] * repeat),
+        ("Author.find_by_names", [lambda: Author.find_by_names(author_names)] * repeat),
+        ("Author.articles", method("articles", authors)),
+        ("Author.magazines", method("magazines", authors)),
+        ("Author.magazines_page", method("magazines_page", authors)),
+        ("Author.top_author", [Author.top_author] * repeat),
+        ("Magazine.find_by_id", calls(Magazine.find_by_id, magazine_ids)),
+        ("Magazine.find_by_name", calls(Magazine.find_by_name, magazine_names)),
+        ("Magazine.find_by_category", calls(Magazine.find_by_category, categories)),
+        ("Magazine.find_page_by_category", calls(Magazine.find_page_by_category, categories)),
+        ("Magazine.articles", method("articles", magazines)),
+        ("Magazine.article_titles", method("article_titles", magazines)),
+        ("Magazine.contributing_authors", method("contributing_authors", magazines)),
+        ("Magazine.contributors", method("contributors", magazines)),
+        ("Magazine.with_multiple_authors", [Magazine.with_multiple_authors] * repeat),
+        ("Magazine.article_counts", [Magazine.article_counts] * repeat),
+        ("Article.find_by_id", calls(Article.find_by_id, article_ids)),
+        ("Article.find_by_title", calls(Article.find_by_title, titles)),
+        ("Article.find_by_author_id", calls(Article.find_by_author_id, author_ids)),
+        ("Article.find_by_magazine_id", calls(Article.find_by_magazine_id, magazine_ids)),
+        ("Article.find_by_magazine_id[only=id,title]",
+         calls(lambda id: Article.find_by_magazine_id(id, only=("id", "title")), magazine_ids)),
+        ("Article.find_page_by_author_id", calls(Article.find_page_by_author_id, author_ids)),
+        ("Article.find_page_by_magazine_id", calls(Article.find_page_by_magazine_id, magazine_ids)),
+        ("Article.search", calls(Article.search, terms)),
+        ("Article.author", method("author", articles)),
+        ("Article.magazine", method("magazine", articles)),
+        ("Author.magazines" + CACHED, method("magazines", authors)),
+        ("Author.top_author" + CACHED, [Author.top_author] * repeat),
+        ("Magazine.contributing_authors" + CACHED, method("contributing_authors", magazines)),
+        ("Magazine.with_multiple_authors" + CACHED, [Magazine.with_multiple_authors] * repeat),
+        ("Magazine.article_counts" + CACHED, [Magazine.article_counts] * repeat),
+    ]
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_calls(calls):
+    """Run each call once (after one untimed warm-up) and summarise the latencies."""
+    if not calls:
+        return None
+    calls[0]()
+    timings = []
+    for call in calls:
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    ordered = sorted(timings)
+    total = sum(timings)
+    return {
+        'calls': len(timings),
+        'mean_ms': total / len(timings) * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': _percentile(ordered, 0.95) * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'calls_per_second': len(timings) / total if total else 0.0,
+    }
+
+
+def run(database, repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED, only=None):
+    """Benchmark the model methods against ``database``; returns the results dict."""
+    previous = db.DATABASE_NAME
+    db.DATABASE_NAME = database
+    try:
+        # The identity map would turn repeated lookups into dict hits
+        with identity_map_disabled():
+            cases = build_cases(database, repeat, seed)
+            reset_query_stats()
+            results = {}
+            for name, calls in cases:
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                clear_result_cache()
+                with nullcontext() if name.endswith(CACHED) else result_cache_disabled():
+                    timing = time_calls(calls)
+                if timing is not None:
+                    results[name] = timing
+            queries = query_stats()
+    finally:
+        db.DATABASE_NAME = previous
+    return {
+        'version': RESULTS_VERSION,
+        'created_at': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'repeat': repeat,
+        'results': results,
+        'queries': queries,
+    }
+
+
+def compare(current, baseline):
+    """Return ``[(name, baseline_ms, current_ms, ratio)]`` for cases in both runs."""
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        rows.append((name, before['median_ms'], result['median_ms'], ratio))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the model methods on a synthetic dataset.")
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--skew", type=float, default=DEFAULT_SKEW)
+    parser.add_argument("--database", help="dataset file (default: one per size in the temp dir, reused)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="calls per case")
+    parser.add_argument("--only", action="append", help="run cases whose name contains this (repeatable)")
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="median slowdown ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    spec = DatasetSpec(args.articles, seed=args.seed, skew=args.skew)
+    database = args.database or os.path.join(
+        tempfile.gettempdir(), f"articles-bench-{args.articles}-{args.seed}-{args.skew}.db")
+    generated = ensure_dataset(database, spec)
+    if generated:
+        load = generated['load']
+        print(f"Generated {database}: {load['rows']:,} rows at {load['rows_per_second']:,.0f} rows/s, "
+              f"indexed in {generated['index_seconds']:.1f}s")
+
+    results = run(database, args.repeat, args.seed, args.only)
+    results['dataset'] = spec.as_dict()
+    if generated:
+        results['generate'] = generated
+    for name, result in results['results'].items():
+        print(f"{name:<36} median {result['median_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != results['dataset']:
+            print("warning: baseline was run on a different dataset", file=sys.stderr)
+        regressions = 0
+        for name, before, after, ratio in compare(results, baseline):
+            flag = ""
+            if ratio > args.threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{name:<36} {before:>9.3f} -> {after:>9.3f} ms  x{ratio:.2f}{flag}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+# ARTICLES/benchmarks/write_queue.py
+"""Threaded save() throughput with and without the group-commit write queue.
+
+``--threads`` threads each add ``--per-thread`` articles through
+Author.add_article, first with every thread committing on its own and
+then with all writes going through the WriteQueue, and reports
+writes/s, save() errors (e.g. "database is locked") and the batches
+the queue formed.
+
+    python -m benchmarks.write_queue --threads 16 --per-thread 200
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.db import connection as db
+from lib.db.instrument import query_stats, reset_query_stats
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.write_queue import start_write_queue, stop_write_queue
+
+from .datagen import DatasetSpec, ensure_dataset
+
+
+def _save_errors():
+    stats = query_stats().get("Article.save")
+    return stats['errors'] if stats else 0
+
+
+def measure(threads, per_thread, max_author, max_magazine):
+    reset_query_stats()
+
+    def work(thread):
+        author = Author.find_by_id(thread % max_author + 1)
+        magazine = Magazine.find_by_id(thread % max_magazine + 1)
+        for i in range(per_thread):
+            author.add_article(magazine, f"Benchmark {thread}-{i}", "text")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(work, range(threads)))
+    seconds = time.perf_counter() - started
+    writes = threads * per_thread
+    return {'writes': writes, 'seconds': seconds, 'writes_per_second': writes / seconds, 'errors': _save_errors()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare threaded saves with and without group commit.")
+    parser.add_argument("--articles", type=int, default=10000, help="size of the starting dataset")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--per-thread", type=int, default=100)
+    parser.add_argument("--max-batch", type=int, default=500)
+    parser.add_argument("--max-delay", type=float, default=0.005)
+    parser.add_argument("--output", help="write the JSON results here")
+    args = parser.parse_args(argv)
+
+    # Lock errors are expected in the direct run and counted; don't flood the terminal
+    logging.getLogger("lib").setLevel(logging.CRITICAL)
+    spec = DatasetSpec(args.articles)
+    database = os.path.join(tempfile.gettempdir(), f"articles-write-queue-{args.articles}.db")
+    ensure_dataset(database, spec)
+    previous = db.DATABASE_NAME
+    db.DATABASE_NAME = database
+    # Enough connections that every direct-writing thread gets its own
+    db.configure_pool(size=args.threads)
+    try:
+        results = {'direct': measure(args.threads, args.per_thread, spec.authors, spec.magazines)}
+        queue = start_write_queue(args.max_batch, args.max_delay)
+        try:
+            results['queued'] = measure(args.threads, args.per_thread, spec.authors, spec.magazines)
+            results['queued']['queue'] = queue.stats()
+        finally:
+            stop_write_queue()
+    finally:
+        db.DATABASE_NAME = previous
+        db.configure_pool()
+
+    for label in ('direct', 'queued'):
+        r = results[label]
+        print(f"{label:<7} {r['writes_per_second']:>9.0f} writes/s  errors {r['errors']}")
+    queue_stats = results['queued']['queue']
+    print(f"queued in {queue_stats['batches']} batches (largest {queue_stats['largest_batch']})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'dataset': spec.as_dict(), 'threads': args.threads, **results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
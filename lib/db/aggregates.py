@@ -0,0 +1,199 @@
+# ARTICLES/lib/db/aggregates.py
+"""Trigger-maintained summary tables behind the aggregate classmethods.
+
+* ``author_stats``           articles per author (Author.top_author)
+* ``magazine_stats``         articles and distinct authors per magazine
+                             (Magazine.article_counts, with_multiple_authors)
+* ``magazine_author_stats``  articles per (magazine, author) pair, which is
+                             what lets the distinct-author count be kept
+                             incrementally
+
+Triggers on ``articles`` update them on every insert, delete and move
+between authors/magazines. ``python -m lib.db.aggregates --check`` compares
+them with a full recount and ``--rebuild`` recomputes them from scratch.
+"""
+import argparse
+import sqlite3
+
+AGGREGATE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS author_stats (
+        author_id INTEGER PRIMARY KEY,
+        article_count INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS magazine_stats (
+        magazine_id INTEGER PRIMARY KEY,
+        article_count INTEGER NOT NULL,
+        author_count INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS magazine_author_stats (
+        magazine_id INTEGER NOT NULL,
+        author_id INTEGER NOT NULL,
+        article_count INTEGER NOT NULL,
+        PRIMARY KEY (magazine_id, author_id)
+    ) WITHOUT ROWID
+    """,
+    # top_author reads the first entry of this index
+    "CREATE INDEX IF NOT EXISTS idx_author_stats_count ON author_stats (article_count DESC, author_id)",
+    # with_multiple_authors seeks author_count > 1
+    "CREATE INDEX IF NOT EXISTS idx_magazine_stats_author_count ON magazine_stats (author_count)",
+]
+
+
+def _count_article(row):
+    """Trigger statements adding one article (``row`` is "new") to the summaries."""
+    return f"""
+        INSERT INTO author_stats (author_id, article_count)
+        SELECT {row}.author_id, 1 WHERE {row}.author_id IS NOT NULL
+        ON CONFLICT (author_id) DO UPDATE SET article_count = article_count + 1;
+
+        INSERT INTO magazine_author_stats (magazine_id, author_id, article_count)
+        SELECT {row}.magazine_id, {row}.author_id, 1
+        WHERE {row}.magazine_id IS NOT NULL AND {row}.author_id IS NOT NULL
+        ON CONFLICT (magazine_id, author_id) DO UPDATE SET article_count = article_count + 1;
+
+        INSERT INTO magazine_stats (magazine_id, article_count, author_count)
+        SELECT {row}.magazine_id, 1, {row}.author_id IS NOT NULL WHERE {row}.magazine_id IS NOT NULL
+        ON CONFLICT (magazine_id) DO UPDATE SET
+            article_count = article_count + 1,
+            author_count = author_count + COALESCE((
+                SELECT article_count = 1 FROM magazine_author_stats
+                WHERE magazine_id = {row}.magazine_id AND author_id = {row}.author_id
+            ), 0);
+    """
+
+
+def _uncount_article(row):
+    """Trigger statements removing one article (``row`` is "old") from the summaries."""
+    return f"""
+        UPDATE author_stats SET article_count = article_count - 1 WHERE author_id = {row}.author_id;
+        DELETE FROM author_stats WHERE author_id = {row}.author_id AND article_count <= 0;
+
+        UPDATE magazine_author_stats SET article_count = article_count - 1
+        WHERE magazine_id = {row}.magazine_id AND author_id = {row}.author_id;
+
+        UPDATE magazine_stats SET
+            article_count = article_count - 1,
+            author_count = author_count - COALESCE((
+                SELECT article_count = 0 FROM magazine_author_stats
+                WHERE magazine_id = {row}.magazine_id AND author_id = {row}.author_id
+            ), 0)
+        WHERE magazine_id = {row}.magazine_id;
+
+        DELETE FROM magazine_author_stats
+        WHERE magazine_id = {row}.magazine_id AND author_id = {row}.author_id AND article_count <= 0;
+        DELETE FROM magazine_stats WHERE magazine_id = {row}.magazine_id AND article_count <= 0;
+    """
+
+
+AGGREGATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS articles_stats_insert AFTER INSERT ON articles BEGIN
+        {_count_article('new')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS articles_stats_delete AFTER DELETE ON articles BEGIN
+        {_uncount_article('old')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS articles_stats_update AFTER UPDATE OF author_id, magazine_id ON articles
+    WHEN old.author_id IS NOT new.author_id OR old.magazine_id IS NOT new.magazine_id BEGIN
+        {_uncount_article('old')}
+        {_count_article('new')}
+    END
+    """,
+]
+
+# The same numbers computed the slow way, straight from articles
+EXPECTED = {
+    'author_stats': """
+        SELECT author_id, COUNT(*) FROM articles
+        WHERE author_id IS NOT NULL GROUP BY author_id
+    """,
+    'magazine_stats': """
+        SELECT magazine_id, COUNT(*), COUNT(DISTINCT author_id) FROM articles
+        WHERE magazine_id IS NOT NULL GROUP BY magazine_id
+    """,
+    'magazine_author_stats': """
+        SELECT magazine_id, author_id, COUNT(*) FROM articles
+        WHERE magazine_id IS NOT NULL AND author_id IS NOT NULL GROUP BY magazine_id, author_id
+    """,
+}
+STORED = {
+    'author_stats': "SELECT author_id, article_count FROM author_stats",
+    'magazine_stats': "SELECT magazine_id, article_count, author_count FROM magazine_stats",
+    'magazine_author_stats': "SELECT magazine_id, author_id, article_count FROM magazine_author_stats",
+}
+
+
+def create_aggregates(conn):
+    """Migration step: create the summary tables and triggers, then fill them."""
+    for statement in AGGREGATE_SCHEMA + AGGREGATE_TRIGGERS:
+        conn.execute(statement)
+    rebuild_aggregates(conn)
+
+
+def rebuild_aggregates(conn):
+    for table, query in EXPECTED.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {query}")
+
+
+def check_aggregates(conn):
+    """Compare the summary tables with a full recount.
+
+    Returns a dict of table -> number of rows that differ (missing, extra or
+    wrong counts); an empty dict means everything is consistent.
+    """
+    problems = {}
+    for table, expected in EXPECTED.items():
+        stored = STORED[table]
+        mismatched = conn.execute(f"""
+            SELECT (SELECT COUNT(*) FROM ({expected} EXCEPT {stored}))
+                 + (SELECT COUNT(*) FROM ({stored} EXCEPT {expected}))
+        """).fetchone()[0]
+        if mismatched:
+            problems[table] = mismatched
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check or rebuild the article summary tables.")
+    parser.add_argument("database", nargs="?", help="path to the SQLite file (default: articles.db)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--check", action="store_true", help="compare the summaries with a full recount")
+    group.add_argument("--rebuild", action="store_true", help="recompute the summaries from articles")
+    args = parser.parse_args(argv)
+
+    from .migrations import migrate
+    database = args.database
+    if database is None:
+        from .connection import DATABASE_NAME
+        database = DATABASE_NAME
+    migrate(database, verbose=True)
+    conn = sqlite3.connect(database, timeout=30.0)
+    try:
+        if args.rebuild:
+            with conn:
+                rebuild_aggregates(conn)
+            print("Rebuilt summary tables.")
+            return 0
+        problems = check_aggregates(conn)
+    finally:
+        conn.close()
+    if not problems:
+        print("Summary tables are consistent.")
+        return 0
+    for table, count in problems.items():
+        print(f"{table}: {count} mismatched rows")
+    return 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
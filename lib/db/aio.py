@@ -0,0 +1,190 @@
+# ARTICLES/lib/db/aio.py
+"""Run blocking model calls from asyncio code.
+
+A fixed set of worker threads each own one connection for their whole
+life, so concurrent awaits never queue on the shared pool and the event
+loop thread never touches sqlite3. Anything a job leaves uncommitted is
+rolled back before the next one starts. Cancelling the awaiting task either
+drops the job before it starts or interrupts the SQL it is running. If a
+worker can't get a connection (e.g. the database needs a migration), the
+executor is broken: queued and later jobs fail with that error.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+
+from . import connection as db
+
+DEFAULT_WORKERS = int(os.environ.get("ARTICLES_DB_ASYNC_WORKERS", "4"))
+
+
+class DatabaseExecutor:
+    def __init__(self, max_workers=DEFAULT_WORKERS, database=None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.database = database if database is not None else db.DATABASE_NAME
+        self._pool = db.ConnectionPool(self.database, size=max_workers)
+        self._jobs = queue.SimpleQueue()
+        self._threads = []
+        self._running = {}  # future -> connection executing it, for interrupt()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._broken = None  # the error that stopped a worker from connecting
+
+    def _worker(self):
+        while True:
+            try:
+                conn = self._pool.acquire()
+            except BaseException as e:
+                self._break(e)
+                return
+            if not self._serve(conn):
+                return
+
+    def _break(self, error):
+        """Fail every queued job with ``error``; submit() fails later ones the same way."""
+        with self._lock:
+            if self._broken is None:
+                self._broken = error
+        # submit() queues under the lock, so every job accepted before the break is queued by now
+        stops = 0
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                stops += 1
+            elif job[0].set_running_or_notify_cancel():
+                job[0].set_exception(self._broken)
+        # Shutdown sentinels are for the workers still serving
+        for _ in range(stops):
+            self._jobs.put(None)
+
+    def _serve(self, conn):
+        """Run jobs on ``conn`` until shutdown (False) or until it needs replacing (True)."""
+        try:
+            with db.bind_connection(conn):
+                while True:
+                    job = self._jobs.get()
+                    if job is None:
+                        return False
+                    future, context, fn, args, kwargs = job
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    with self._lock:
+                        self._running[future] = conn
+                    try:
+                        result = context.run(fn, *args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+                    finally:
+                        with self._lock:
+                            self._running.pop(future, None)
+                    # A failed write (e.g. asave() hitting a UNIQUE constraint) leaves its
+                    # transaction open, holding the write lock for every other writer
+                    if conn.in_transaction:
+                        try:
+                            conn.rollback()
+                        except sqlite3.Error:
+                            return True
+        finally:
+            # release() discards a connection that still can't be rolled back
+            self._pool.release(conn)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` for a worker thread; returns a concurrent Future.
+
+        The caller's contextvars (e.g. an identity_map_scope) are carried over.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("DatabaseExecutor has been shut down")
+            if self._broken is not None:
+                future.set_exception(self._broken)
+                return future
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._worker, name=f"articles-db-{len(self._threads)}", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._jobs.put((future, contextvars.copy_context(), fn, args, kwargs))
+        return future
+
+    def interrupt(self, future):
+        """Abort the SQL statement a running job is executing."""
+        with self._lock:
+            conn = self._running.get(future)
+            if conn is not None:
+                conn.interrupt()
+
+    async def run(self, fn, *args, **kwargs):
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                self.interrupt(future)
+            raise
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+        # Workers still finishing a job discard their connection on release
+        self._pool.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the shared executor, recreating it if DATABASE_NAME has been repointed or it broke."""
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor.database != db.DATABASE_NAME or _executor._broken is not None:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            db.get_pool()  # make sure migrations have run before workers connect
+            _executor = DatabaseExecutor()
+        return _executor
+
+
+def configure_executor(max_workers=DEFAULT_WORKERS):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        db.get_pool()
+        _executor = DatabaseExecutor(max_workers)
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+async def run_async(fn, *args, **kwargs):
+    """Await ``fn(*args, **kwargs)`` on a database worker thread."""
+    return await get_executor().run(fn, *args, **kwargs)
@@ -0,0 +1,179 @@
+# ARTICLES/lib/db/bulk.py
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from .connection import connection
+from .instrument import execute_many, fetch_all, fetch_one
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+# Bound on the parameters of one multi-row statement (as prefetch.MAX_IN_VARIABLES)
+MAX_VARIABLES = 500
+
+
+class BulkStats:
+    """Running totals for a bulk operation, including throughput."""
+
+    def __init__(self):
+        self.rows = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def add_chunk(self, rows):
+        self.rows += rows
+        self.chunks += 1
+        self.seconds = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'chunks': self.chunks,
+            'seconds': self.seconds,
+            'rows_per_second': self.rows_per_second,
+        }
+
+    def __repr__(self):
+        return f"<BulkStats rows={self.rows} chunks={self.chunks} rows/s={self.rows_per_second:.0f}>"
+
+
+def chunked(iterable, size):
+    """Yield lists of up to ``size`` items without materialising ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def chunk_transaction(conn):
+    """Commit one chunk, unless ``conn`` is already in a transaction (e.g. a Session's).
+
+    Then the chunk goes in a savepoint instead: a failed chunk is undone on
+    its own and nothing is committed before the transaction's owner says so.
+    """
+    if not conn.in_transaction:
+        with conn:
+            yield
+        return
+    conn.execute("SAVEPOINT bulk_chunk")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK TO bulk_chunk")
+        conn.execute("RELEASE bulk_chunk")
+        raise
+    conn.execute("RELEASE bulk_chunk")
+
+
+def bulk_insert(table, columns, objects, row_for, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """INSERT ``objects`` with executemany, committing once per chunk (see chunk_transaction()).
+
+    ``row_for(obj)`` returns the column values for one object. New ids are
+    written back onto the objects: inside a chunk's write transaction no
+    other connection can insert, so the chunk's rowids are the contiguous
+    range ending at last_insert_rowid(). ``progress``, if given, is called
+    with the BulkStats after every chunk.
+    """
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    stats = BulkStats()
+    try:
+        with connection() as conn:
+            for chunk in chunked(objects, chunk_size):
+                if any(obj.id is not None for obj in chunk):
+                    raise ValueError(f"bulk_create() got an already saved row for {table}; use bulk_update()")
+                with chunk_transaction(conn):
+                    execute_many(conn, f"{table}.bulk_insert", sql, [row_for(obj) for obj in chunk])
+                    last_id = fetch_one(conn, f"{table}.bulk_insert.last_id", "SELECT last_insert_rowid()")[0]
+                first_id = last_id - len(chunk) + 1
+                for offset, obj in enumerate(chunk):
+                    obj.id = first_id + offset
+                stats.add_chunk(len(chunk))
+                if progress:
+                    progress(stats)
+    except sqlite3.Error as e:
+        logger.error("Error bulk inserting into %s: %s", table, e)
+    return stats
+
+
+def bulk_update(table, columns, objects, row_for, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """UPDATE ``objects`` by id with executemany, committing once per chunk (see chunk_transaction()).
+
+    ``row_for(obj)`` returns the column values followed by the id.
+    """
+    assignments = ', '.join(f"{column} = ?" for column in columns)
+    sql = f"UPDATE {table} SET {assignments} WHERE id = ?"
+    stats = BulkStats()
+    try:
+        with connection() as conn:
+            for chunk in chunked(objects, chunk_size):
+                if any(obj.id is None for obj in chunk):
+                    raise ValueError(f"bulk_update() got an unsaved row for {table}; use bulk_create()")
+                with chunk_transaction(conn):
+                    execute_many(conn, f"{table}.bulk_update", sql, [row_for(obj) for obj in chunk])
+                stats.add_chunk(len(chunk))
+                if progress:
+                    progress(stats)
+    except sqlite3.Error as e:
+        logger.error("Error bulk updating %s: %s", table, e)
+    return stats
+
+
+def upsert_returning(conn, name, table, columns, rows, key="name", update=()):
+    """INSERT ``rows`` or find their existing rows by the unique ``key``; returns {key: id}.
+
+    Runs one multi-row ``INSERT ... ON CONFLICT (key) DO UPDATE ... RETURNING``
+    per chunk inside the caller's transaction, so a name that another
+    writer inserts at the same moment resolves to that writer's row rather
+    than failing or creating a duplicate. Columns in ``update`` are
+    overwritten on conflict; otherwise existing rows are left as they are
+    (the key is "updated" to itself so RETURNING reports them too).
+    """
+    key_index = columns.index(key)
+    # A key repeated in one statement would be upserted twice; the last row wins
+    rows = list({row[key_index]: row for row in rows}.values())
+    assignments = ", ".join(f"{column} = excluded.{column}" for column in (update or (key,)))
+    values = f"({', '.join('?' * len(columns))})"
+    ids = {}
+    for chunk in chunked(rows, max(1, MAX_VARIABLES // len(columns))):
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([values] * len(chunk))} "
+               f"ON CONFLICT ({key}) DO UPDATE SET {assignments} RETURNING {key}, id")
+        ids.update(fetch_all(conn, name, sql, [value for row in chunk for value in row], tuples=True))
+    return ids
+
+
+def bulk_upsert(table, columns, objects, row_for, key="name", update=(), saved=None,
+                chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Insert-or-find ``objects`` by ``key`` with upsert_returning(), committing once per chunk.
+
+    Every object gets the id of its row, whether it was inserted or already
+    there; ``saved(obj)``, if given, is called after that.
+    """
+    stats = BulkStats()
+    try:
+        with connection() as conn:
+            for chunk in chunked(objects, chunk_size):
+                with chunk_transaction(conn):
+                    ids = upsert_returning(
+                        conn, f"{table}.bulk_upsert", table, columns, [row_for(obj) for obj in chunk], key, update
+                    )
+                for obj in chunk:
+                    obj.id = ids[getattr(obj, key)]
+                    if saved:
+                        saved(obj)
+                stats.add_chunk(len(chunk))
+                if progress:
+                    progress(stats)
+    except sqlite3.Error as e:
+        logger.error("Error bulk upserting into %s: %s", table, e)
+    return stats
@@ -0,0 +1,199 @@
+# ARTICLES/lib/db/compression.py
+"""Optional transparent compression of articles.content.
+
+Content at least ``threshold`` bytes long is stored as a BLOB: one codec
+byte followed by the compressed UTF-8 text. Shorter content, and anything
+written while compression is off, stays plain TEXT, so both kinds can sit
+in the same table and the codec can be changed at any time. Article keeps
+the stored value and only decompresses when ``content`` is read.
+
+SQL sees the text through ``article_text(content)``, which every
+connection opened by this package registers. The full-text index reads
+from the ``articles_text`` view built on it, so search and snippets work
+on compressed rows too. No trigger in the schema calls the function, so
+other SQLite clients can still write articles.
+
+    ARTICLES_DB_COMPRESSION=zlib ARTICLES_DB_COMPRESSION_THRESHOLD=512 ...
+    python -m lib.db.compression --convert --codec zlib   # rewrite existing rows
+    python -m lib.db.compression --stats
+"""
+import argparse
+import bz2
+import lzma
+import os
+import sqlite3
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+DEFAULT_THRESHOLD = 1024
+CONVERT_BATCH_SIZE = 1000
+
+# name -> (codec byte, compress(bytes, level), decompress(bytes)); the byte is stored with
+# each value, so existing ids must never be reused for a different codec
+CODECS = {
+    'zlib': (1, lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+    'lzma': (2, lambda data, level: lzma.compress(data, preset=6 if level is None else level), lzma.decompress),
+    'bz2': (3, lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (
+        4,
+        lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+_DECOMPRESSORS = {codec_id: decompress for codec_id, _, decompress in CODECS.values()}
+
+_settings = {
+    'codec': os.environ.get("ARTICLES_DB_COMPRESSION") or None,
+    'threshold': int(os.environ.get("ARTICLES_DB_COMPRESSION_THRESHOLD", DEFAULT_THRESHOLD)),
+    'level': None,
+}
+
+
+def configure_compression(codec=None, threshold=DEFAULT_THRESHOLD, level=None):
+    """Compress content written from now on with ``codec`` (None turns compression off)."""
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}; available: {', '.join(sorted(CODECS))}")
+    _settings.update(codec=codec, threshold=threshold, level=level)
+
+
+def compression_settings():
+    return dict(_settings)
+
+
+def compress_content(text, codec=None, threshold=None):
+    """The value to store for ``text``: compressed bytes, or ``text`` unchanged.
+
+    Text is left alone when compression is off, when it is shorter than the
+    threshold, or when compressing it would not make it smaller.
+    """
+    codec = codec or _settings['codec']
+    if codec is None or not isinstance(text, str):
+        return text
+    threshold = _settings['threshold'] if threshold is None else threshold
+    data = text.encode("utf-8")
+    if len(data) < threshold:
+        return text
+    codec_id, compress, _ = CODECS[codec]
+    packed = bytes([codec_id]) + compress(data, _settings['level'])
+    return packed if len(packed) < len(data) else text
+
+
+def decompress_content(value):
+    """Inverse of compress_content(); plain text and None pass through."""
+    if not isinstance(value, (bytes, memoryview)):
+        return value
+    value = bytes(value)
+    try:
+        decompress = _DECOMPRESSORS[value[0]]
+    except (IndexError, KeyError):
+        raise ValueError(f"Unknown content codec byte {value[:1]!r}") from None
+    return decompress(value[1:]).decode("utf-8")
+
+
+def register_functions(conn, index=True):
+    """Make ``article_text(content)`` available on ``conn``.
+
+    With ``index``, compressed rows written through ``conn`` are also
+    full-text indexed (see lib/db/search.py); leave it off for read-only
+    connections. Changing ``PRAGMA temp_store`` afterwards undoes that.
+    """
+    conn.create_function("article_text", 1, decompress_content, deterministic=True)
+    if index:
+        from .search import install_compressed_triggers
+        install_compressed_triggers(conn)
+    return conn
+
+
+def convert(conn, codec=None, threshold=None, batch_size=CONVERT_BATCH_SIZE):
+    """Re-store every article's content with ``codec`` (None decompresses everything).
+
+    The text is unchanged, so the full-text update trigger is suspended
+    while the rows are rewritten. Must run inside a transaction the caller
+    has already begun (so the trigger swap is atomic); returns the number
+    of rows whose stored value changed.
+    """
+    from .search import COMPRESSED_UPDATE_TRIGGER, FTS_UPDATE_TRIGGER
+    conn.execute("DROP TRIGGER IF EXISTS articles_fts_update")
+    conn.execute("DROP TRIGGER IF EXISTS temp.articles_fts_update_compressed")
+    changed = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, content FROM articles WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for id, stored in rows:
+            text = decompress_content(stored)
+            value = compress_content(text, codec, threshold) if codec else text
+            if value != stored:
+                updates.append((value, id))
+        conn.executemany("UPDATE articles SET content = ? WHERE id = ?", updates)
+        changed += len(updates)
+        last_id = rows[-1][0]
+    conn.execute(FTS_UPDATE_TRIGGER)
+    conn.execute(COMPRESSED_UPDATE_TRIGGER)
+    return changed
+
+
+def convert_existing_content(conn):
+    """Migration step: compress existing rows if compression is configured."""
+    if _settings['codec'] is not None:
+        convert(conn, _settings['codec'])
+
+
+def content_stats(conn):
+    compressed, plain, stored_bytes = conn.execute("""
+        SELECT COALESCE(SUM(typeof(content) = 'blob'), 0), COALESCE(SUM(typeof(content) = 'text'), 0),
+               COALESCE(SUM(length(CAST(content AS BLOB))), 0)
+        FROM articles
+    """).fetchone()
+    return {'compressed_rows': compressed, 'plain_rows': plain, 'stored_bytes': stored_bytes}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress or decompress stored article content.")
+    parser.add_argument("database", nargs="?", help="path to the SQLite file (default: articles.db)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--convert", action="store_true", help="re-store content with --codec")
+    group.add_argument("--decompress", action="store_true", help="store all content as plain text")
+    group.add_argument("--stats", action="store_true", help="show how content is stored")
+    parser.add_argument("--codec", choices=sorted(CODECS), default=_settings['codec'] or 'zlib')
+    parser.add_argument("--threshold", type=int, default=_settings['threshold'])
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to give the space back")
+    args = parser.parse_args(argv)
+
+    from .migrations import migrate
+    database = args.database
+    if database is None:
+        from .connection import DATABASE_NAME
+        database = DATABASE_NAME
+    migrate(database, verbose=True)
+    # Autocommit mode so the trigger swap in convert() is inside our own transaction
+    conn = register_functions(sqlite3.connect(database, timeout=30.0, isolation_level=None))
+    try:
+        if not args.stats:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                changed = convert(conn, None if args.decompress else args.codec, args.threshold)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"Rewrote {changed} rows.")
+            if args.vacuum:
+                conn.execute("VACUUM")
+        print(content_stats(conn))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,6 +1,16 @@
 # ARTICLES/lib/db/connection.py
+import logging
 import sqlite3
 import os
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager, nullcontext
+
+from .compression import register_functions
+from .instrument import ACQUIRE, record
+
+logger = logging.getLogger(__name__)
 
 # Get the absolute path of the directory containing connection.py
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,22 +20,548 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.join(current_dir, '..', '..')
 
 # Define the full path to articles.db, assuming it's in the ARTICLES/ root
-DATABASE_NAME = os.path.join(project_root, "articles.db")
+DEFAULT_DATABASE = os.path.join(project_root, "articles.db")
+# Repointed by use_database(); may also be an in-memory database's "file:" URI
+DATABASE_NAME = DEFAULT_DATABASE
+# use_database() target that stands for a new in-memory database
+MEMORY = ":memory:"
+
+logger.debug("DATABASE_NAME (absolute path) = %s", DATABASE_NAME)
+
+# Pool defaults, overridable from the environment or via configure_pool()
+DEFAULT_POOL_SIZE = int(os.environ.get("ARTICLES_DB_POOL_SIZE", "5"))
+DEFAULT_POOL_TIMEOUT = float(os.environ.get("ARTICLES_DB_POOL_TIMEOUT", "5.0"))
+# Idle connections older than this (seconds) get a "SELECT 1" before reuse
+HEALTH_CHECK_INTERVAL = 30.0
+# Read-only connections are cheap under WAL, so the reader pool is larger
+DEFAULT_READ_POOL_SIZE = int(os.environ.get("ARTICLES_DB_READ_POOL_SIZE", "8"))
+# Bring the database up to the latest schema version when the shared pool opens it
+AUTO_MIGRATE = os.environ.get("ARTICLES_DB_AUTO_MIGRATE", "1") != "0"
+
+JOURNAL_MODES = {"delete", "truncate", "persist", "memory", "wal", "off"}
+SYNCHRONOUS_LEVELS = {"off", "normal", "full", "extra"}
+TEMP_STORES = {"default", "file", "memory"}
+
+
+class ConnectionProfile:
+    """PRAGMA settings applied to every pooled connection.
+
+    The default is WAL with ``synchronous=NORMAL``: readers never block the
+    writer or each other, and a commit costs one fsync of the log rather
+    than two of the main file. ``cache_size`` follows SQLite's convention
+    (negative means KiB), ``mmap_size`` is in bytes and ``busy_timeout`` in
+    seconds. ``journal_mode`` is persistent in the database file, so it is
+    only set from read-write connections.
+    """
+
+    def __init__(self, journal_mode="wal", synchronous="normal", cache_size=-16000,
+                 mmap_size=256 * 1024 * 1024, temp_store="memory", busy_timeout=5.0):
+        if journal_mode.lower() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal_mode {journal_mode!r}")
+        if synchronous.lower() not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Unknown synchronous level {synchronous!r}")
+        if temp_store.lower() not in TEMP_STORES:
+            raise ValueError(f"Unknown temp_store {temp_store!r}")
+        self.journal_mode = journal_mode.lower()
+        self.synchronous = synchronous.lower()
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.temp_store = temp_store.lower()
+        self.busy_timeout = float(busy_timeout)
+
+    @classmethod
+    def from_env(cls):
+        """The default profile with any ``ARTICLES_DB_<SETTING>`` overrides applied."""
+        defaults = cls()
+        env = os.environ.get
+        return cls(
+            journal_mode=env("ARTICLES_DB_JOURNAL_MODE", defaults.journal_mode),
+            synchronous=env("ARTICLES_DB_SYNCHRONOUS", defaults.synchronous),
+            cache_size=env("ARTICLES_DB_CACHE_SIZE", defaults.cache_size),
+            mmap_size=env("ARTICLES_DB_MMAP_SIZE", defaults.mmap_size),
+            temp_store=env("ARTICLES_DB_TEMP_STORE", defaults.temp_store),
+            busy_timeout=env("ARTICLES_DB_BUSY_TIMEOUT", defaults.busy_timeout),
+        )
+
+    def connect(self, database, read_only=False):
+        conn = connect(database, timeout=self.busy_timeout, check_same_thread=False)
+        self.apply(conn, read_only)
+        # After apply(): setting temp_store drops the connection's TEMP triggers
+        register_functions(conn, index=not read_only)
+        return conn
+
+    def apply(self, conn, read_only=False):
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        if not read_only:
+            try:
+                conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            except sqlite3.OperationalError as e:
+                # Switching modes needs a moment of exclusive access; keep the current mode
+                logger.warning("Could not set journal_mode=%s on %s: %s", self.journal_mode, _database_of(conn), e)
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA cache_size = {self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        conn.execute(f"PRAGMA temp_store = {self.temp_store}")
+        # Read-only role: any INSERT/UPDATE/DELETE/DDL fails with "attempt to write a readonly database"
+        conn.execute(f"PRAGMA query_only = {int(read_only)}")
+
+    def as_dict(self):
+        return {
+            'journal_mode': self.journal_mode,
+            'synchronous': self.synchronous,
+            'cache_size': self.cache_size,
+            'mmap_size': self.mmap_size,
+            'temp_store': self.temp_store,
+            'busy_timeout': self.busy_timeout,
+        }
+
+    def __repr__(self):
+        return f"<ConnectionProfile {self.as_dict()}>"
+
+
+# The pre-WAL behaviour, kept for comparison in benchmarks.concurrency
+ROLLBACK_PROFILE = ConnectionProfile(journal_mode="delete", synchronous="full", cache_size=-2000,
+                                     mmap_size=0, temp_store="default")
+
+_profile = ConnectionProfile.from_env()
+
+
+def connect(database, **kwargs):
+    """sqlite3.connect() that also accepts the ``file:`` URIs of memory_database()."""
+    return sqlite3.connect(database, uri=database.startswith("file:"), **kwargs)
+
+
+def _database_of(conn):
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return row[2] if row else None
+
+
+class ConnectionPool:
+    """A bounded, thread-aware pool of reusable sqlite3 connections.
+
+    Use ``with pool.connection() as conn:`` to check a connection out.
+    Nested checkouts on the same thread reuse the connection that thread
+    already holds, so a model method calling another model method does
+    not take a second slot from the pool. Every connection is configured
+    by ``profile``; a ``read_only`` pool hands out connections that refuse
+    writes.
+    """
+
+    def __init__(self, database=None, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, profile=None, read_only=False):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.database = database if database is not None else DATABASE_NAME
+        self.profile = profile if profile is not None else _profile
+        self.read_only = read_only
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []  # LIFO stack of (conn, last_used) so warm connections get reused first
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._open = 0
+        self._closed = False
+        self._counters = {
+            'created': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'discarded': 0,
+        }
+
+    def _connect(self):
+        conn = self.profile.connect(self.database, self.read_only)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._open -= 1
+        self._counters['discarded'] += 1
+        self._cond.notify()
+
+    def acquire(self):
+        """Check a connection out of the pool, waiting up to ``timeout`` seconds."""
+        started = time.perf_counter()
+        try:
+            conn = self._acquire()
+        except sqlite3.Error:
+            record(ACQUIRE, time.perf_counter() - started, error=True)
+            raise
+        record(ACQUIRE, time.perf_counter() - started)
+        return conn
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.OperationalError("Connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+                        self._counters['health_check_failures'] += 1
+                        self._discard(conn)
+                        continue
+                    self._counters['checkouts'] += 1
+                    self._counters['reused'] += 1
+                    return conn
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise sqlite3.OperationalError(
+                        f"Timed out after {self.timeout}s waiting for a pooled connection to {self.database}"
+                    )
+                self._counters['waits'] += 1
+                self._cond.wait(remaining)
+        # Open the new connection outside the lock
+        try:
+            conn = self._connect()
+        except sqlite3.Error:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters['created'] += 1
+            self._counters['checkouts'] += 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool. Uncommitted work is rolled back."""
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            healthy = False
+        with self._cond:
+            if self._closed or not healthy:
+                self._discard(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        held = self.held()
+        if held is not None:
+            yield held
+            return
+        conn = self.acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self.release(conn)
+
+    def held(self):
+        """The connection this thread currently has checked out via connection(), if any."""
+        return getattr(self._local, 'conn', None)
+
+    @contextmanager
+    def dedicated_connection(self):
+        """Check out a connection that is not shared with nested checkouts.
+
+        Used by streaming generators, which may stay suspended while the same
+        thread runs other queries; the connection goes back to the pool when
+        the generator finishes or is closed.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def health_check(self):
+        """Ping every idle connection, dropping the ones that fail. Returns the number dropped."""
+        dropped = 0
+        with self._cond:
+            survivors = []
+            for conn, _ in self._idle:
+                if self._is_healthy(conn):
+                    survivors.append((conn, time.monotonic()))
+                else:
+                    self._counters['health_check_failures'] += 1
+                    self._discard(conn)
+                    dropped += 1
+            self._idle = survivors
+        return dropped
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(
+                database=self.database,
+                size=self.size,
+                open=self._open,
+                idle=len(self._idle),
+                in_use=self._open - len(self._idle),
+                closed=self._closed,
+                read_only=self.read_only,
+            )
+        return stats
+
+    def close(self):
+        """Close idle connections; connections still checked out are closed on release."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+
+_pool = None
+_read_pool = None
+_read_pool_size = DEFAULT_READ_POOL_SIZE
+_pool_lock = threading.Lock()
+# Connection pinned to the current thread by bind_connection(), if any
+_bound = threading.local()
+
+
+def _open_pool(*args):
+    if AUTO_MIGRATE:
+        from .migrations import DuplicateNamesError, MigrationRequiredError, migrate
+        try:
+            migrate(DATABASE_NAME)
+        except DuplicateNamesError as e:
+            raise MigrationRequiredError(f"Can't open {DATABASE_NAME}: {e}") from e
+    return ConnectionPool(DATABASE_NAME, *args)
+
+
+def _close_pools():
+    global _pool, _read_pool
+    for pool in (_pool, _read_pool):
+        if pool is not None:
+            pool.close()
+    _pool = _read_pool = None
+
+
+def get_pool():
+    """Return the shared read-write pool, recreating it if DATABASE_NAME has been repointed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != DATABASE_NAME:
+            _close_pools()
+            _pool = _open_pool()
+        return _pool
+
+
+def get_read_pool():
+    """Return the shared read-only pool.
+
+    It is opened after the read-write pool, so migrations have run and the
+    journal mode is set before the first reader connects, and it follows
+    that pool's timeout and profile.
+    """
+    global _read_pool
+    pool = get_pool()
+    with _pool_lock:
+        if _read_pool is None or _read_pool.database != pool.database or _read_pool.profile is not pool.profile:
+            if _read_pool is not None:
+                _read_pool.close()
+            _read_pool = ConnectionPool(pool.database, _read_pool_size, pool.timeout, pool.health_check_interval,
+                                        profile=pool.profile, read_only=True)
+        return _read_pool
+
+
+def configure_pool(size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                   health_check_interval=HEALTH_CHECK_INTERVAL, read_size=DEFAULT_READ_POOL_SIZE):
+    """Replace the shared pools with ones using the given settings."""
+    global _pool, _read_pool_size
+    with _pool_lock:
+        _close_pools()
+        _read_pool_size = read_size
+        _pool = _open_pool(size, timeout, health_check_interval)
+        return _pool
+
+
+def get_profile():
+    return _profile
+
+
+def configure_profile(profile):
+    """Use ``profile`` for every connection the shared pools open from now on.
+
+    The pools are reopened (keeping their sizes) so the new settings apply
+    straight away; the read-write pool's first connection sets the journal
+    mode on the file.
+    """
+    global _profile, _pool
+    with _pool_lock:
+        settings = (_pool.size, _pool.timeout, _pool.health_check_interval) if _pool is not None else ()
+        _profile = profile
+        _close_pools()
+        _pool = _open_pool(*settings)
+        with _pool.connection():
+            pass
+        return _pool
+
+
+def connection():
+    """Context manager yielding a pooled read-write connection: ``with connection() as conn:``."""
+    bound = getattr(_bound, 'conn', None)
+    if bound is not None:
+        return nullcontext(bound)
+    return get_pool().connection()
+
+
+def read_connection():
+    """Context manager yielding a pooled read-only connection.
+
+    Finders and other reads use this so they can run alongside a writer.
+    A thread that already holds a read-write connection (or has one bound)
+    keeps using it, so it reads its own uncommitted writes.
+    """
+    bound = getattr(_bound, 'conn', None)
+    if bound is not None:
+        return nullcontext(bound)
+    held = get_pool().held()
+    if held is not None:
+        return nullcontext(held)
+    return get_read_pool().connection()
+
+
+def reads_own_writes():
+    """True if reads on this thread could see writes that aren't committed yet.
+
+    That is the case when the connection a Session, bind_connection() or an
+    open connection() block gives this thread is inside a transaction. A
+    bound connection between transactions (e.g. an async worker's) reads
+    only committed data, like any other.
+    """
+    conn = getattr(_bound, 'conn', None)
+    if conn is None:
+        pool = _pool
+        conn = None if pool is None else pool.held()
+    return conn is not None and conn.in_transaction
+
+
+@contextmanager
+def bind_connection(conn):
+    """Route every connection() call on this thread to ``conn`` until the block exits.
+
+    Used by worker threads that own a long-lived connection of their own.
+    """
+    previous = getattr(_bound, 'conn', None)
+    _bound.conn = conn
+    try:
+        yield conn
+    finally:
+        _bound.conn = previous
+
+
+def dedicated_connection(read_only=False):
+    pool = get_read_pool() if read_only else get_pool()
+    return pool.dedicated_connection()
+
+
+def pool_stats(read_only=False):
+    pool = get_read_pool() if read_only else get_pool()
+    return pool.stats()
+
+
+# Connections keeping each in-memory database alive, keyed by URI: one
+# disappears when its last connection closes
+_memory_databases = {}
+_memory_lock = threading.Lock()
+
+
+def memory_database():
+    """Create an empty in-memory database; returns the URI to connect to it with.
+
+    All connections to the URI in this process share the one database
+    through SQLite's memdb VFS. It has no WAL, but it locks like a rollback
+    journal and honours busy_timeout: a reader overlapping a commit waits
+    for it instead of failing, as it would with shared cache. It lives
+    until release_database().
+    """
+    # The leading "/" makes memdb share the database between connections
+    uri = f"file:/articles-{uuid.uuid4().hex}?vfs=memdb"
+    with _memory_lock:
+        _memory_databases[uri] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    return uri
+
+
+def clone_database(template, target=MEMORY):
+    """Copy the database file ``template`` to ``target`` with SQLite's backup API.
+
+    ``target`` is MEMORY (the default) for a new in-memory database or the
+    path of a file that doesn't exist yet. Returns the name to connect to,
+    e.g. for use_database(). Copying pages is much faster than building
+    and seeding a database, so one migrated, seeded template can give every
+    test or worker an isolated copy.
+    """
+    if not os.path.exists(template):
+        raise FileNotFoundError(f"No template database at {template}")
+    if target == MEMORY:
+        database = memory_database()
+    else:
+        database = os.path.abspath(target)
+        if os.path.exists(database) and os.path.getsize(database) > 0:
+            raise FileExistsError(f"Refusing to overwrite {database} with a copy of {template}")
+    with closing(sqlite3.connect(template)) as source, closing(connect(database)) as copy:
+        source.backup(copy)
+    return database
+
+
+def release_database(database):
+    """Let an in-memory database from memory_database() go once its remaining connections close."""
+    with _memory_lock:
+        keeper = _memory_databases.pop(database, None)
+    if keeper is not None:
+        keeper.close()
+
+
+def use_database(target=None, template=None):
+    """Point DATABASE_NAME, and with it the shared pools, at another database.
+
+    ``target`` is a file path, MEMORY for a new in-memory database, or None
+    for the default articles.db. With ``template`` the target starts as a
+    copy of that file (see clone_database()); the target then defaults to
+    MEMORY. An in-memory database being switched away from is released.
+    Model instances loaded before the switch (e.g. in the identity map)
+    still describe the old database. Returns the new DATABASE_NAME.
+    """
+    global DATABASE_NAME
+    if template is not None:
+        database = clone_database(template, MEMORY if target is None else target)
+    elif target == MEMORY:
+        database = memory_database()
+    else:
+        database = DEFAULT_DATABASE if target is None else os.path.abspath(target)
+    with _pool_lock:
+        _close_pools()
+        previous, DATABASE_NAME = DATABASE_NAME, database
+    release_database(previous)
+    return database
 
-# --- THIS IS THE CRITICAL DEBUG PRINT. ENSURE IT'S THERE. ---
-print(f"DEBUG: DATABASE_NAME (absolute path) = {DATABASE_NAME}")
-# --- END CRITICAL DEBUG PRINT ---
 
 def get_connection():
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
+        conn = register_functions(connect(DATABASE_NAME))
         conn.row_factory = sqlite3.Row
         return conn
     except sqlite3.Error as e:
-        print(f"Database connection error: {e}")
-        # --- MAKE SURE THIS PRINT IS ALSO THERE ---
-        print(f"Attempted to connect to: {DATABASE_NAME}")
-        # --- END CHECK ---
+        logger.error("Database connection error: %s (attempted to connect to %s)", e, DATABASE_NAME)
         return None
 
 def close_connection(conn):
@@ -62,10 +598,18 @@ def create_tables():
                 )
             """)
             conn.commit()
-            print("Tables created successfully.")
+            from .migrations import migrate
+            migrate(DATABASE_NAME)
+            logger.info("Tables created successfully.")
         except sqlite3.Error as e:
-            print(f"Error creating tables: {e}")
+            logger.error("Error creating tables: %s", e)
         finally:
             close_connection(conn)
     else: # Added a message if connection failed
-        print("Skipping table creation: Database connection failed.")
\ No newline at end of file
+        logger.error("Skipping table creation: Database connection failed.")
+
+
+# ARTICLES_DB_TARGET=:memory: (or a path) and/or ARTICLES_DB_TEMPLATE=seeded.db
+# give a process, e.g. a test worker, its own database from the start
+if os.environ.get("ARTICLES_DB_TARGET") or os.environ.get("ARTICLES_DB_TEMPLATE"):
+    use_database(os.environ.get("ARTICLES_DB_TARGET") or None, os.environ.get("ARTICLES_DB_TEMPLATE") or None)
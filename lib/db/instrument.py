@@ -0,0 +1,259 @@
+# ARTICLES/lib/db/instrument.py
+"""Central execution hook for model SQL.
+
+Every model query runs through ``fetch_all`` / ``fetch_one`` / ``execute``
+/ ``execute_many`` under a name such as ``"Article.find_by_author_id"``.
+For each name we keep call and row counts, errors and a latency
+histogram; pool checkouts are recorded under ``"pool.acquire"``. Queries
+slower than the configured threshold are logged together with their
+EXPLAIN QUERY PLAN and kept in a short in-memory list.
+
+    from lib.db.instrument import configure_instrumentation, query_stats
+    configure_instrumentation(slow_query_ms=50)
+    print(query_stats()["Article.find_by_author_id"])
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(__name__ + ".slow")
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+
+ACQUIRE = "pool.acquire"
+
+
+class QueryStats:
+    __slots__ = ('count', 'errors', 'rows', 'total_ms', 'max_ms', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, ms, rows, error):
+        self.count += 1
+        self.rows += rows
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls."""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bound, hits in zip(BUCKETS_MS, self.buckets):
+            seen += hits
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'histogram': {
+                ('+Inf' if bound == float('inf') else bound): hits
+                for bound, hits in zip(BUCKETS_MS, self.buckets)
+            },
+        }
+
+
+_stats = {}
+_slow = deque(maxlen=100)
+_lock = threading.Lock()
+# Errors seen by this thread, counted even with instrumentation off (see thread_errors())
+_local = threading.local()
+# Statements seen while a capture_statements() block is active, else None
+_captured = None
+_settings = {
+    'enabled': True,
+    'slow_query_ms': 100.0,
+    'explain_slow_queries': True,
+}
+
+
+def configure_instrumentation(enabled=None, slow_query_ms=None, explain_slow_queries=None, slow_log_size=None):
+    """Change instrumentation settings; arguments left as None are unchanged.
+
+    ``slow_query_ms=None`` keeps the threshold; pass ``float('inf')`` to turn
+    the slow-query log off.
+    """
+    global _slow
+    with _lock:
+        if enabled is not None:
+            _settings['enabled'] = enabled
+        if slow_query_ms is not None:
+            _settings['slow_query_ms'] = slow_query_ms
+        if explain_slow_queries is not None:
+            _settings['explain_slow_queries'] = explain_slow_queries
+        if slow_log_size is not None:
+            _slow = deque(_slow, maxlen=slow_log_size)
+
+
+def record(name, seconds, rows=0, error=False, conn=None, sql=None, params=()):
+    """Record one call of ``name``; logs it if it crossed the slow-query threshold."""
+    if error:
+        _local.errors = getattr(_local, 'errors', 0) + 1
+    if not _settings['enabled']:
+        return
+    ms = seconds * 1000.0
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = QueryStats()
+        stats.add(ms, rows, error)
+    if sql is not None and ms >= _settings['slow_query_ms']:
+        _log_slow(name, ms, rows, conn, sql, params)
+
+
+def _log_slow(name, ms, rows, conn, sql, params):
+    plan = None
+    if conn is not None and _settings['explain_slow_queries']:
+        try:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        except Exception as e:  # the plan is best-effort; never fail the caller over it
+            plan = [f"<EXPLAIN failed: {e}>"]
+    entry = {
+        'name': name,
+        'ms': ms,
+        'rows': rows,
+        'sql': " ".join(sql.split()),
+        'plan': plan,
+        'at': time.time(),
+    }
+    with _lock:
+        _slow.append(entry)
+    slow_logger.warning("Slow query %s took %.1f ms (%d rows): %s | plan: %s",
+                        name, ms, rows, entry['sql'], "; ".join(plan or []))
+
+
+def thread_errors():
+    """Number of failed queries/checkouts recorded on this thread so far.
+
+    Model methods log database errors and return an empty result; callers
+    compare this before and after a call to tell that apart from a real one.
+    """
+    return getattr(_local, 'errors', 0)
+
+
+@contextmanager
+def capture_statements():
+    """Collect ``(name, sql, params)`` for every statement run in the block, on any thread.
+
+    Used by the query-plan auditor to find out what SQL the models issue.
+    """
+    global _captured
+    previous, _captured = _captured, []
+    try:
+        yield _captured
+    finally:
+        _captured = previous
+
+
+def capture(name, sql, params=()):
+    """Hand a statement to the active capture_statements() block, if there is one."""
+    captured = _captured
+    if captured is not None:
+        captured.append((name, sql, tuple(params)))
+
+
+def query_stats():
+    """Snapshot of per-name statistics, suitable for JSON export."""
+    with _lock:
+        return {name: stats.as_dict() for name, stats in _stats.items()}
+
+
+def slow_queries():
+    with _lock:
+        return list(_slow)
+
+
+def reset_query_stats():
+    with _lock:
+        _stats.clear()
+        _slow.clear()
+
+
+def _run(conn, name, sql, params, tuples, fetch):
+    capture(name, sql, params)
+    cursor = conn.cursor()
+    if tuples:
+        cursor.row_factory = None
+    started = time.perf_counter()
+    try:
+        cursor.execute(sql, params)
+        result = fetch(cursor)
+    except Exception:
+        record(name, time.perf_counter() - started, error=True)
+        logger.debug("Query %s failed", name, exc_info=True)
+        raise
+    finally:
+        cursor.close()
+    rows = len(result) if isinstance(result, list) else int(result is not None)
+    record(name, time.perf_counter() - started, rows, conn=conn, sql=sql, params=params)
+    return result
+
+
+def fetch_all(conn, name, sql, params=(), tuples=False):
+    """Run a SELECT and return all rows (plain tuples if ``tuples``)."""
+    return _run(conn, name, sql, params, tuples, lambda cursor: cursor.fetchall())
+
+
+def fetch_one(conn, name, sql, params=(), tuples=False):
+    """Run a SELECT and return its first row or None."""
+    return _run(conn, name, sql, params, tuples, lambda cursor: cursor.fetchone())
+
+
+def execute(conn, name, sql, params=()):
+    """Run a write statement; returns the cursor so callers can read lastrowid/rowcount."""
+    capture(name, sql, params)
+    started = time.perf_counter()
+    try:
+        cursor = conn.execute(sql, params)
+    except Exception:
+        record(name, time.perf_counter() - started, error=True)
+        logger.debug("Statement %s failed", name, exc_info=True)
+        raise
+    record(name, time.perf_counter() - started, max(cursor.rowcount, 0), conn=conn, sql=sql, params=params)
+    return cursor
+
+
+def execute_many(conn, name, sql, seq_of_params):
+    if _captured is not None:
+        # The first parameter set stands in for all of them
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            capture(name, sql, seq_of_params[0])
+    started = time.perf_counter()
+    try:
+        cursor = conn.executemany(sql, seq_of_params)
+    except Exception:
+        record(name, time.perf_counter() - started, error=True)
+        logger.debug("Statement %s failed", name, exc_info=True)
+        raise
+    # No EXPLAIN for executemany: there is no single parameter set to plan with
+    record(name, time.perf_counter() - started, max(cursor.rowcount, 0))
+    return cursor
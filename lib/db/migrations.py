@@ -0,0 +1,245 @@
+# ARTICLES/lib/db/migrations.py
+"""Versioned schema migrations.
+
+The applied version is stored in ``PRAGMA user_version``. Each migration
+runs in its own ``BEGIN IMMEDIATE`` transaction, so readers keep working
+while it is applied and two processes racing to migrate the same file
+cannot both apply a step. Run ``python -m lib.db.migrations`` to upgrade
+an existing articles.db in place.
+"""
+import argparse
+import sqlite3
+
+from .aggregates import create_aggregates
+from .compression import convert_existing_content, register_functions
+from .search import create_search_index, index_decompressed_text, replace_text_triggers
+
+
+class DuplicateNamesError(sqlite3.IntegrityError):
+    """Names can't be made unique while rows share them; the migration changed nothing."""
+
+
+class MigrationRequiredError(RuntimeError):
+    """The shared pool won't open a database whose pending migrations need a decision first.
+
+    Deliberately not an sqlite3.Error: the models log and swallow those, so
+    every finder would quietly return nothing.
+    """
+
+
+def duplicate_names(conn):
+    """``{table: [(name, [ids])]}`` for every name used by more than one author or magazine."""
+    found = {}
+    for table in ("authors", "magazines"):
+        rows = conn.execute(f"SELECT name, group_concat(id) FROM {table} "
+                            f"GROUP BY name HAVING COUNT(*) > 1 ORDER BY name").fetchall()
+        if rows:
+            found[table] = [(name, sorted(int(id) for id in ids.split(","))) for name, ids in rows]
+    return found
+
+
+def check_duplicate_names(conn, shown=10):
+    """Stop migration 7 with a report of the shared names, instead of deciding which rows win."""
+    groups = [(table, name, ids) for table, found in duplicate_names(conn).items() for name, ids in found]
+    if not groups:
+        return
+    listing = "; ".join(f"{table} {name!r} (ids {', '.join(map(str, ids))})" for table, name, ids in groups[:shown])
+    if len(groups) > shown:
+        listing += f"; and {len(groups) - shown} more"
+    raise DuplicateNamesError(
+        f"Author and magazine names must be unique before migration 7, but some are shared: {listing}. "
+        "Rename them, or run 'python -m lib.db.migrations --merge-duplicates' to fold each group into its lowest id."
+    )
+
+
+def merge_duplicate_names(conn):
+    """Fold authors/magazines sharing a name into the lowest id; returns what duplicate_names() found.
+
+    Articles of the dropped rows are moved to the kept one (the summary
+    triggers follow) and the dropped rows' other columns, such as a
+    magazine's category, are lost. Only run on request (``--merge-duplicates``).
+    """
+    found = duplicate_names(conn)
+    for table, fk in (("authors", "author_id"), ("magazines", "magazine_id")):
+        if table not in found:
+            continue
+        duplicates = f"SELECT id FROM {table} AS t WHERE id > (SELECT MIN(id) FROM {table} WHERE name = t.name)"
+        conn.execute(f"""
+            UPDATE articles SET {fk} = (
+                SELECT MIN(kept.id) FROM {table} AS kept
+                WHERE kept.name = (SELECT name FROM {table} WHERE id = articles.{fk})
+            )
+            WHERE {fk} IN ({duplicates})
+        """)
+        conn.execute(f"DELETE FROM {table} WHERE id IN ({duplicates})")
+    return found
+
+
+# (version, description, steps). A step is an SQL string or a callable(conn).
+MIGRATIONS = [
+    # The same tables as create_tables(), so a database gets one shape however it was made
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS articles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            author_id INTEGER NOT NULL,
+            magazine_id INTEGER NOT NULL,
+            FOREIGN KEY (author_id) REFERENCES authors(id),
+            FOREIGN KEY (magazine_id) REFERENCES magazines(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS authors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS magazines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL
+        )
+        """,
+    ]),
+    (2, "lookup and covering indexes", [
+        # Author.find_by_name / Magazine.find_by_name / find_by_category / Article.find_by_title
+        "CREATE INDEX IF NOT EXISTS idx_authors_name ON authors (name)",
+        "CREATE INDEX IF NOT EXISTS idx_magazines_name ON magazines (name)",
+        "CREATE INDEX IF NOT EXISTS idx_magazines_category ON magazines (category)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_title ON articles (title)",
+        # Article.find_by_author_id, and covering for Author.magazines / top_author
+        "CREATE INDEX IF NOT EXISTS idx_articles_author_magazine ON articles (author_id, magazine_id)",
+        # Article.find_by_magazine_id, and covering for contributing_authors / with_multiple_authors
+        "CREATE INDEX IF NOT EXISTS idx_articles_magazine_author ON articles (magazine_id, author_id)",
+    ]),
+    (3, "full-text search over article title and content", [create_search_index]),
+    (4, "keyset pagination indexes", [
+        # Single-column indexes carry the rowid, so "fk = ? AND id > ? ORDER BY id"
+        # is a pure index seek instead of a sort over every matching row
+        "CREATE INDEX IF NOT EXISTS idx_articles_author_id ON articles (author_id)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_magazine_id ON articles (magazine_id)",
+    ]),
+    (5, "trigger-maintained article summary tables", [create_aggregates]),
+    (6, "optional content compression", [index_decompressed_text, convert_existing_content]),
+    (7, "unique author and magazine names", [
+        check_duplicate_names,
+        # get_or_create / bulk_upsert resolve names with ON CONFLICT (name); the unique
+        # indexes also serve find_by_name, so the plain ones go
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_authors_name_unique ON authors (name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_magazines_name_unique ON magazines (name)",
+        "DROP INDEX IF EXISTS idx_authors_name",
+        "DROP INDEX IF EXISTS idx_magazines_name",
+    ]),
+    # Version 6 triggers called article_text(), so clients without it couldn't write articles
+    (8, "search triggers without application functions", [replace_text_triggers]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def migrate(database=None, target=None, verbose=False):
+    """Apply pending migrations to ``database`` (defaults to DATABASE_NAME).
+
+    Returns the list of versions that were applied.
+    """
+    from .connection import connect
+    if database is None:
+        from .connection import DATABASE_NAME
+        database = DATABASE_NAME
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    # isolation_level=None: we manage BEGIN/COMMIT ourselves so DDL is transactional
+    conn = connect(database, timeout=30.0, isolation_level=None)
+    register_functions(conn)
+    try:
+        for version, description, steps in MIGRATIONS:
+            if version > target or version <= current_version(conn):
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-check under the write lock in case another process got here first
+                if version <= current_version(conn):
+                    conn.execute("COMMIT")
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+            if verbose:
+                print(f"Applied migration {version}: {description}")
+        if applied:
+            # Refresh planner statistics for the new indexes
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply schema migrations to an articles database.")
+    parser.add_argument("database", nargs="?", help="path to the SQLite file (default: articles.db)")
+    parser.add_argument("--target", type=int, help="migrate up to this version only")
+    parser.add_argument("--status", action="store_true", help="show the current version and exit")
+    parser.add_argument("--merge-duplicates", action="store_true",
+                        help="before migration 7, fold authors/magazines sharing a name into the lowest id")
+    args = parser.parse_args(argv)
+
+    database = args.database
+    if database is None:
+        from .connection import DATABASE_NAME
+        database = DATABASE_NAME
+    if args.status:
+        conn = sqlite3.connect(database)
+        try:
+            version = current_version(conn)
+            pending = [str(m[0]) for m in pending_migrations(conn)]
+        finally:
+            conn.close()
+        print(f"{database}: schema version {version} (latest {LATEST_VERSION})")
+        print(f"Pending: {', '.join(pending) if pending else 'none'}")
+        return 0
+    applied = []
+    if args.merge_duplicates:
+        # The tables must exist; migration 7 itself then finds the names unique
+        applied += migrate(database, min(6, LATEST_VERSION if args.target is None else args.target), verbose=True)
+        conn = register_functions(sqlite3.connect(database, timeout=30.0, isolation_level=None))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                found = merge_duplicate_names(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        for table, groups in found.items():
+            for name, ids in groups:
+                print(f"Merged {table} {name!r}: kept id {ids[0]}, removed {', '.join(map(str, ids[1:]))}")
+    applied += migrate(database, args.target, verbose=True)
+    if not applied:
+        print(f"{database} is already up to date.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+# ARTICLES/lib/db/search.py
+"""FTS5 full-text index over articles.title and articles.content.
+
+``articles_fts`` is an external-content FTS5 table: it stores only the
+index and is kept in sync by triggers. Since schema version 6 it reads the
+text from the ``articles_text`` view, which decompresses content with
+``article_text()`` (see lib/db/compression.py). The schema's triggers only
+index plain-text rows; compressed rows are indexed by TEMP triggers that
+register_functions() adds to every connection this package opens. A
+compressed row written by any other SQLite client is left out of the index
+until ``--rebuild``.
+Run ``python -m lib.db.search --rebuild`` to re-index an existing file.
+"""
+import argparse
+import re
+import sqlite3
+
+from .compression import register_functions
+
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+        title, content, content='articles', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles BEGIN
+        INSERT INTO articles_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, content ON articles BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO articles_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+# Version 6: index the decompressed text, read from the articles_text view.
+# The triggers stored in the schema only index plain-text content, so any
+# SQLite client can write articles without article_text(); rows whose
+# content is compressed (a BLOB) are indexed by COMPRESSED_TEXT_TRIGGERS,
+# which this package adds to each of its own connections. The 'delete'
+# command needs the exact text that was indexed, so each side only removes
+# what it indexed.
+FTS_UPDATE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, content ON articles BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, content)
+        SELECT 'delete', old.id, old.title, old.content WHERE typeof(old.content) <> 'blob';
+        INSERT INTO articles_fts (rowid, title, content)
+        SELECT new.id, new.title, new.content WHERE typeof(new.content) <> 'blob';
+    END
+"""
+FTS_TEXT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles
+    WHEN typeof(new.content) <> 'blob' BEGIN
+        INSERT INTO articles_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles
+    WHEN typeof(old.content) <> 'blob' BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    FTS_UPDATE_TRIGGER,
+]
+FTS_TEXT_SCHEMA = [
+    "CREATE VIEW IF NOT EXISTS articles_text AS SELECT id, title, article_text(content) AS content FROM articles",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+        title, content, content='articles_text', content_rowid='id'
+    )
+    """,
+] + FTS_TEXT_TRIGGERS
+
+# Connection-local (TEMP) counterparts for compressed rows; they need article_text()
+COMPRESSED_UPDATE_TRIGGER = """
+    CREATE TEMP TRIGGER IF NOT EXISTS articles_fts_update_compressed
+    AFTER UPDATE OF title, content ON main.articles BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, content)
+        SELECT 'delete', old.id, old.title, article_text(old.content) WHERE typeof(old.content) = 'blob';
+        INSERT INTO articles_fts (rowid, title, content)
+        SELECT new.id, new.title, article_text(new.content) WHERE typeof(new.content) = 'blob';
+    END
+"""
+COMPRESSED_TEXT_TRIGGERS = [
+    """
+    CREATE TEMP TRIGGER IF NOT EXISTS articles_fts_insert_compressed AFTER INSERT ON main.articles
+    WHEN typeof(new.content) = 'blob' BEGIN
+        INSERT INTO articles_fts (rowid, title, content) VALUES (new.id, new.title, article_text(new.content));
+    END
+    """,
+    """
+    CREATE TEMP TRIGGER IF NOT EXISTS articles_fts_delete_compressed AFTER DELETE ON main.articles
+    WHEN typeof(old.content) = 'blob' BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, article_text(old.content));
+    END
+    """,
+    COMPRESSED_UPDATE_TRIGGER,
+]
+
+# Title matches count for more than body matches in bm25() ranking
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+
+def create_search_index(conn):
+    """Migration step: create the FTS table and triggers, then index existing rows."""
+    for statement in FTS_SCHEMA:
+        conn.execute(statement)
+    rebuild_search_index(conn)
+
+
+def index_decompressed_text(conn):
+    """Migration step: rebuild the FTS table on the articles_text view."""
+    for trigger in ("articles_fts_insert", "articles_fts_delete", "articles_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS articles_fts")
+    for statement in FTS_TEXT_SCHEMA:
+        conn.execute(statement)
+    rebuild_search_index(conn)
+
+
+def replace_text_triggers(conn):
+    """Migration step: swap the version 6 triggers, which called article_text(), for FTS_TEXT_TRIGGERS."""
+    for trigger in ("articles_fts_insert", "articles_fts_delete", "articles_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for statement in FTS_TEXT_TRIGGERS:
+        conn.execute(statement)
+
+
+def install_compressed_triggers(conn):
+    """Index compressed rows written through ``conn`` (see COMPRESSED_TEXT_TRIGGERS).
+
+    Does nothing before schema version 6, when there is no articles_text view.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'articles_text'").fetchone()
+    if exists is None:
+        return
+    for statement in COMPRESSED_TEXT_TRIGGERS:
+        conn.execute(statement)
+
+
+def rebuild_search_index(conn):
+    conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')")
+
+
+def to_match_query(text):
+    """Turn free text into an FTS5 query that ANDs each word as a literal term.
+
+    Quoting every word keeps punctuation such as ``-`` or ``:`` in user input
+    from being parsed as FTS5 operators.
+    """
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"' for word in words)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the article full-text search index.")
+    parser.add_argument("database", nargs="?", help="path to the SQLite file (default: articles.db)")
+    parser.add_argument("--rebuild", action="store_true", help="re-index every article")
+    args = parser.parse_args(argv)
+
+    from .migrations import migrate
+    database = args.database
+    if database is None:
+        from .connection import DATABASE_NAME
+        database = DATABASE_NAME
+    migrate(database, verbose=True)
+    if args.rebuild:
+        conn = register_functions(sqlite3.connect(database, timeout=30.0))
+        try:
+            with conn:
+                rebuild_search_index(conn)
+            count = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+        finally:
+            conn.close()
+        print(f"Rebuilt search index for {count} articles.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,13 +1,23 @@
 from lib.db.connection import get_connection
+from lib.db.migrations import migrate
 
 def seed_data():
+    migrate()
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.executescript(open("lib/db/schema.sql").read())
 
-    cursor.execute("INSERT INTO authors (name) VALUES (?)", ("Alice",))
-    cursor.execute("INSERT INTO magazines (name, category) VALUES (?, ?)", ("Tech Today", "Technology"))
-    cursor.execute("INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, ?)", ("AI Revolution", 1, 1))
+    # Names are unique, so re-running the seed reuses the existing rows
+    author_id = cursor.execute(
+        "INSERT INTO authors (name) VALUES (?) ON CONFLICT (name) DO UPDATE SET name = excluded.name RETURNING id",
+        ("Alice",)
+    ).fetchone()[0]
+    magazine_id = cursor.execute(
+        "INSERT INTO magazines (name, category) VALUES (?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET name = excluded.name RETURNING id",
+        ("Tech Today", "Technology")
+    ).fetchone()[0]
+    cursor.execute("INSERT INTO articles (title, content, author_id, magazine_id) VALUES (?, ?, ?, ?)",
+                   ("AI Revolution", "How AI is changing everything.", author_id, magazine_id))
 
     conn.commit()
     conn.close()
@@ -0,0 +1,340 @@
+# ARTICLES/lib/db/sharding.py
+"""Partition articles by magazine_id across several SQLite files.
+
+A sharded deployment is a catalog database plus N shard files. The
+catalog is DATABASE_NAME as usual: it keeps authors and magazines, and
+``article_shards``, which records the shard of every article and hands
+out article ids so they stay unique across shards. Each shard has the
+full schema but only holds the articles of magazines whose
+``magazine_id % N`` is its index, together with the summary tables its
+triggers maintain for them.
+
+    python -m lib.db.sharding split shard0.db shard1.db shard2.db   # move articles out of the catalog
+    configure_sharding(["shard0.db", "shard1.db", "shard2.db"])
+
+Lookups by article or magazine id go to one shard. Queries over every
+article (an author's articles and magazines, the aggregates) run once per
+shard in parallel on a process pool, and the model methods merge the
+results. Sessions, bulk writes, ingest/export, full-text search and the
+streaming finders still address a single database and raise
+RuntimeError while sharding is on.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .instrument import execute, fetch_all, fetch_one, record
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS article_shards (
+        article_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        shard INTEGER NOT NULL
+    )
+"""
+ARTICLE_COLUMNS = "id, title, content, author_id, magazine_id"
+
+# Connections kept open by each scatter worker process, keyed by database path
+_worker_connections = {}
+
+
+def _query_shard(database, sql, params):
+    """Run a read-only query in a scatter worker; returns the rows as tuples."""
+    conn = _worker_connections.get(database)
+    if conn is None:
+        from .connection import get_profile
+        conn = _worker_connections[database] = get_profile().connect(database, read_only=True)
+    return conn.execute(sql, params).fetchall()
+
+
+class ShardSet:
+    """The shard files of a sharded deployment and the pools and workers that serve them.
+
+    ``workers`` is the size of the scatter process pool (default: one per
+    shard, up to the CPU count); 0 runs scatter queries one after another
+    in the calling thread instead, which is cheaper for tiny shards.
+    """
+
+    def __init__(self, databases, workers=None, pool_size=None):
+        from .connection import DEFAULT_POOL_SIZE, DEFAULT_READ_POOL_SIZE, ConnectionPool
+        if not databases:
+            raise ValueError("At least one shard database is required")
+        self.databases = [os.path.abspath(database) for database in databases]
+        self.workers = min(len(self.databases), os.cpu_count() or 1) if workers is None else workers
+        self._pools = [ConnectionPool(database, pool_size or DEFAULT_POOL_SIZE) for database in self.databases]
+        self._read_pools = [
+            ConnectionPool(database, pool_size or DEFAULT_READ_POOL_SIZE, read_only=True)
+            for database in self.databases
+        ]
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.databases)
+
+    def shard_for(self, magazine_id):
+        """Index of the shard holding ``magazine_id``'s articles."""
+        if magazine_id is None:
+            raise ValueError("Articles need a magazine_id to be placed on a shard")
+        return int(magazine_id) % len(self.databases)
+
+    def connection(self, shard):
+        return self._pools[shard].connection()
+
+    def read_connection(self, shard):
+        return self._read_pools[shard].connection()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forked children would inherit this process's open connections and locks
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def scatter(self, name, sql, params=(), shards=None):
+        """Run ``sql`` on every shard (or the given shard indexes) in parallel.
+
+        Returns one list of row tuples per shard, in shard order. The time
+        until the last shard answers is recorded under ``name``.
+        """
+        shards = range(len(self.databases)) if shards is None else shards
+        params = tuple(params)
+        started = time.perf_counter()
+        try:
+            if self.workers:
+                executor = self._get_executor()
+                futures = [executor.submit(_query_shard, self.databases[shard], sql, params) for shard in shards]
+                results = [future.result() for future in futures]
+            else:
+                results = [_query_shard(self.databases[shard], sql, params) for shard in shards]
+        except sqlite3.Error:
+            record(name, time.perf_counter() - started, error=True)
+            raise
+        record(name, time.perf_counter() - started, rows=sum(len(rows) for rows in results))
+        return results
+
+    def scatter_rows(self, name, sql, params=(), shards=None):
+        """scatter() with the per-shard results concatenated."""
+        return [row for rows in self.scatter(name, sql, params, shards) for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        for pool in self._pools + self._read_pools:
+            pool.close()
+        for database in self.databases:
+            conn = _worker_connections.pop(database, None)
+            if conn is not None:
+                conn.close()
+
+
+_shards = None
+_shards_lock = threading.Lock()
+
+
+def ensure_directory(conn):
+    """Create the catalog's article_shards table.
+
+    New ids start above every article id in the catalog, so articles that
+    have not been split yet keep theirs.
+    """
+    conn.execute(DIRECTORY_SCHEMA)
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM articles").fetchone()[0]
+    if conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'article_shards'",
+                    (last_id,)).rowcount == 0:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('article_shards', ?)", (last_id,))
+    conn.commit()
+
+
+def configure_sharding(databases, workers=None, pool_size=None):
+    """Spread articles over ``databases`` from now on; None turns sharding off.
+
+    Each shard file is created and migrated if needed. Articles already in
+    the catalog are not moved; run ``split()`` (or the CLI) for that.
+    """
+    global _shards
+    from .connection import connection
+    from .migrations import migrate
+    with _shards_lock:
+        if _shards is not None:
+            _shards.close()
+            _shards = None
+        if databases is None:
+            return None
+        for database in databases:
+            migrate(database)
+        with connection() as conn:
+            ensure_directory(conn)
+        _shards = ShardSet(databases, workers, pool_size)
+        return _shards
+
+
+def get_shards():
+    """The active ShardSet, or None when articles live in the catalog database."""
+    return _shards
+
+
+def require_unsharded(operation):
+    if _shards is not None:
+        raise RuntimeError(f"{operation} does not support sharded storage yet")
+
+
+def read_connection_for(magazine_id):
+    """read_connection() for a query on one magazine's articles: its shard's, when sharded."""
+    from .connection import read_connection
+    if _shards is None:
+        return read_connection()
+    return _shards.read_connection(_shards.shard_for(magazine_id))
+
+
+def read_connection_for_article(article_id):
+    """read_connection() for a query on one article, routed through the catalog directory.
+
+    Articles the directory doesn't know are looked up in the catalog, where
+    they stay until split() moves them.
+    """
+    from .connection import read_connection
+    shard = None if _shards is None else shard_of_article(article_id)
+    if shard is None:
+        return read_connection()
+    return _shards.read_connection(shard)
+
+
+def fetch_all_sharded(name, sql, params=()):
+    """Rows of a query on the articles table, from every shard when sharded.
+
+    Shard results are merged in order of their first column, which must be
+    the article id.
+    """
+    from .connection import read_connection
+    if _shards is None:
+        with read_connection() as conn:
+            return fetch_all(conn, name, sql, params, tuples=True)
+    return sorted(_shards.scatter_rows(name, sql, params), key=lambda row: row[0])
+
+
+def shard_of_article(article_id):
+    from .connection import read_connection
+    with read_connection() as conn:
+        row = fetch_one(conn, "sharding.shard_of_article",
+                        "SELECT shard FROM article_shards WHERE article_id = ?", (article_id,), tuples=True)
+    return None if row is None else row[0]
+
+
+def allocate_article_id(shard):
+    """A new article id, unique across shards, recorded as living on ``shard``."""
+    from .connection import connection
+    with connection() as conn:
+        id = execute(conn, "sharding.allocate_article_id",
+                     "INSERT INTO article_shards (shard) VALUES (?)", (shard,)).lastrowid
+        conn.commit()
+    return id
+
+
+def release_article_id(article_id):
+    """Drop the directory entry of an id whose article never reached its shard."""
+    from .connection import connection
+    with connection() as conn:
+        execute(conn, "sharding.release_article_id", "DELETE FROM article_shards WHERE article_id = ?", (article_id,))
+        conn.commit()
+
+
+def move_article(article_id, shard):
+    """Record ``article_id`` as living on ``shard``; returns the shard it was on (or None)."""
+    from .connection import connection
+    with connection() as conn:
+        row = fetch_one(conn, "sharding.shard_of_article",
+                        "SELECT shard FROM article_shards WHERE article_id = ?", (article_id,), tuples=True)
+        if row is None or row[0] != shard:
+            execute(conn, "sharding.move_article",
+                    "INSERT INTO article_shards (article_id, shard) VALUES (?, ?) "
+                    "ON CONFLICT (article_id) DO UPDATE SET shard = excluded.shard", (article_id, shard))
+            conn.commit()
+    return None if row is None else row[0]
+
+
+def split(catalog, databases):
+    """Move every article of ``catalog`` onto the shard its magazine maps to.
+
+    Each shard is filled in its own transaction (the catalog copy of the
+    shard's articles is deleted in the same one), so an interrupted split
+    can simply be run again. Returns the number of articles moved per shard.
+    """
+    from .compression import register_functions
+    from .migrations import migrate
+    migrate(catalog)
+    moved = []
+    conn = register_functions(sqlite3.connect(catalog, timeout=30.0, isolation_level=None))
+    try:
+        ensure_directory(conn)
+        for index, database in enumerate(databases):
+            migrate(database)
+            conn.execute("ATTACH DATABASE ? AS shard", (database,))
+            try:
+                where = f"magazine_id % {len(databases)} = {index}"
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # The shard's own triggers only index plain text; index the compressed
+                    # rows about to be copied (see lib/db/search.py)
+                    conn.execute(f"INSERT INTO shard.articles_fts (rowid, title, content) "
+                                 f"SELECT id, title, article_text(content) FROM main.articles m "
+                                 f"WHERE {where} AND typeof(content) = 'blob' "
+                                 f"AND NOT EXISTS (SELECT 1 FROM shard.articles s WHERE s.id = m.id)")
+                    # An article saved to a shard since the last split is newer than its catalog copy
+                    conn.execute(f"INSERT OR IGNORE INTO shard.articles ({ARTICLE_COLUMNS}) "
+                                 f"SELECT {ARTICLE_COLUMNS} FROM main.articles WHERE {where}")
+                    conn.execute(f"INSERT OR IGNORE INTO main.article_shards (article_id, shard) "
+                                 f"SELECT id, {index} FROM main.articles WHERE {where}")
+                    moved.append(conn.execute(f"DELETE FROM main.articles WHERE {where}").rowcount)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                conn.execute("DETACH DATABASE shard")
+    finally:
+        conn.close()
+    return moved
+
+
+def shard_stats(databases):
+    stats = []
+    for database in databases:
+        conn = sqlite3.connect(database)
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+        finally:
+            conn.close()
+        stats.append({'database': database, 'articles': count, 'file_bytes': os.path.getsize(database)})
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split the catalog's articles across shard databases.")
+    parser.add_argument("command", choices=("split", "stats"))
+    parser.add_argument("shards", nargs="+", help="shard database files, in shard order")
+    parser.add_argument("--catalog", help="path to the catalog database (default: articles.db)")
+    args = parser.parse_args(argv)
+
+    if args.command == "split":
+        catalog = args.catalog
+        if catalog is None:
+            from .connection import DATABASE_NAME
+            catalog = DATABASE_NAME
+        for database, count in zip(args.shards, split(catalog, args.shards)):
+            print(f"Moved {count} articles to {database}")
+    for stats in shard_stats(args.shards):
+        print(stats)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,98 +1,450 @@
 # ARTICLES/lib/models/article.py
+import logging
 import sqlite3
-from ..db.connection import get_connection, close_connection
+from contextlib import closing
+from ..db.connection import connection, read_connection
+from ..db.instrument import execute, fetch_all, fetch_one
+from ..db.aio import run_async
+from ..db.bulk import DEFAULT_CHUNK_SIZE, bulk_insert, bulk_update
+from ..db.compression import compress_content, decompress_content
+from ..db.sharding import (
+    allocate_article_id, fetch_all_sharded, get_shards, move_article, read_connection_for,
+    read_connection_for_article, release_article_id, require_unsharded,
+)
+from ..db.search import CONTENT_WEIGHT, TITLE_WEIGHT, to_match_query
+from .deferred import from_projection, projection
+from .identity_map import forget, lookup, lookup_by, remember, refresh
+from .session import in_session, join_bulk
+from .write_queue import in_write_queue
+from .streaming import DEFAULT_BATCH_SIZE, iter_batches
+from .pagination import DEFAULT_PAGE_SIZE, decode_token, keyset_page
+
+logger = logging.getLogger(__name__)
 
 class Article:
+    # Compact instances: no per-object __dict__
+    # ``_content`` is the stored value (plain text or compressed bytes); ``_text``
+    # caches its decompressed form once ``content`` has been read. ``_batch`` is
+    # set on instances loaded with deferred columns (see lib/models/deferred.py).
+    __slots__ = ('id', 'title', '_content', '_text', 'author_id', 'magazine_id', '_author', '_magazine', '_batch')
+
+    # Column order expected by _from_tuples()
+    COLUMNS = "id, title, content, author_id, magazine_id"
+    # Session flush order (after authors and magazines) and identity-map lookup keys
+    FLUSH_ORDER = 1
+    LOOKUP_FIELDS = ('title',)
+    # Fields the list finders can leave out with only=/defer=, and the slot each is stored in
+    DEFERRABLE = ('title', 'content', 'author_id', 'magazine_id')
+    FIELD_SLOTS = {'content': '_content'}
+    SLOT_FIELDS = {slot: field for field, slot in FIELD_SLOTS.items()}
+
     def __init__(self, title, content, author_id, magazine_id, id=None): # id is now optional and last
         self.id = id
         self.title = title
         self.content = content
         self.author_id = author_id
         self.magazine_id = magazine_id
+        # Related objects attached by prefetch() or cached by author()/magazine()
+        self._author = None
+        self._magazine = None
+        self._batch = None
 
     @classmethod
-    def find_by_author_id(cls, author_id):
-        articles = []
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, title, content, author_id, magazine_id FROM articles WHERE author_id = ?", (author_id,))
-                rows = cursor.fetchall()
-                for row in rows:
-                    articles.append(cls(
-                        row['title'], row['content'], row['author_id'], row['magazine_id'], row['id'] # Pass id as the last argument
+    def _blank(cls):
+        """An instance with no columns set, for the deferred-column loader to fill in."""
+        article = cls.__new__(cls)
+        article._text = article._author = article._magazine = article._batch = None
+        return article
+
+    def __getattr__(self, name):
+        # Only reached when normal lookup fails, i.e. a deferred column not loaded yet,
+        # read by field name or by its slot (save() reads _content directly)
+        field = Article.SLOT_FIELDS.get(name, name)
+        if field in Article.DEFERRABLE and self._batch is not None:
+            self._batch.load(field)
+            return getattr(self, name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    @property
+    def content(self):
+        if self._text is None:
+            self._text = decompress_content(self._content)
+        return self._text
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._text = None
+
+    def _stored_content(self):
+        """The value to write for content: kept as loaded if untouched, else compressed per the settings."""
+        if isinstance(self._content, bytes):
+            return self._content
+        return compress_content(self._content)
+
+    @classmethod
+    def _from_row(cls, row):
+        return cls(row['title'], row['content'], row['author_id'], row['magazine_id'], row['id'])
+
+    @classmethod
+    def _from_tuples(cls, rows):
+        """Positional fast path: build articles from plain tuples in COLUMNS order."""
+        return [
+            cls(title, content, author_id, magazine_id, id)
+            for id, title, content, author_id, magazine_id in rows
+        ]
+
+    @classmethod
+    def _select(cls, only, defer):
+        """(column list SQL, projected columns or None) for the only=/defer= arguments."""
+        columns = projection(cls, only, defer)
+        return (cls.COLUMNS if columns is None else ", ".join(columns)), columns
+
+    @classmethod
+    def _build(cls, rows, columns):
+        if columns is None:
+            return cls._from_tuples(rows)
+        return from_projection(cls, "articles", columns, rows, "Article.load_deferred")
+
+    @classmethod
+    def find_by_id(cls, article_id):
+        article = lookup(cls, article_id)
+        if article is not None:
+            return article
+        try:
+            with read_connection_for_article(article_id) as conn:
+                row = fetch_one(
+                    conn, "Article.find_by_id",
+                    "SELECT id, title, content, author_id, magazine_id FROM articles WHERE id = ?", (article_id,)
+                )
+                if row:
+                    article = remember(cls(
+                        row['title'], row['content'], row['author_id'], row['magazine_id'], row['id']
                     ))
-            except sqlite3.Error as e:
-                print(f"Error finding articles by author ID: {e}")
-            finally:
-                close_connection(conn)
-        return articles
+        except sqlite3.Error as e:
+            logger.error("Error finding article by ID: %s", e)
+        return article
+
+    @classmethod
+    def find_by_author_id(cls, author_id, with_related=(), only=None, defer=()):
+        """An author's articles. ``only=("id", "title")`` or ``defer=("content",)`` leaves
+        columns out of the query; they load on first access, for the whole result at once.
+        """
+        select, columns = cls._select(only, defer)
+        articles = []
+        try:
+            # Sharded: every shard is queried in parallel and the rows merged in id order
+            rows = fetch_all_sharded(
+                "Article.find_by_author_id", f"SELECT {select} FROM articles WHERE author_id = ?", (author_id,)
+            )
+            articles = cls._build(rows, columns)
+        except sqlite3.Error as e:
+            logger.error("Error finding articles by author ID: %s", e)
+        return cls.prefetch(articles, *with_related)
 
     @classmethod
     def find_by_title(cls, title):
-        article = None
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, title, content, author_id, magazine_id FROM articles WHERE title = ?", (title,))
-                row = cursor.fetchone()
-                if row:
-                    article = cls(
-                        row['title'], row['content'], row['author_id'], row['magazine_id'], row['id'] # Pass id as the last argument
-                    )
-            except sqlite3.Error as e:
-                print(f"Error finding article by title: {e}")
-            finally:
-                close_connection(conn)
+        article = lookup_by(cls, 'title', title)
+        if article is not None:
+            return article
+        try:
+            rows = fetch_all_sharded(
+                "Article.find_by_title",
+                "SELECT id, title, content, author_id, magazine_id FROM articles WHERE title = ? ORDER BY id LIMIT 1",
+                (title,)
+            )
+            # Sorted by id across shards, so this is the lowest id with that title
+            if rows:
+                article = remember(cls._from_tuples(rows[:1])[0], 'title')
+        except sqlite3.Error as e:
+            logger.error("Error finding article by title: %s", e)
         return article
 
     @classmethod
-    def find_by_magazine_id(cls, magazine_id):
+    def find_by_magazine_id(cls, magazine_id, with_related=(), only=None, defer=()):
+        """A magazine's articles; ``only=`` / ``defer=`` work as in find_by_author_id()."""
+        select, columns = cls._select(only, defer)
         articles = []
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, title, content, author_id, magazine_id FROM articles WHERE magazine_id = ?", (magazine_id,))
-                rows = cursor.fetchall()
-                for row in rows:
-                    articles.append(cls(
-                        row['title'], row['content'], row['author_id'], row['magazine_id'], row['id'] # Pass id as the last argument
-                    ))
-            except sqlite3.Error as e:
-                print(f"Error finding articles by magazine ID: {e}")
-            finally:
-                close_connection(conn)
-        return articles
+        try:
+            with read_connection_for(magazine_id) as conn:
+                rows = fetch_all(
+                    conn, "Article.find_by_magazine_id",
+                    f"SELECT {select} FROM articles WHERE magazine_id = ?", (magazine_id,), tuples=True
+                )
+                articles = cls._build(rows, columns)
+        except sqlite3.Error as e:
+            logger.error("Error finding articles by magazine ID: %s", e)
+        return cls.prefetch(articles, *with_related)
+
+    @classmethod
+    def _page_by(cls, name, column, value, page_size, after, only=None, defer=()):
+        scope = f"articles:{column}:{value}"
+        last_id = decode_token(scope, after)
+        select, columns = cls._select(only, defer)
+        sql = f"SELECT {select} FROM articles WHERE {column} = ? AND id > ? ORDER BY id LIMIT ?"
+        params = (value, -1 if last_id is None else last_id, page_size + 1)
+        articles = []
+        try:
+            if column == 'magazine_id':
+                with read_connection_for(value) as conn:
+                    rows = fetch_all(conn, name, sql, params, tuples=True)
+            else:
+                # Each shard returns its first page_size + 1; the merged page is the lowest ids overall
+                rows = fetch_all_sharded(name, sql, params)[:page_size + 1]
+            articles = cls._build(rows, columns)
+        except sqlite3.Error as e:
+            logger.error("Error paging articles by %s: %s", column, e)
+        return keyset_page(articles, page_size, scope, lambda a: a.id)
+
+    @classmethod
+    def find_page_by_author_id(cls, author_id, page_size=DEFAULT_PAGE_SIZE, after=None, only=None, defer=()):
+        """One page of an author's articles in id order; pass ``page.next_token`` as ``after``."""
+        return cls._page_by("Article.find_page_by_author_id", 'author_id', author_id, page_size, after, only, defer)
+
+    @classmethod
+    def find_page_by_magazine_id(cls, magazine_id, page_size=DEFAULT_PAGE_SIZE, after=None, only=None, defer=()):
+        """One page of a magazine's articles in id order; pass ``page.next_token`` as ``after``."""
+        return cls._page_by(
+            "Article.find_page_by_magazine_id", 'magazine_id', magazine_id, page_size, after, only, defer
+        )
+
+    @classmethod
+    def search(cls, query, magazine_id=None, limit=20, offset=0, raw=False):
+        """Full-text search over title and content, best matches first.
+
+        Returns a list of dicts with the ``article``, its bm25 ``rank``
+        (lower is better) and a highlighted ``snippet`` of the content.
+        Free text is searched word by word; pass ``raw=True`` to use FTS5
+        query syntax (phrases, OR, NEAR, prefix*) directly.
+        """
+        require_unsharded("Article.search")
+        match = query if raw else to_match_query(query)
+        if not match:
+            return []
+        sql = f"""
+            SELECT articles.id, articles.title, articles.content, articles.author_id, articles.magazine_id,
+                   bm25(articles_fts, {TITLE_WEIGHT}, {CONTENT_WEIGHT}) AS rank,
+                   snippet(articles_fts, 1, '[', ']', '...', 12) AS snippet
+            FROM articles_fts
+            JOIN articles ON articles.id = articles_fts.rowid
+            WHERE articles_fts MATCH ?
+        """
+        params = [match]
+        if magazine_id is not None:
+            sql += " AND articles.magazine_id = ?"
+            params.append(magazine_id)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        results = []
+        try:
+            with read_connection() as conn:
+                for row in fetch_all(conn, "Article.search", sql, params, tuples=True):
+                    article = cls._from_tuples([row[:5]])[0]
+                    results.append({'article': article, 'rank': row[5], 'snippet': row[6]})
+        except sqlite3.Error as e:
+            logger.error("Error searching articles: %s", e)
+        return results
+
+    @classmethod
+    def iter_by_author_id(cls, author_id, batch_size=DEFAULT_BATCH_SIZE, only=None, defer=()):
+        """Lazily yield the articles find_by_author_id() would return.
+
+        With ``only=`` / ``defer=``, deferred fields load per fetched batch.
+        """
+        require_unsharded("Article.iter_by_author_id")
+        select, columns = cls._select(only, defer)
+        try:
+            with closing(iter_batches(
+                "Article.iter_by_author_id",
+                f"SELECT {select} FROM articles WHERE author_id = ?", (author_id,), batch_size
+            )) as batches:
+                for batch in batches:
+                    yield from cls._build(batch, columns)
+        except sqlite3.Error as e:
+            logger.error("Error streaming articles by author ID: %s", e)
+
+    @classmethod
+    def iter_by_magazine_id(cls, magazine_id, batch_size=DEFAULT_BATCH_SIZE, only=None, defer=()):
+        """Lazily yield the articles find_by_magazine_id() would return.
+
+        With ``only=`` / ``defer=``, deferred fields load per fetched batch.
+        """
+        require_unsharded("Article.iter_by_magazine_id")
+        select, columns = cls._select(only, defer)
+        try:
+            with closing(iter_batches(
+                "Article.iter_by_magazine_id",
+                f"SELECT {select} FROM articles WHERE magazine_id = ?", (magazine_id,), batch_size
+            )) as batches:
+                for batch in batches:
+                    yield from cls._build(batch, columns)
+        except sqlite3.Error as e:
+            logger.error("Error streaming articles by magazine ID: %s", e)
+
+    def _state(self):
+        return (self.title, self._content, self.author_id, self.magazine_id)
+
+    def _dependencies(self):
+        """Unsaved author/magazine a Session must insert before this article."""
+        return [related for related in (self._author, self._magazine) if related is not None and related.id is None]
+
+    def _resolve_related_ids(self):
+        # Pick up ids of an author/magazine that were saved after this article was built
+        if self.author_id is None and self._author is not None:
+            self.author_id = self._author.id
+        if self.magazine_id is None and self._magazine is not None:
+            self.magazine_id = self._magazine.id
+
+    def _write(self, conn):
+        require_unsharded("Writing articles through a Session or WriteQueue")
+        self._resolve_related_ids()
+        if self.id is None:
+            cursor = execute(
+                conn, "Article.save",
+                "INSERT INTO articles (title, content, author_id, magazine_id) VALUES (?, ?, ?, ?)",
+                (self.title, self._stored_content(), self.author_id, self.magazine_id)
+            )
+            self.id = cursor.lastrowid
+        else:
+            execute(
+                conn, "Article.save",
+                "UPDATE articles SET title = ?, content = ?, author_id = ?, magazine_id = ? WHERE id = ?",
+                (self.title, self._stored_content(), self.author_id, self.magazine_id, self.id)
+            )
 
     def save(self):
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                if self.id is None:
-                    cursor.execute(
-                        "INSERT INTO articles (title, content, author_id, magazine_id) VALUES (?, ?, ?, ?)",
-                        (self.title, self.content, self.author_id, self.magazine_id)
-                    )
-                    self.id = cursor.lastrowid
-                else:
-                    cursor.execute(
-                        "UPDATE articles SET title = ?, content = ?, author_id = ?, magazine_id = ? WHERE id = ?",
-                        (self.title, self.content, self.author_id, self.magazine_id, self.id)
-                    )
+        """Insert or update and commit; inside a Session, only register for its flush."""
+        if in_session(self):
+            return
+        shards = get_shards()
+        try:
+            if shards is not None:
+                self._write_sharded(shards)
+            elif in_write_queue(self):
+                return
+            else:
+                with connection() as conn:
+                    self._write(conn)
+                    conn.commit()
+            refresh(self, 'title')
+        except sqlite3.Error as e:
+            logger.error("Error saving article: %s", e)
+
+    def _write_sharded(self, shards):
+        """Write to the shard of the article's magazine, moving it there if the magazine changed.
+
+        The catalog hands out the id first; the row is upserted so the
+        summary triggers see an update rather than a second insert.
+        """
+        self._resolve_related_ids()
+        shard = shards.shard_for(self.magazine_id)
+        new = self.id is None
+        previous = None
+        if new:
+            self.id = allocate_article_id(shard)
+        try:
+            with shards.connection(shard) as conn:
+                execute(conn, "Article.save", """
+                    INSERT INTO articles (id, title, content, author_id, magazine_id) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET title = excluded.title, content = excluded.content,
+                        author_id = excluded.author_id, magazine_id = excluded.magazine_id
+                """, (self.id, self.title, self._stored_content(), self.author_id, self.magazine_id))
+                conn.commit()
+        except sqlite3.Error:
+            if new:
+                release_article_id(self.id)
+                self.id = None
+            raise
+        if not new:
+            previous = move_article(self.id, shard)
+        if previous is not None and previous != shard:
+            with shards.connection(previous) as conn:
+                execute(conn, "Article.save", "DELETE FROM articles WHERE id = ?", (self.id,))
                 conn.commit()
+
+    @classmethod
+    def bulk_create(cls, articles, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        require_unsharded("Article.bulk_create")
+        return bulk_insert(
+            "articles", ("title", "content", "author_id", "magazine_id"), join_bulk(articles),
+            lambda a: (a.title, a._stored_content(), a.author_id, a.magazine_id), chunk_size, progress
+        )
+
+    @classmethod
+    def bulk_update(cls, articles, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        require_unsharded("Article.bulk_update")
+        return bulk_update(
+            "articles", ("title", "content", "author_id", "magazine_id"), join_bulk(map(forget, articles)),
+            lambda a: (a.title, a._stored_content(), a.author_id, a.magazine_id, a.id), chunk_size, progress
+        )
+
+    @classmethod
+    def prefetch(cls, articles, *relations):
+        """Attach the related "author" and/or "magazine" to every article.
+
+        Each relation costs one IN query per chunk of distinct ids, however
+        many articles there are. Returns the articles as a list.
+        """
+        from .author import Author
+        from .magazine import Magazine
+        articles = list(articles)
+        for relation in relations:
+            if relation == 'author':
+                model, fk, attr = Author, 'author_id', '_author'
+            elif relation == 'magazine':
+                model, fk, attr = Magazine, 'magazine_id', '_magazine'
+            else:
+                raise ValueError(f"Unknown Article relation: {relation!r}")
+            try:
+                related = model._load_by_ids(getattr(a, fk) for a in articles)
             except sqlite3.Error as e:
-                print(f"Error saving article: {e}")
-            finally:
-                close_connection(conn)
+                logger.error("Error prefetching %s for articles: %s", relation, e)
+                continue
+            for article in articles:
+                setattr(article, attr, related.get(getattr(article, fk)))
+        return articles
 
     def magazine(self):
         from .magazine import Magazine # Local import to avoid circular dependency
-        return Magazine.find_by_id(self.magazine_id)
+        if self._magazine is None or self._magazine.id != self.magazine_id:
+            self._magazine = Magazine.find_by_id(self.magazine_id)
+        return self._magazine
 
     def author(self):
         from .author import Author # Local import to avoid circular dependency
-        return Author.find_by_id(self.author_id)
\ No newline at end of file
+        if self._author is None or self._author.id != self.author_id:
+            self._author = Author.find_by_id(self.author_id)
+        return self._author
+
+    # --- asyncio counterparts: the blocking method runs on a database worker thread ---
+
+    @classmethod
+    async def afind_by_id(cls, article_id):
+        return await run_async(cls.find_by_id, article_id)
+
+    @classmethod
+    async def afind_by_title(cls, title):
+        return await run_async(cls.find_by_title, title)
+
+    @classmethod
+    async def afind_by_author_id(cls, author_id, with_related=(), only=None, defer=()):
+        return await run_async(cls.find_by_author_id, author_id, with_related=with_related, only=only, defer=defer)
+
+    @classmethod
+    async def afind_by_magazine_id(cls, magazine_id, with_related=(), only=None, defer=()):
+        return await run_async(
+            cls.find_by_magazine_id, magazine_id, with_related=with_related, only=only, defer=defer
+        )
+
+    @classmethod
+    async def asearch(cls, query, magazine_id=None, limit=20, offset=0, raw=False):
+        return await run_async(cls.search, query, magazine_id, limit, offset, raw)
+
+    async def asave(self):
+        return await run_async(self.save)
+
+    async def aauthor(self):
+        return await run_async(self.author)
+
+    async def amagazine(self):
+        return await run_async(self.magazine)
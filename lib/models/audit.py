@@ -0,0 +1,310 @@
+# ARTICLES/lib/models/audit.py
+"""Check the query plan of every statement the models issue.
+
+The public model methods are called once against a scratch database built
+by the migrations while ``capture_statements()`` records their SQL. Each
+distinct statement is then run through EXPLAIN QUERY PLAN on the database
+being audited, which is opened read-only and never written to. For every
+statement the report shows how each table is reached (SCAN reads all of
+it, SEARCH uses an index or the rowid), temp B-trees built for ORDER BY,
+GROUP BY or DISTINCT, and indexes that cover the query on their own.
+
+    python -m lib.models.audit articles.db
+    python -m lib.models.audit articles.db --verbose --json plans.json
+
+The exit status is 1 when a hot-path statement (see HOT_PATHS, extended
+with ``--hot``) scans a whole table or can't be planned at all.
+"""
+import argparse
+import ast
+import fnmatch
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from contextlib import closing
+from pathlib import Path
+
+from ..db import connection as db
+from ..db.compression import register_functions
+from ..db.instrument import capture_statements
+from ..db.migrations import LATEST_VERSION, migrate
+from .article import Article
+from .author import Author
+from .identity_map import identity_map_disabled
+from .ingest import export_file, ingest_records
+from .magazine import Magazine
+from .result_cache import result_cache_disabled
+from .session import Session
+
+# Statements run per request rather than per batch job or report: these must
+# reach their rows through an index
+HOT_PATHS = (
+    "*.find_by_*",
+    "*.find_page_by_*",
+    "*.load_by_ids",
+    "*.get_or_create",
+    "*.save",
+    "Article.load_deferred",
+    "Article.search",
+    "Author.magazines",
+    "Author.magazines_page",
+    "Magazine.article_titles",
+    "Magazine.contributing_authors",
+)
+
+# Instrumented calls whose string arguments name a query
+_RUNNERS = {'fetch_all', 'fetch_one', 'execute', 'execute_many', 'load_by', 'load_by_ids',
+            'fetch_all_sharded', 'iter_batches', 'upsert_returning', 'from_projection'}
+_QUERY_NAME = re.compile(r"^[A-Z]\w*\.\w+$")
+# "SCAN articles", "SEARCH a USING INDEX ...", and "SCAN TABLE articles" before SQLite 3.36
+_ACCESS = re.compile(r"^(SCAN|SEARCH)(?: TABLE)? (\w+)(?: AS \w+)?(.*)$")
+_COVERING = re.compile(r"COVERING INDEX (\w+)")
+
+
+def exercise(directory):
+    """Call every public model method once; ``directory`` is for the import/export files."""
+    author = Author("Audit Author")
+    author.save()
+    author.save()
+    magazine = Magazine("Audit Weekly", "Technology")
+    magazine.save()
+    magazine.save()
+    article = author.add_article(magazine, "Audit Article", "audit content")
+    article.save()
+    with Session():
+        Author("Audit Session").add_article(Magazine("Audit Session Weekly", "News"), "Audit Session Article")
+
+    Author.get_or_create("Audit Author")
+    Magazine.get_or_create("Audit Weekly", "Technology")
+    Author.bulk_create([Author("Audit Bulk")])
+    Author.bulk_upsert([Author("Audit Bulk"), Author("Audit Upsert")])
+    Author.bulk_update([author])
+    Magazine.bulk_create([Magazine("Audit Bulk Weekly", "News")])
+    Magazine.bulk_upsert([Magazine("Audit Bulk Weekly", "News")])
+    Magazine.bulk_upsert([Magazine("Audit Bulk Weekly", "Science")], update_category=True)
+    Magazine.bulk_update([magazine])
+    Article.bulk_create([Article("Audit Bulk Article", "", author.id, magazine.id)])
+    Article.bulk_update([article])
+    ingest_records([{'title': "Audit Feed", 'content': "", 'author': "Audit Feed Author",
+                     'magazine': "Audit Feed Weekly", 'category': "News"}])
+    export_file(os.path.join(directory, "audit.jsonl"))
+
+    Author.find_by_id(author.id)
+    Author.find_by_name(author.name)
+    Author.find_by_ids([author.id])
+    Author.find_by_names([author.name])
+    Magazine.find_by_id(magazine.id)
+    Magazine.find_by_name(magazine.name)
+    Magazine.find_by_ids([magazine.id])
+    Magazine.find_by_names([magazine.name])
+    Magazine.find_by_category(magazine.category)
+    Magazine.find_page_by_category(magazine.category)
+    list(Magazine.iter_by_category(magazine.category))
+
+    Article.find_by_id(article.id)
+    Article.find_by_title(article.title)
+    Article.find_by_author_id(author.id, with_related=('author', 'magazine'))
+    Article.find_by_magazine_id(magazine.id)
+    for partial in Article.find_by_magazine_id(magazine.id, only=('id', 'title')):
+        partial.content
+    Article.find_page_by_author_id(author.id)
+    Article.find_page_by_magazine_id(magazine.id)
+    Article.search("audit")
+    Article.search("audit", magazine_id=magazine.id)
+    list(Article.iter_by_author_id(author.id))
+    list(Article.iter_by_magazine_id(magazine.id))
+    article.author()
+    article.magazine()
+
+    author.articles()
+    author.magazines()
+    author.magazines_page()
+    Author.top_author()
+    magazine.articles()
+    magazine.article_titles()
+    magazine.contributing_authors()
+    magazine.contributors()
+    Magazine.with_multiple_authors()
+    Magazine.article_counts()
+
+
+def collect_statements():
+    """Run exercise() on a scratch database; returns ``[(name, sql, params)]``, one per distinct statement."""
+    previous = db.DATABASE_NAME
+    with tempfile.TemporaryDirectory() as directory:
+        db.DATABASE_NAME = os.path.join(directory, "audit.db")
+        try:
+            migrate(db.DATABASE_NAME)
+            with capture_statements() as captured, identity_map_disabled(), result_cache_disabled():
+                exercise(directory)
+        finally:
+            # The pools follow DATABASE_NAME back on their next use
+            db.get_read_pool().close()
+            db.get_pool().close()
+            db.DATABASE_NAME = previous
+    distinct = {}
+    for name, sql, params in captured:
+        distinct.setdefault((name, " ".join(sql.split())), params)
+    return [(name, sql, params) for (name, sql), params in distinct.items()]
+
+
+def source_query_names(paths=None):
+    """Query names passed as string literals to the instrumented calls in lib/models."""
+    if paths is None:
+        paths = glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))
+    names = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            func = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, 'id', None)
+            if func not in _RUNNERS:
+                continue
+            for arg in node.args:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str) and _QUERY_NAME.match(arg.value):
+                    names.add(arg.value)
+    return names
+
+
+def analyze(plan, tables):
+    """Sort EXPLAIN QUERY PLAN details into scans, searches, temp B-trees and covering indexes.
+
+    Only SCANs of ``tables`` (real tables, not virtual tables, subqueries
+    or CTEs) count as full scans.
+    """
+    result = {'scans': [], 'searches': [], 'temp_btrees': [], 'covering_indexes': [], 'automatic_indexes': []}
+    for detail in plan:
+        if detail.startswith("USE TEMP B-TREE FOR "):
+            result['temp_btrees'].append(detail[len("USE TEMP B-TREE FOR "):])
+            continue
+        match = _ACCESS.match(detail)
+        if match is None:
+            continue
+        kind, table, rest = match.groups()
+        covering = _COVERING.search(rest)
+        if covering is not None:
+            result['covering_indexes'].append(covering.group(1))
+        if "AUTOMATIC" in rest:
+            result['automatic_indexes'].append(table)
+        if kind == "SEARCH":
+            result['searches'].append(table)
+        elif table in tables and "VIRTUAL TABLE" not in rest:
+            result['scans'].append(table)
+    return result
+
+
+def is_hot(name, patterns=HOT_PATHS):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def schema_copy(conn):
+    """An in-memory database with ``conn``'s tables, indexes and triggers but no rows or statistics.
+
+    Without sqlite_stat1 the planner assumes every table is large, so plans
+    show whether an index can serve a query at all rather than what suits
+    the current (perhaps tiny) data.
+    """
+    copy = register_functions(sqlite3.connect(":memory:"))
+    for sql, in conn.execute("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                             "ORDER BY type = 'trigger', type = 'index', rowid"):
+        try:
+            copy.execute(sql)
+        except sqlite3.OperationalError:
+            # Shadow tables already created by their virtual table (e.g. the FTS index)
+            pass
+    return copy
+
+
+def audit(database, statements=None, hot=HOT_PATHS, schema_only=False):
+    """Plan every model statement against ``database``; returns the report dict.
+
+    ``schema_only`` plans against schema_copy() instead of the data.
+    """
+    if statements is None:
+        statements = collect_statements()
+    uri = Path(database).resolve().as_uri() + "?mode=ro"
+    with closing(register_functions(sqlite3.connect(uri, uri=True), index=False)) as conn:
+        # Read before the swap: schema_copy() doesn't carry user_version over
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if schema_only:
+            original, conn = conn, schema_copy(conn)
+            original.close()
+        tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        entries = []
+        for name, sql, params in sorted(statements, key=lambda statement: statement[0]):
+            entry = {'name': name, 'hot': is_hot(name, hot), 'sql': sql, 'plan': [], 'error': None}
+            try:
+                entry['plan'] = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            except sqlite3.Error as e:
+                entry['error'] = str(e)
+            entry.update(analyze(entry['plan'], tables))
+            if entry['hot'] and (entry['scans'] or entry['error']):
+                entry['status'] = "FAIL"
+            elif entry['scans'] or entry['temp_btrees'] or entry['automatic_indexes'] or entry['error']:
+                entry['status'] = "warn"
+            else:
+                entry['status'] = "ok"
+            entries.append(entry)
+    captured = {entry['name'] for entry in entries}
+    return {
+        'database': os.path.abspath(database),
+        'schema_only': schema_only,
+        'schema_version': version,
+        'latest_version': LATEST_VERSION,
+        'statements': entries,
+        'failures': sum(entry['status'] == "FAIL" for entry in entries),
+        'not_exercised': sorted(source_query_names() - captured),
+    }
+
+
+def _summary(entry):
+    if entry['error']:
+        return f"error: {entry['error']}"
+    parts = [detail for detail in entry['plan'] if _ACCESS.match(detail)]
+    parts += [f"TEMP B-TREE FOR {use}" for use in entry['temp_btrees']]
+    return "; ".join(parts) or "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN every statement the models issue and flag full scans.")
+    parser.add_argument("database", nargs="?", help="database to audit (default: articles.db)")
+    parser.add_argument("--hot", action="append", default=[], metavar="PATTERN",
+                        help="also treat query names matching this glob as hot paths")
+    parser.add_argument("--schema-only", action="store_true",
+                        help="plan against the schema without its rows and statistics")
+    parser.add_argument("--json", metavar="PATH", help="write the full report here")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print each statement's SQL and full plan")
+    args = parser.parse_args(argv)
+
+    database = args.database or db.DATABASE_NAME
+    if not os.path.exists(database):
+        print(f"No such database: {database}", file=sys.stderr)
+        return 2
+    report = audit(database, hot=HOT_PATHS + tuple(args.hot), schema_only=args.schema_only)
+
+    if report['schema_version'] < report['latest_version']:
+        print(f"warning: schema version {report['schema_version']} is behind {report['latest_version']}; "
+              f"plans may differ once it is migrated")
+    for entry in report['statements']:
+        print(f"{entry['status']:<4} {'*' if entry['hot'] else ' '} {entry['name']:<36} {_summary(entry)}")
+        if args.verbose:
+            print(f"         {entry['sql']}")
+            for detail in entry['plan']:
+                print(f"           {detail}")
+    for name in report['not_exercised']:
+        print(f"warning: {name} was not exercised")
+    print(f"{len(report['statements'])} statements, {report['failures']} hot-path full scans (* = hot path)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['failures'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
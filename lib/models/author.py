@@ -1,116 +1,327 @@
+import logging
 import sqlite3
-from ..db.connection import get_connection, close_connection
+from ..db.connection import connection, read_connection
+from ..db.instrument import execute, fetch_all, fetch_one
+from ..db.aio import run_async
+from ..db.bulk import DEFAULT_CHUNK_SIZE, bulk_insert, bulk_update, bulk_upsert
+from ..db.sharding import get_shards
+from .identity_map import forget, lookup, lookup_by, remember, refresh
+from .prefetch import load_by, load_by_ids
+from .result_cache import cached_result
+from .write_queue import in_write_queue
+from .session import current_session, in_session, join_bulk
+from .pagination import DEFAULT_PAGE_SIZE, decode_token, keyset_page
+
+logger = logging.getLogger(__name__)
 
 class Author:
+    __slots__ = ('id', 'name')
+
+    # Column order expected by _from_tuples()
+    COLUMNS = "id, name"
+    # Session flush order (authors and magazines before articles) and identity-map lookup keys
+    FLUSH_ORDER = 0
+    LOOKUP_FIELDS = ('name',)
+
     def __init__(self, name, id=None):
         self.id = id
         self.name = name
 
+    @classmethod
+    def _from_row(cls, row):
+        return cls(row['name'], row['id'])
+
+    @classmethod
+    def _from_tuples(cls, rows):
+        """Positional fast path: build authors from plain tuples in COLUMNS order."""
+        return [cls(name, id) for id, name in rows]
+
+    @classmethod
+    def _load_by_ids(cls, ids):
+        return load_by_ids(cls, "Author.load_by_ids", "SELECT id, name FROM authors WHERE id IN ({placeholders})", ids)
+
     @classmethod
     def find_by_id(cls, author_id):
-        author = None
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name FROM authors WHERE id = ?", (author_id,))
-                row = cursor.fetchone()
+        author = lookup(cls, author_id)
+        if author is not None:
+            return author
+        try:
+            with read_connection() as conn:
+                row = fetch_one(conn, "Author.find_by_id", "SELECT id, name FROM authors WHERE id = ?", (author_id,))
                 if row:
-                    author = cls(row['name'], row['id'])
-            except sqlite3.Error as e:
-                print(f"Error finding author by ID: {e}")
-            finally:
-                close_connection(conn)
+                    author = remember(cls(row['name'], row['id']))
+        except sqlite3.Error as e:
+            logger.error("Error finding author by ID: %s", e)
         return author
 
     @classmethod
     def find_by_name(cls, name):
-        author = None
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name FROM authors WHERE name = ?", (name,))
-                row = cursor.fetchone()
+        author = lookup_by(cls, 'name', name)
+        if author is not None:
+            return author
+        try:
+            with read_connection() as conn:
+                row = fetch_one(conn, "Author.find_by_name", "SELECT id, name FROM authors WHERE name = ?", (name,))
                 if row:
-                    author = cls(row['name'], row['id'])
-            except sqlite3.Error as e:
-                print(f"Error finding author by name: {e}")
-            finally:
-                close_connection(conn)
+                    author = remember(cls(row['name'], row['id']), 'name')
+        except sqlite3.Error as e:
+            logger.error("Error finding author by name: %s", e)
         return author
 
+    @classmethod
+    def find_by_ids(cls, ids):
+        """{id: Author or None} for every id, in input order.
+
+        Ids not in the identity map are loaded with one IN query per chunk
+        of ids rather than one query each.
+        """
+        ids = list(ids)
+        found = {}
+        try:
+            found = cls._load_by_ids(ids)
+        except sqlite3.Error as e:
+            logger.error("Error finding authors by ID: %s", e)
+        return {id: found.get(id) for id in ids}
+
+    @classmethod
+    def find_by_names(cls, names):
+        """{name: Author or None} for every name, in input order; batched like find_by_ids()."""
+        names = list(names)
+        found = {}
+        try:
+            found = load_by(cls, "Author.find_by_names", "SELECT id, name FROM authors WHERE name IN ({placeholders})",
+                            'name', names)
+        except sqlite3.Error as e:
+            logger.error("Error finding authors by name: %s", e)
+        return {name: found.get(name) for name in names}
+
+    @classmethod
+    def get_or_create(cls, name):
+        """The author called ``name``, inserted first if there isn't one.
+
+        An existing author is only read, so the lookup takes no write lock.
+        Otherwise the insert skips a row a concurrent caller just added and
+        the row is read again, so every caller gets the same one. Inside a
+        Session the insert is part of the session's transaction.
+        """
+        author = lookup_by(cls, 'name', name)
+        if author is not None:
+            return author
+        select = "SELECT id, name FROM authors WHERE name = ?"
+        try:
+            with connection() as conn:
+                row = fetch_one(conn, "Author.get_or_create", select, (name,), tuples=True)
+                if row is None:
+                    execute(conn, "Author.get_or_create.insert",
+                            "INSERT INTO authors (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,))
+                    if current_session() is None:
+                        conn.commit()
+                    row = fetch_one(conn, "Author.get_or_create", select, (name,), tuples=True)
+                id, name = row
+                author = remember(cls(name, id), 'name')
+        except sqlite3.Error as e:
+            logger.error("Error getting or creating author: %s", e)
+        return author
+
+    def _state(self):
+        return (self.name,)
+
+    def _write(self, conn):
+        if self.id is None:
+            cursor = execute(conn, "Author.save", "INSERT INTO authors (name) VALUES (?)", (self.name,))
+            self.id = cursor.lastrowid
+        else:
+            execute(conn, "Author.save", "UPDATE authors SET name = ? WHERE id = ?", (self.name, self.id))
+
     def save(self):
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                if self.id is None:
-                    cursor.execute("INSERT INTO authors (name) VALUES (?)", (self.name,))
-                    self.id = cursor.lastrowid
-                else:
-                    cursor.execute("UPDATE authors SET name = ? WHERE id = ?", (self.name, self.id))
+        """Insert or update and commit; inside a Session, only register for its flush."""
+        if in_session(self):
+            return
+        try:
+            if in_write_queue(self):
+                return
+            with connection() as conn:
+                self._write(conn)
                 conn.commit()
-            except sqlite3.Error as e:
-                print(f"Error saving author: {e}")
-            finally:
-                close_connection(conn)
+                refresh(self, 'name')
+        except sqlite3.Error as e:
+            logger.error("Error saving author: %s", e)
+
+    @classmethod
+    def bulk_create(cls, authors, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        return bulk_insert("authors", ("name",), join_bulk(authors), lambda a: (a.name,), chunk_size, progress)
+
+    @classmethod
+    def bulk_upsert(cls, authors, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        """bulk_create() that gives authors whose name already exists that row's id instead."""
+        return bulk_upsert("authors", ("name",), join_bulk(authors), lambda a: (a.name,),
+                           chunk_size=chunk_size, progress=progress)
+
+    @classmethod
+    def bulk_update(cls, authors, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        return bulk_update("authors", ("name",), join_bulk(map(forget, authors)), lambda a: (a.name, a.id),
+                           chunk_size, progress)
 
-    def articles(self):
+    def articles(self, with_related=()):
         from .article import Article
-        return Article.find_by_author_id(self.id)
+        return Article.find_by_author_id(self.id, with_related=with_related)
 
+    @cached_result("Author.magazines", key=lambda author: (author.id,))
     def magazines(self):
         from .magazine import Magazine
-        conn = get_connection()
         magazines_list = []
-        if conn and self.id is not None:
+        shards = get_shards()
+        if self.id is not None and shards is not None:
+            try:
+                # Magazines are in the catalog; each shard reports the ones this author wrote for
+                ids = shards.scatter_rows(
+                    "Author.magazines", "SELECT DISTINCT magazine_id FROM articles WHERE author_id = ?", (self.id,)
+                )
+                magazines = Magazine._load_by_ids(id for id, in ids)
+                magazines_list = [magazines[id] for id in sorted(magazines)]
+            except sqlite3.Error as e:
+                logger.error("Error finding magazines for author: %s", e)
+        elif self.id is not None:
             try:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT DISTINCT magazines.id, magazines.name, magazines.category
-                    FROM magazines
-                    JOIN articles ON magazines.id = articles.magazine_id
-                    WHERE articles.author_id = ?
-                """, (self.id,))
-                rows = cursor.fetchall()
-                for row in rows:
-                    magazines_list.append(Magazine(row['name'], row['category'], row['id']))
+                with read_connection() as conn:
+                    rows = fetch_all(conn, "Author.magazines", """
+                        SELECT DISTINCT magazines.id, magazines.name, magazines.category
+                        FROM magazines
+                        JOIN articles ON magazines.id = articles.magazine_id
+                        WHERE articles.author_id = ?
+                    """, (self.id,))
+                    for row in rows:
+                        magazines_list.append(Magazine(row['name'], row['category'], row['id']))
             except sqlite3.Error as e:
-                print(f"Error finding magazines for author: {e}")
-            finally:
-                close_connection(conn)
+                logger.error("Error finding magazines for author: %s", e)
         return magazines_list
 
+    def magazines_page(self, page_size=DEFAULT_PAGE_SIZE, after=None):
+        """One page of magazines() in id order; pass ``page.next_token`` as ``after``."""
+        from .magazine import Magazine
+        scope = f"authors:{self.id}:magazines"
+        last_id = decode_token(scope, after)
+        magazines_list = []
+        shards = get_shards()
+        if self.id is not None and shards is not None:
+            try:
+                ids = sorted({id for id, in shards.scatter_rows("Author.magazines_page", """
+                    SELECT DISTINCT magazine_id FROM articles
+                    WHERE author_id = ? AND magazine_id > ?
+                    ORDER BY magazine_id
+                    LIMIT ?
+                """, (self.id, -1 if last_id is None else last_id, page_size + 1))})[:page_size + 1]
+                magazines = Magazine._load_by_ids(ids)
+                magazines_list = [magazines[id] for id in ids if id in magazines]
+            except sqlite3.Error as e:
+                logger.error("Error paging magazines for author: %s", e)
+        elif self.id is not None:
+            try:
+                with read_connection() as conn:
+                    # Seek the (author_id, magazine_id) index from the last magazine id seen
+                    rows = fetch_all(conn, "Author.magazines_page", """
+                        SELECT magazines.id, magazines.name, magazines.category
+                        FROM (
+                            SELECT DISTINCT magazine_id FROM articles
+                            WHERE author_id = ? AND magazine_id > ?
+                            ORDER BY magazine_id
+                            LIMIT ?
+                        ) AS page
+                        JOIN magazines ON magazines.id = page.magazine_id
+                        ORDER BY magazines.id
+                    """, (self.id, -1 if last_id is None else last_id, page_size + 1), tuples=True)
+                    magazines_list = Magazine._from_tuples(rows)
+            except sqlite3.Error as e:
+                logger.error("Error paging magazines for author: %s", e)
+        return keyset_page(magazines_list, page_size, scope, lambda m: m.id)
+
     def add_article(self, magazine, title, content=""): # TWEAK: content now has a default value
         from .article import Article
-        if self.id is None or magazine.id is None:
-            print("Author or Magazine must be saved to add an article.")
+        if (self.id is None or magazine.id is None) and current_session() is None:
+            logger.warning("Author or Magazine must be saved to add an article.")
             return None
         article = Article(title, content, self.id, magazine.id)
+        # Inside a session the author/magazine may still be unsaved; their ids
+        # are copied onto the article when the session flushes
+        article._author = self
+        article._magazine = magazine
         article.save()
         return article
 
     @classmethod
+    @cached_result("Author.top_author")
     def top_author(cls):
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT authors.id, authors.name, COUNT(articles.id) as article_count
-                    FROM authors
-                    JOIN articles ON authors.id = articles.author_id
-                    GROUP BY authors.id, authors.name
-                    ORDER BY article_count DESC
+        shards = get_shards()
+        if shards is not None:
+            return cls._top_author_sharded(shards)
+        try:
+            with read_connection() as conn:
+                # author_stats is kept up to date by triggers on articles (see lib/db/aggregates.py)
+                row = fetch_one(conn, "Author.top_author", """
+                    SELECT authors.id, authors.name, author_stats.article_count
+                    FROM author_stats
+                    JOIN authors ON authors.id = author_stats.author_id
+                    ORDER BY author_stats.article_count DESC, author_stats.author_id
                     LIMIT 1
                 """)
-                row = cursor.fetchone()
                 if row:
                     return cls(row['name'], row['id'])
-            except sqlite3.Error as e:
-                print(f"Error finding top author: {e}")
-            finally:
-                close_connection(conn)
+        except sqlite3.Error as e:
+            logger.error("Error finding top author: %s", e)
         return None
 
+    @classmethod
+    def _top_author_sharded(cls, shards):
+        # An author's articles can be on every shard, so the per-shard counts are summed here
+        counts = {}
+        try:
+            for author_id, article_count in shards.scatter_rows(
+                "Author.top_author", "SELECT author_id, article_count FROM author_stats"
+            ):
+                counts[author_id] = counts.get(author_id, 0) + article_count
+            for author_id in sorted(counts, key=lambda id: (-counts[id], id)):
+                # Skip counts left behind by an author deleted from the catalog, as the join does
+                author = cls.find_by_id(author_id)
+                if author is not None:
+                    return author
+        except sqlite3.Error as e:
+            logger.error("Error finding top author: %s", e)
+        return None
+
+    # --- asyncio counterparts: the blocking method runs on a database worker thread ---
+
+    @classmethod
+    async def afind_by_id(cls, author_id):
+        return await run_async(cls.find_by_id, author_id)
+
+    @classmethod
+    async def afind_by_name(cls, name):
+        return await run_async(cls.find_by_name, name)
+
+    @classmethod
+    async def afind_by_ids(cls, ids):
+        return await run_async(cls.find_by_ids, ids)
+
+    @classmethod
+    async def afind_by_names(cls, names):
+        return await run_async(cls.find_by_names, names)
+
+    @classmethod
+    async def aget_or_create(cls, name):
+        return await run_async(cls.get_or_create, name)
+
+    async def asave(self):
+        return await run_async(self.save)
+
+    async def aarticles(self, with_related=()):
+        return await run_async(self.articles, with_related=with_related)
+
+    async def amagazines(self):
+        return await run_async(self.magazines)
+
+    async def aadd_article(self, magazine, title, content=""):
+        return await run_async(self.add_article, magazine, title, content)
+
+    @classmethod
+    async def atop_author(cls):
+        return await run_async(cls.top_author)
@@ -0,0 +1,83 @@
+# ARTICLES/lib/models/deferred.py
+from ..db.bulk import chunked
+from ..db.connection import read_connection
+from ..db.instrument import fetch_all
+from ..db.sharding import fetch_all_sharded
+from .prefetch import MAX_IN_VARIABLES, placeholders
+
+
+def projection(cls, only=None, defer=()):
+    """Columns to select for ``only=`` / ``defer=``, or None to select all of them.
+
+    ``id`` is always selected. Raises ValueError for a field that can't be
+    deferred.
+    """
+    if only is None and not defer:
+        return None
+    fields = cls.DEFERRABLE if only is None else tuple(only)
+    unknown = (set(fields) | set(defer)) - set(cls.DEFERRABLE) - {'id'}
+    if unknown:
+        raise ValueError(f"Unknown {cls.__name__} fields: {', '.join(sorted(unknown))}")
+    return ('id',) + tuple(field for field in cls.DEFERRABLE if field in fields and field not in defer)
+
+
+def _is_set(obj, slot):
+    # object.__getattribute__ doesn't fall back to the model's __getattr__,
+    # so this never triggers a load
+    try:
+        object.__getattribute__(obj, slot)
+        return True
+    except AttributeError:
+        return False
+
+
+class DeferredBatch:
+    """The instances one query built with some columns left out.
+
+    Touching a deferred field on any of them loads that field for every
+    instance in the batch that still lacks it, with one IN query per chunk
+    of ids.
+    """
+
+    def __init__(self, cls, table, name):
+        self.cls = cls
+        self.table = table
+        self.name = name
+        self.instances = []
+
+    def load(self, field):
+        slot = self.cls.FIELD_SLOTS.get(field, field)
+        pending = {}
+        for obj in self.instances:
+            if not _is_set(obj, slot):
+                pending.setdefault(obj.id, []).append(obj)
+        if not pending:
+            return
+        values = {}
+        for chunk in chunked(list(pending), MAX_IN_VARIABLES):
+            sql = f"SELECT id, {field} FROM {self.table} WHERE id IN ({placeholders(len(chunk))})"
+            if self.table == "articles":
+                # Articles may be spread over shards
+                values.update(fetch_all_sharded(self.name, sql, chunk))
+            else:
+                with read_connection() as conn:
+                    values.update(fetch_all(conn, self.name, sql, chunk, tuples=True))
+        for id, objects in pending.items():
+            # A row deleted since the first query loads as None
+            for obj in objects:
+                setattr(obj, slot, values.get(id))
+
+
+def from_projection(cls, table, columns, rows, name):
+    """Build ``cls`` instances from rows holding only ``columns``, sharing one DeferredBatch."""
+    batch = DeferredBatch(cls, table, name)
+    slots = [cls.FIELD_SLOTS.get(column, column) for column in columns]
+    instances = []
+    for row in rows:
+        obj = cls._blank()
+        for slot, value in zip(slots, row):
+            setattr(obj, slot, value)
+        obj._batch = batch
+        instances.append(obj)
+    batch.instances = instances
+    return instances
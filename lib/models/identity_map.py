@@ -0,0 +1,218 @@
+# ARTICLES/lib/models/identity_map.py
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_MAXSIZE = 1024
+
+
+class IdentityMap:
+    """A bounded LRU cache of loaded model instances.
+
+    Entries are keyed by ``(cls, id)``. Unique lookups such as
+    ``Author.find_by_name`` are stored as secondary keys
+    ``(cls, field, value)`` that point at an id key, so evicting or
+    invalidating the instance drops its lookups too.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lookups = {}
+        self._lookups_by_key = {}  # reverse index so dropping an entry's lookups is O(1)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cls, id):
+        with self._lock:
+            obj = self._entries.get((cls, id))
+            if obj is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((cls, id))
+            self.hits += 1
+            return obj
+
+    def get_by(self, cls, field, value):
+        with self._lock:
+            key = self._lookups.get((cls, field, value))
+            obj = self._entries.get(key) if key is not None else None
+            if obj is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return obj
+
+    def add(self, obj, *fields, replace=False):
+        """Store ``obj`` under its id, plus a lookup key for each of ``fields``.
+
+        Returns the canonical instance: if the row is already mapped the
+        existing object wins, unless ``replace`` is set.
+        """
+        if obj.id is None:
+            return obj
+        cls = type(obj)
+        key = (cls, obj.id)
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and not replace:
+                obj = existing
+            else:
+                self._entries[key] = obj
+            self._entries.move_to_end(key)
+            for field in fields:
+                lookup = (cls, field, getattr(obj, field))
+                previous = self._lookups.get(lookup)
+                if previous is not None and previous != key:
+                    self._lookups_by_key[previous].discard(lookup)
+                self._lookups[lookup] = key
+                self._lookups_by_key.setdefault(key, set()).add(lookup)
+            while len(self._entries) > self.maxsize:
+                old_key, _ = self._entries.popitem(last=False)
+                self._drop_lookups(old_key)
+                self.evictions += 1
+        return obj
+
+    def refresh(self, obj, *fields):
+        """Re-register ``obj`` after a save.
+
+        Any lookups that pointed at the old row, or at the values the row
+        now holds, are dropped since they may no longer pick the same row.
+        """
+        cls = type(obj)
+        with self._lock:
+            self._drop_lookups((cls, obj.id))
+            for field in fields:
+                lookup = (cls, field, getattr(obj, field))
+                previous = self._lookups.pop(lookup, None)
+                if previous is not None:
+                    self._lookups_by_key[previous].discard(lookup)
+            self.add(obj, replace=True)
+
+    def discard(self, cls, id):
+        with self._lock:
+            self._entries.pop((cls, id), None)
+            self._drop_lookups((cls, id))
+
+    def _drop_lookups(self, key):
+        for lookup in self._lookups_by_key.pop(key, ()):
+            self._lookups.pop(lookup, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._lookups.clear()
+            self._lookups_by_key.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'lookups': len(self._lookups),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Process-wide map, used unless a thread/task has scoped or disabled its own.
+# Off by default: it can't see writes made by other processes or connections,
+# so a long-lived process would keep serving stale rows. Turn it on with
+# set_identity_map_enabled(True) or ARTICLES_DB_IDENTITY_MAP=1 when this
+# process is the database's only writer; identity_map_scope() gives one
+# request its own short-lived map either way.
+_global_map = IdentityMap()
+_enabled = os.environ.get("ARTICLES_DB_IDENTITY_MAP", "0") == "1"
+# Per-context override: an IdentityMap for a scoped request, False when disabled
+_current = ContextVar('identity_map', default=None)
+
+
+def get_identity_map():
+    """Return the identity map active for the current thread/task, or None if caching is off."""
+    scoped = _current.get()
+    if scoped is False:
+        return None
+    if scoped is not None:
+        return scoped
+    return _global_map if _enabled else None
+
+
+def set_identity_map_enabled(enabled):
+    """Switch the process-wide identity map on or off."""
+    global _enabled
+    _enabled = enabled
+    if not enabled:
+        _global_map.clear()
+
+
+def configure_identity_map(maxsize=DEFAULT_MAXSIZE):
+    global _global_map
+    _global_map = IdentityMap(maxsize)
+    return _global_map
+
+
+@contextmanager
+def identity_map_scope(maxsize=DEFAULT_MAXSIZE):
+    """Give the current thread/task a private identity map, e.g. for one request."""
+    scoped = IdentityMap(maxsize)
+    token = _current.set(scoped)
+    try:
+        yield scoped
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def identity_map_disabled():
+    """Bypass the identity map for the current thread/task."""
+    token = _current.set(False)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def identity_map_stats():
+    imap = get_identity_map()
+    return imap.stats() if imap is not None else None
+
+
+# Helpers used by the models; they are no-ops when caching is off
+
+def lookup(cls, id):
+    imap = get_identity_map()
+    return imap.get(cls, id) if imap is not None and id is not None else None
+
+
+def lookup_by(cls, field, value):
+    imap = get_identity_map()
+    return imap.get_by(cls, field, value) if imap is not None else None
+
+
+def remember(obj, *fields):
+    imap = get_identity_map()
+    return imap.add(obj, *fields) if imap is not None else obj
+
+
+def forget(obj):
+    imap = get_identity_map()
+    if imap is not None and obj.id is not None:
+        imap.discard(type(obj), obj.id)
+    return obj
+
+
+def refresh(obj, *fields):
+    imap = get_identity_map()
+    if imap is not None and obj.id is not None:
+        imap.refresh(obj, *fields)
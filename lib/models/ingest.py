@@ -0,0 +1,283 @@
+# ARTICLES/lib/models/ingest.py
+"""Streaming CSV / JSONL import and export of articles.
+
+Records have the fields ``title``, ``content``, ``author``, ``magazine``
+and ``category`` (author and magazine are names; other fields are
+ignored). Input is read one record at a time and written in chunks, one
+transaction per chunk, so memory stays flat however large the file is.
+Author and magazine names are resolved to ids through a bounded LRU
+cache; names not in the database yet are inserted as part of the chunk.
+
+    python -m lib.models.ingest import feed.csv
+    python -m lib.models.ingest export articles.jsonl
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+from ..db.bulk import DEFAULT_CHUNK_SIZE, BulkStats, chunked, upsert_returning
+from ..db.compression import compress_content
+from ..db.connection import connection
+from ..db.instrument import execute_many, fetch_all
+from ..db.sharding import require_unsharded
+from .prefetch import MAX_IN_VARIABLES, placeholders
+from .streaming import DEFAULT_BATCH_SIZE, iter_batches
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('title', 'content', 'author', 'magazine', 'category')
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+DEFAULT_CACHE_SIZE = 100000
+# magazines.category is NOT NULL; used when a record names a new magazine without one
+DEFAULT_CATEGORY = "General"
+
+
+class IngestStats(BulkStats):
+    """BulkStats plus the rows skipped and the authors/magazines created."""
+
+    def __init__(self):
+        super().__init__()
+        self.skipped = 0
+        self.authors_created = 0
+        self.magazines_created = 0
+
+    def as_dict(self):
+        stats = super().as_dict()
+        stats.update(
+            skipped=self.skipped,
+            authors_created=self.authors_created,
+            magazines_created=self.magazines_created,
+        )
+        return stats
+
+    def __repr__(self):
+        return (f"<IngestStats rows={self.rows} skipped={self.skipped} chunks={self.chunks} "
+                f"rows/s={self.rows_per_second:.0f}>")
+
+
+class NameCache:
+    """Bounded LRU map of name -> id."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        id = self._ids.get(name)
+        if id is None:
+            self.misses += 1
+            return None
+        self._ids.move_to_end(name)
+        self.hits += 1
+        return id
+
+    def put(self, name, id):
+        self._ids[name] = id
+        self._ids.move_to_end(name)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def discard(self, name):
+        self._ids.pop(name, None)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class _NameResolver:
+    """Look up or insert rows of ``table`` by name, caching the ids."""
+
+    def __init__(self, table, columns, cache_size):
+        self.table = table
+        self.columns = columns
+        self.cache = NameCache(cache_size)
+
+    def resolve(self, conn, values):
+        """Return {name: id} for ``values`` ({name: insert row}), inserting unknown names.
+
+        Must run inside the chunk's write transaction. Returns the names that
+        were not found as well, so the caller can count them and drop them
+        from the cache if the transaction is rolled back.
+        """
+        ids = {}
+        missing = []
+        for name in values:
+            id = self.cache.get(name)
+            if id is None:
+                missing.append(name)
+            else:
+                ids[name] = id
+        for chunk in chunked(missing, MAX_IN_VARIABLES):
+            rows = fetch_all(
+                conn, f"ingest.{self.table}.lookup",
+                f"SELECT name, id FROM {self.table} WHERE name IN ({placeholders(len(chunk))})",
+                chunk, tuples=True
+            )
+            for name, id in rows:
+                ids[name] = id
+                self.cache.put(name, id)
+        created = [name for name in missing if name not in ids]
+        if created:
+            # Upsert rather than INSERT: another writer may have added some of
+            # these names since the lookup (names are unique, see migration 7)
+            new_ids = upsert_returning(
+                conn, f"ingest.{self.table}.upsert", self.table, self.columns, [values[name] for name in created]
+            )
+            for name in created:
+                ids[name] = new_ids[name]
+                self.cache.put(name, ids[name])
+        return ids, created
+
+
+def detect_format(path, format=None):
+    if format is not None:
+        return format
+    format = FORMATS.get(os.path.splitext(path)[1].lower())
+    if format is None:
+        raise ValueError(f"Can't tell the format of {path!r}; pass format='csv' or 'jsonl'")
+    return format
+
+
+@contextmanager
+def _open(path, mode, format):
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+        return
+    # The csv module does its own newline handling
+    with open(path, mode, newline="" if format == 'csv' else None, encoding="utf-8") as f:
+        yield f
+
+
+def read_records(path, format=None):
+    """Yield one dict per record of a CSV (with header) or JSONL file; ``-`` is stdin."""
+    format = detect_format(path, format)
+    with _open(path, "r", format) as f:
+        if format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def ingest_records(records, chunk_size=DEFAULT_CHUNK_SIZE, cache_size=DEFAULT_CACHE_SIZE, progress=None):
+    """Insert article ``records`` (dicts) in chunked transactions; returns IngestStats.
+
+    Records without a title, author or magazine are skipped and counted.
+    ``progress``, if given, is called with the stats after every chunk.
+    """
+    require_unsharded("Article ingest")
+    authors = _NameResolver("authors", ("name",), cache_size)
+    magazines = _NameResolver("magazines", ("name", "category"), cache_size)
+    stats = IngestStats()
+    with connection() as conn:
+        for chunk in chunked(records, chunk_size):
+            rows = []
+            for record in chunk:
+                title, author, magazine = record.get('title'), record.get('author'), record.get('magazine')
+                if not (title and author and magazine):
+                    stats.skipped += 1
+                    continue
+                rows.append((title, record.get('content') or "", author, magazine,
+                             record.get('category') or DEFAULT_CATEGORY))
+            if not rows:
+                continue
+            new_authors = new_magazines = ()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                author_ids, new_authors = authors.resolve(conn, {row[2]: (row[2],) for row in rows})
+                magazine_ids, new_magazines = magazines.resolve(conn, {row[3]: (row[3], row[4]) for row in rows})
+                execute_many(
+                    conn, "ingest.articles.insert",
+                    "INSERT INTO articles (title, content, author_id, magazine_id) VALUES (?, ?, ?, ?)",
+                    [(title, compress_content(content), author_ids[author], magazine_ids[magazine])
+                     for title, content, author, magazine, _ in rows]
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                # Ids handed out inside the rolled-back chunk no longer exist
+                for resolver, names in ((authors, new_authors), (magazines, new_magazines)):
+                    for name in names:
+                        resolver.cache.discard(name)
+                raise
+            stats.authors_created += len(new_authors)
+            stats.magazines_created += len(new_magazines)
+            stats.add_chunk(len(rows))
+            if progress:
+                progress(stats)
+    return stats
+
+
+def ingest_file(path, format=None, chunk_size=DEFAULT_CHUNK_SIZE, cache_size=DEFAULT_CACHE_SIZE, progress=None):
+    return ingest_records(read_records(path, format), chunk_size, cache_size, progress)
+
+
+EXPORT_SQL = """
+    SELECT articles.id, articles.title, article_text(articles.content), authors.name, magazines.name, magazines.category
+    FROM articles
+    LEFT JOIN authors ON authors.id = articles.author_id
+    LEFT JOIN magazines ON magazines.id = articles.magazine_id
+    ORDER BY articles.id
+"""
+
+
+def export_file(path, format=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Stream every article (with author/magazine names) to a CSV or JSONL file.
+
+    The output can be fed straight back to ``ingest_file``. Returns BulkStats.
+    """
+    require_unsharded("Article export")
+    format = detect_format(path, format)
+    header = ('id',) + FIELDS
+    stats = BulkStats()
+    with _open(path, "w", format) as f, closing(iter_batches("ingest.export", EXPORT_SQL, (), batch_size)) as batches:
+        if format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(header)
+            write = writer.writerows
+        else:
+            def write(rows):
+                f.writelines(json.dumps(dict(zip(header, row)), ensure_ascii=False) + "\n" for row in rows)
+        for batch in batches:
+            write(batch)
+            stats.add_chunk(len(batch))
+            if progress:
+                progress(stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream articles in or out as CSV or JSONL.")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path", help="file to read or write ('-' for stdin/stdout, with --format)")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    def progress(stats):
+        if stats.chunks % 10 == 0:
+            print(f"  {stats.rows:,} rows, {stats.rows_per_second:,.0f} rows/s", file=sys.stderr)
+
+    try:
+        if args.command == "import":
+            stats = ingest_file(args.path, args.format, args.chunk_size, progress=progress)
+        else:
+            stats = export_file(args.path, args.format, args.chunk_size, progress=progress)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"{args.command} failed: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.command}: {stats.as_dict()}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,124 +1,283 @@
+import logging
 import sqlite3
-from ..db.connection import get_connection, close_connection
+from contextlib import closing
+from ..db.connection import connection, read_connection
+from ..db.instrument import execute, fetch_all, fetch_one
+from ..db.aio import run_async
+from ..db.bulk import DEFAULT_CHUNK_SIZE, bulk_insert, bulk_update, bulk_upsert
+from ..db.sharding import get_shards, read_connection_for
+from .identity_map import forget, lookup, lookup_by, remember, refresh
+from .prefetch import load_by, load_by_ids
+from .result_cache import cached_result
+from .write_queue import in_write_queue
+from .session import current_session, in_session, join_bulk
+from .streaming import DEFAULT_BATCH_SIZE, iter_batches
+from .pagination import DEFAULT_PAGE_SIZE, decode_token, keyset_page
+
+logger = logging.getLogger(__name__)
 
 class Magazine:
+    __slots__ = ('id', 'name', 'category')
+
+    # Column order expected by _from_tuples()
+    COLUMNS = "id, name, category"
+    # Session flush order (authors and magazines before articles) and identity-map lookup keys
+    FLUSH_ORDER = 0
+    LOOKUP_FIELDS = ('name',)
+
     def __init__(self, name, category, id=None):
         self.id = id
         self.name = name
         self.category = category
 
+    @classmethod
+    def _from_row(cls, row):
+        return cls(row['name'], row['category'], row['id'])
+
+    @classmethod
+    def _from_tuples(cls, rows):
+        """Positional fast path: build magazines from plain tuples in COLUMNS order."""
+        return [cls(name, category, id) for id, name, category in rows]
+
+    @classmethod
+    def _load_by_ids(cls, ids):
+        return load_by_ids(
+            cls, "Magazine.load_by_ids", "SELECT id, name, category FROM magazines WHERE id IN ({placeholders})", ids
+        )
+
     @classmethod
     def find_by_id(cls, magazine_id):
-        magazine = None
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name, category FROM magazines WHERE id = ?", (magazine_id,))
-                row = cursor.fetchone()
+        magazine = lookup(cls, magazine_id)
+        if magazine is not None:
+            return magazine
+        try:
+            with read_connection() as conn:
+                row = fetch_one(
+                    conn, "Magazine.find_by_id", "SELECT id, name, category FROM magazines WHERE id = ?", (magazine_id,)
+                )
                 if row:
-                    magazine = cls(row['name'], row['category'], row['id'])
-            except sqlite3.Error as e:
-                print(f"Error finding magazine by ID: {e}")
-            finally:
-                close_connection(conn)
+                    magazine = remember(cls(row['name'], row['category'], row['id']))
+        except sqlite3.Error as e:
+            logger.error("Error finding magazine by ID: %s", e)
         return magazine
 
     @classmethod
     def find_by_name(cls, name):
-        magazine = None
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name, category FROM magazines WHERE name = ?", (name,))
-                row = cursor.fetchone()
+        magazine = lookup_by(cls, 'name', name)
+        if magazine is not None:
+            return magazine
+        try:
+            with read_connection() as conn:
+                row = fetch_one(
+                    conn, "Magazine.find_by_name", "SELECT id, name, category FROM magazines WHERE name = ?", (name,)
+                )
                 if row:
-                    magazine = cls(row['name'], row['category'], row['id'])
-            except sqlite3.Error as e:
-                print(f"Error finding magazine by name: {e}")
-            finally:
-                close_connection(conn)
+                    magazine = remember(cls(row['name'], row['category'], row['id']), 'name')
+        except sqlite3.Error as e:
+            logger.error("Error finding magazine by name: %s", e)
         return magazine
 
     @classmethod
     def find_by_category(cls, category):
         magazines = []
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name, category FROM magazines WHERE category = ?", (category,))
-                rows = cursor.fetchall()
-                for row in rows:
-                    magazines.append(cls(row['name'], row['category'], row['id']))
-            except sqlite3.Error as e:
-                print(f"Error finding magazines by category: {e}")
-            finally:
-                close_connection(conn)
+        try:
+            with read_connection() as conn:
+                rows = fetch_all(
+                    conn, "Magazine.find_by_category",
+                    f"SELECT {cls.COLUMNS} FROM magazines WHERE category = ?", (category,), tuples=True
+                )
+                magazines = cls._from_tuples(rows)
+        except sqlite3.Error as e:
+            logger.error("Error finding magazines by category: %s", e)
         return magazines
 
+    @classmethod
+    def find_page_by_category(cls, category, page_size=DEFAULT_PAGE_SIZE, after=None):
+        """One page of magazines in id order; pass ``page.next_token`` as ``after``."""
+        scope = f"magazines:category:{category}"
+        last_id = decode_token(scope, after)
+        magazines = []
+        try:
+            with read_connection() as conn:
+                rows = fetch_all(
+                    conn, "Magazine.find_page_by_category",
+                    f"SELECT {cls.COLUMNS} FROM magazines WHERE category = ? AND id > ? ORDER BY id LIMIT ?",
+                    (category, -1 if last_id is None else last_id, page_size + 1), tuples=True
+                )
+                magazines = cls._from_tuples(rows)
+        except sqlite3.Error as e:
+            logger.error("Error paging magazines by category: %s", e)
+        return keyset_page(magazines, page_size, scope, lambda m: m.id)
+
+    @classmethod
+    def iter_by_category(cls, category, batch_size=DEFAULT_BATCH_SIZE):
+        """Lazily yield the magazines find_by_category() would return."""
+        try:
+            with closing(iter_batches(
+                "Magazine.iter_by_category",
+                f"SELECT {cls.COLUMNS} FROM magazines WHERE category = ?", (category,), batch_size
+            )) as batches:
+                for batch in batches:
+                    yield from cls._from_tuples(batch)
+        except sqlite3.Error as e:
+            logger.error("Error streaming magazines by category: %s", e)
+
+    @classmethod
+    def find_by_ids(cls, ids):
+        """{id: Magazine or None} for every id, in input order; see Author.find_by_ids()."""
+        ids = list(ids)
+        found = {}
+        try:
+            found = cls._load_by_ids(ids)
+        except sqlite3.Error as e:
+            logger.error("Error finding magazines by ID: %s", e)
+        return {id: found.get(id) for id in ids}
+
+    @classmethod
+    def find_by_names(cls, names):
+        """{name: Magazine or None} for every name, in input order; batched like find_by_ids()."""
+        names = list(names)
+        found = {}
+        try:
+            found = load_by(
+                cls, "Magazine.find_by_names",
+                "SELECT id, name, category FROM magazines WHERE name IN ({placeholders})", 'name', names
+            )
+        except sqlite3.Error as e:
+            logger.error("Error finding magazines by name: %s", e)
+        return {name: found.get(name) for name in names}
+
+    @classmethod
+    def get_or_create(cls, name, category):
+        """The magazine called ``name``, inserted with ``category`` if there isn't one.
+
+        An existing magazine keeps its own category and is only read, as
+        in Author.get_or_create().
+        """
+        magazine = lookup_by(cls, 'name', name)
+        if magazine is not None:
+            return magazine
+        select = "SELECT id, name, category FROM magazines WHERE name = ?"
+        try:
+            with connection() as conn:
+                rows = fetch_all(conn, "Magazine.get_or_create", select, (name,), tuples=True)
+                if not rows:
+                    execute(conn, "Magazine.get_or_create.insert",
+                            "INSERT INTO magazines (name, category) VALUES (?, ?) ON CONFLICT (name) DO NOTHING",
+                            (name, category))
+                    if current_session() is None:
+                        conn.commit()
+                    rows = fetch_all(conn, "Magazine.get_or_create", select, (name,), tuples=True)
+                magazine = remember(cls._from_tuples(rows)[0], 'name')
+        except sqlite3.Error as e:
+            logger.error("Error getting or creating magazine: %s", e)
+        return magazine
+
+    def _state(self):
+        return (self.name, self.category)
+
+    def _write(self, conn):
+        if self.id is None:
+            cursor = execute(
+                conn, "Magazine.save",
+                "INSERT INTO magazines (name, category) VALUES (?, ?)",
+                (self.name, self.category)
+            )
+            self.id = cursor.lastrowid
+        else:
+            execute(
+                conn, "Magazine.save",
+                "UPDATE magazines SET name = ?, category = ? WHERE id = ?",
+                (self.name, self.category, self.id)
+            )
+
     def save(self):
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                if self.id is None:
-                    cursor.execute(
-                        "INSERT INTO magazines (name, category) VALUES (?, ?)",
-                        (self.name, self.category)
-                    )
-                    self.id = cursor.lastrowid
-                else:
-                    cursor.execute(
-                        "UPDATE magazines SET name = ?, category = ? WHERE id = ?",
-                        (self.name, self.category, self.id)
-                    )
+        """Insert or update and commit; inside a Session, only register for its flush."""
+        if in_session(self):
+            return
+        try:
+            if in_write_queue(self):
+                return
+            with connection() as conn:
+                self._write(conn)
                 conn.commit()
-            except sqlite3.Error as e:
-                print(f"Error saving magazine: {e}")
-            finally:
-                close_connection(conn)
+                refresh(self, 'name')
+        except sqlite3.Error as e:
+            logger.error("Error saving magazine: %s", e)
+
+    @classmethod
+    def bulk_create(cls, magazines, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        return bulk_insert(
+            "magazines", ("name", "category"), join_bulk(magazines),
+            lambda m: (m.name, m.category), chunk_size, progress
+        )
 
-    def articles(self):
+    @classmethod
+    def bulk_upsert(cls, magazines, update_category=False, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        """bulk_create() that gives magazines whose name already exists that row's id instead.
+
+        With ``update_category`` the existing rows take the given category.
+        """
+        return bulk_upsert(
+            "magazines", ("name", "category"), join_bulk(magazines), lambda m: (m.name, m.category),
+            update=("category",) if update_category else (), saved=forget if update_category else None,
+            chunk_size=chunk_size, progress=progress
+        )
+
+    @classmethod
+    def bulk_update(cls, magazines, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        return bulk_update(
+            "magazines", ("name", "category"), join_bulk(map(forget, magazines)),
+            lambda m: (m.name, m.category, m.id), chunk_size, progress
+        )
+
+    def articles(self, with_related=()):
         from .article import Article
-        return Article.find_by_magazine_id(self.id)
+        return Article.find_by_magazine_id(self.id, with_related=with_related)
 
     def article_titles(self):
         titles = []
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT title FROM articles WHERE magazine_id = ?", (self.id,))
-                rows = cursor.fetchall()
+        try:
+            with read_connection_for(self.id) as conn:
+                rows = fetch_all(
+                    conn, "Magazine.article_titles", "SELECT title FROM articles WHERE magazine_id = ?", (self.id,)
+                )
                 titles = [row['title'] for row in rows]
-            except sqlite3.Error as e:
-                print(f"Error getting article titles for magazine {self.name}: {e}")
-            finally:
-                close_connection(conn)
+        except sqlite3.Error as e:
+            logger.error("Error getting article titles for magazine %s: %s", self.name, e)
         return titles
 
+    @cached_result("Magazine.contributing_authors", key=lambda magazine: (magazine.id,))
     def contributing_authors(self): # This method is explicitly called by some tests
         authors = []
-        conn = get_connection()
-        if conn:
+        shards = get_shards()
+        if shards is not None:
+            from .author import Author
             try:
-                cursor = conn.cursor()
-                cursor.execute("""
+                # The magazine's articles are on one shard; the authors are in the catalog
+                with shards.read_connection(shards.shard_for(self.id)) as conn:
+                    rows = fetch_all(
+                        conn, "Magazine.contributing_authors",
+                        "SELECT DISTINCT author_id FROM articles WHERE magazine_id = ?", (self.id,), tuples=True
+                    )
+                found = Author._load_by_ids(id for id, in rows)
+                authors = [found[id] for id in sorted(found)]
+            except sqlite3.Error as e:
+                logger.error("Error getting contributing authors for magazine %s: %s", self.name, e)
+            return authors
+        try:
+            with read_connection() as conn:
+                rows = fetch_all(conn, "Magazine.contributing_authors", """
                     SELECT DISTINCT authors.id, authors.name
                     FROM authors
                     JOIN articles ON authors.id = articles.author_id
                     WHERE articles.magazine_id = ?
                 """, (self.id,))
-                rows = cursor.fetchall()
                 from .author import Author
                 for row in rows:
                     authors.append(Author(row['name'], row['id']))
-            except sqlite3.Error as e:
-                print(f"Error getting contributing authors for magazine {self.name}: {e}")
-            finally:
-                close_connection(conn)
+        except sqlite3.Error as e:
+            logger.error("Error getting contributing authors for magazine %s: %s", self.name, e)
         return authors
 
     # NEW: Add this method to satisfy tests explicitly calling 'contributors()'
@@ -126,47 +285,121 @@ class Magazine:
         return self.contributing_authors() # This method simply calls the other one
 
     @classmethod
+    @cached_result("Magazine.with_multiple_authors")
     def with_multiple_authors(cls):
         magazines = []
-        conn = get_connection()
-        if conn:
+        shards = get_shards()
+        if shards is not None:
             try:
-                cursor = conn.cursor()
-                cursor.execute("""
+                # All of a magazine's articles are on one shard, so its summary row there is complete
+                ids = shards.scatter_rows(
+                    "Magazine.with_multiple_authors",
+                    "SELECT magazine_id FROM magazine_stats WHERE author_count > 1"
+                )
+                found = cls._load_by_ids(id for id, in ids)
+                magazines = [found[id] for id in sorted(found)]
+            except sqlite3.Error as e:
+                logger.error("Error finding magazines with multiple authors: %s", e)
+            return magazines
+        try:
+            with read_connection() as conn:
+                # magazine_stats is kept up to date by triggers on articles (see lib/db/aggregates.py)
+                rows = fetch_all(conn, "Magazine.with_multiple_authors", """
                     SELECT magazines.id, magazines.name, magazines.category
-                    FROM magazines
-                    JOIN articles ON magazines.id = articles.magazine_id
-                    GROUP BY magazines.id, magazines.name, magazines.category
-                    HAVING COUNT(DISTINCT articles.author_id) > 1
+                    FROM magazine_stats INDEXED BY idx_magazine_stats_author_count
+                    JOIN magazines ON magazines.id = magazine_stats.magazine_id
+                    WHERE magazine_stats.author_count > 1
+                    ORDER BY magazines.id
                 """)
-                rows = cursor.fetchall()
                 for row in rows:
                     magazines.append(cls(row['name'], row['category'], row['id']))
-            except sqlite3.Error as e:
-                print(f"Error finding magazines with multiple authors: {e}")
-            finally:
-                close_connection(conn)
+        except sqlite3.Error as e:
+            logger.error("Error finding magazines with multiple authors: %s", e)
         return magazines
 
     @classmethod
+    @cached_result("Magazine.article_counts", freeze=lambda counts: tuple(tuple(count.items()) for count in counts),
+                   thaw=lambda counts: [dict(count) for count in counts])
     def article_counts(cls):
         counts_list = []
-        conn = get_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT magazines.name, COUNT(articles.id) AS article_count
+        shards = get_shards()
+        if shards is not None:
+            return cls._article_counts_sharded(shards)
+        try:
+            with read_connection() as conn:
+                rows = fetch_all(conn, "Magazine.article_counts", """
+                    SELECT magazines.name, COALESCE(SUM(magazine_stats.article_count), 0) AS article_count
                     FROM magazines
-                    LEFT JOIN articles ON magazines.id = articles.magazine_id
+                    LEFT JOIN magazine_stats ON magazine_stats.magazine_id = magazines.id
                     GROUP BY magazines.name
                 """)
-                rows = cursor.fetchall()
                 for row in rows:
                     counts_list.append({'name': row['name'], 'article_count': row['article_count']})
-            except sqlite3.Error as e:
-                print(f"Error getting article counts: {e}")
-            finally:
-                close_connection(conn)
+        except sqlite3.Error as e:
+            logger.error("Error getting article counts: %s", e)
         return counts_list
 
+    @classmethod
+    def _article_counts_sharded(cls, shards):
+        counts_list = []
+        try:
+            counts = dict(shards.scatter_rows(
+                "Magazine.article_counts", "SELECT magazine_id, article_count FROM magazine_stats"
+            ))
+            # Same shape as the unsharded query: one entry per magazine name, in name order
+            by_name = {}
+            with read_connection() as conn:
+                for id, name in fetch_all(
+                    conn, "Magazine.article_counts.names", "SELECT id, name FROM magazines ORDER BY name", tuples=True
+                ):
+                    by_name[name] = by_name.get(name, 0) + counts.get(id, 0)
+            counts_list = [{'name': name, 'article_count': count} for name, count in by_name.items()]
+        except sqlite3.Error as e:
+            logger.error("Error getting article counts: %s", e)
+        return counts_list
+
+    # --- asyncio counterparts: the blocking method runs on a database worker thread ---
+
+    @classmethod
+    async def afind_by_id(cls, magazine_id):
+        return await run_async(cls.find_by_id, magazine_id)
+
+    @classmethod
+    async def afind_by_name(cls, name):
+        return await run_async(cls.find_by_name, name)
+
+    @classmethod
+    async def afind_by_ids(cls, ids):
+        return await run_async(cls.find_by_ids, ids)
+
+    @classmethod
+    async def afind_by_names(cls, names):
+        return await run_async(cls.find_by_names, names)
+
+    @classmethod
+    async def aget_or_create(cls, name, category):
+        return await run_async(cls.get_or_create, name, category)
+
+    @classmethod
+    async def afind_by_category(cls, category):
+        return await run_async(cls.find_by_category, category)
+
+    async def asave(self):
+        return await run_async(self.save)
+
+    async def aarticles(self, with_related=()):
+        return await run_async(self.articles, with_related=with_related)
+
+    async def aarticle_titles(self):
+        return await run_async(self.article_titles)
+
+    async def acontributing_authors(self):
+        return await run_async(self.contributing_authors)
+
+    @classmethod
+    async def awith_multiple_authors(cls):
+        return await run_async(cls.with_multiple_authors)
+
+    @classmethod
+    async def aarticle_counts(cls):
+        return await run_async(cls.article_counts)
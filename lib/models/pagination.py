@@ -0,0 +1,41 @@
+# ARTICLES/lib/models/pagination.py
+import base64
+import json
+from collections import namedtuple
+
+DEFAULT_PAGE_SIZE = 50
+
+# items: the objects on this page; next_token: pass as ``after`` for the next
+# page, or None when this is the last one
+Page = namedtuple('Page', ['items', 'next_token'])
+
+
+def encode_token(scope, last_key):
+    payload = json.dumps([scope, last_key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_token(scope, token):
+    """Return the last key stored in ``token``, or None for the first page.
+
+    Tokens are tied to the query they came from: reusing one for a
+    different listing raises ValueError instead of silently skipping rows.
+    """
+    if token is None:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        token_scope, last_key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid page token: {token!r}") from e
+    if token_scope != scope:
+        raise ValueError("Page token belongs to a different listing")
+    return last_key
+
+
+def keyset_page(rows, page_size, scope, key_for):
+    """Trim a ``page_size + 1`` row fetch to a Page, minting the next token."""
+    if len(rows) <= page_size:
+        return Page(rows, None)
+    items = rows[:page_size]
+    return Page(items, encode_token(scope, key_for(items[-1])))
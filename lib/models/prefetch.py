@@ -0,0 +1,44 @@
+# ARTICLES/lib/models/prefetch.py
+from ..db.bulk import chunked
+from ..db.connection import read_connection
+from ..db.instrument import fetch_all
+from .identity_map import lookup, lookup_by, remember
+
+# Stay well under SQLite's host-parameter limit (999 on older builds)
+MAX_IN_VARIABLES = 500
+
+
+def placeholders(count):
+    return ", ".join("?" * count)
+
+
+def load_by_ids(cls, name, select_sql, ids):
+    """Load ``cls`` instances for ``ids`` with one IN query per chunk.
+
+    ``select_sql`` must contain a ``{placeholders}`` slot inside ``IN (...)``.
+    Rows already in the identity map are not queried again. Returns a dict
+    of id -> instance; ids with no row are simply absent.
+    """
+    return load_by(cls, name, select_sql, 'id', ids)
+
+
+def load_by(cls, name, select_sql, field, values):
+    """load_by_ids() for any unique ``field`` (e.g. ``'name'``); returns a dict of value -> instance."""
+    found = {}
+    missing = []
+    for value in dict.fromkeys(values):
+        if value is None:
+            continue
+        obj = lookup(cls, value) if field == 'id' else lookup_by(cls, field, value)
+        if obj is not None:
+            found[value] = obj
+        else:
+            missing.append(value)
+    if missing:
+        fields = () if field == 'id' else (field,)
+        with read_connection() as conn:
+            for chunk in chunked(missing, MAX_IN_VARIABLES):
+                sql = select_sql.format(placeholders=placeholders(len(chunk)))
+                for row in fetch_all(conn, name, sql, chunk):
+                    found[row[field]] = remember(cls._from_row(row), *fields)
+    return found
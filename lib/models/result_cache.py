@@ -0,0 +1,224 @@
+# ARTICLES/lib/models/result_cache.py
+"""Cache of the analytic read methods' results, valid until the data changes.
+
+Results are keyed by method name, database file(s) and arguments, and
+stored with the files' ``PRAGMA data_version`` at the time. That number
+changes whenever any other connection, in this process or another one,
+commits to the file, and reading it costs a few microseconds on a
+connection kept open for the purpose. A hit is served only while the
+version is unchanged, the entry is younger than the TTL and the cache has
+not evicted it (LRU, bounded size). Each process has its own cache.
+
+Calls are passed straight through when the caller could see uncommitted
+writes (on a connection inside an open transaction) and results of calls
+that hit a database error are never stored. The cache keeps row tuples,
+not model instances: every call gets instances of its own.
+
+    ARTICLES_DB_RESULT_CACHE_SIZE=0 ...          # turn it off
+    configure_result_cache(maxsize=4096, ttl=300)
+    result_cache_stats()  # {'hits': ..., 'hit_rate': ..., ...}
+"""
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ..db import connection as db
+from ..db.instrument import thread_errors
+from ..db.sharding import get_shards
+
+DEFAULT_MAXSIZE = int(os.environ.get("ARTICLES_DB_RESULT_CACHE_SIZE", "1024"))
+DEFAULT_TTL = float(os.environ.get("ARTICLES_DB_RESULT_CACHE_TTL", "60"))
+
+
+class ResultCache:
+    """A bounded LRU map of call key -> (data versions, expiry time, result)."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Open read-only per database file and only ever used for PRAGMA data_version
+        self._watchers = {}
+        self._watch_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def _versions(self, databases):
+        """data_version of each file, or None if one can't be read (e.g. not created yet)."""
+        versions = []
+        with self._watch_lock:
+            for database in databases:
+                watcher = self._watchers.get(database)
+                try:
+                    if watcher is None:
+                        if database.startswith("file:"):
+                            # An in-memory database's URI can't also say mode=ro
+                            watcher = db.connect(database, isolation_level=None, check_same_thread=False)
+                            watcher.execute("PRAGMA query_only = 1")
+                        else:
+                            watcher = sqlite3.connect(f"file:{database}?mode=ro", uri=True,
+                                                      isolation_level=None, check_same_thread=False)
+                        self._watchers[database] = watcher
+                    versions.append(watcher.execute("PRAGMA data_version").fetchone()[0])
+                except sqlite3.Error:
+                    return None
+        return tuple(versions)
+
+    def get_or_call(self, key, databases, call):
+        """The cached result for ``key``, or ``call()``'s result (stored if the call succeeded)."""
+        if self.maxsize <= 0 or db.reads_own_writes():
+            with self._lock:
+                self.bypassed += 1
+            return call()
+        versions = self._versions(databases)
+        if versions is None:
+            with self._lock:
+                self.bypassed += 1
+            return call()
+        key = (key, databases)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == versions and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                if entry[0] != versions:
+                    self.stale += 1
+                else:
+                    self.expired += 1
+                del self._entries[key]
+            self.misses += 1
+        errors = thread_errors()
+        result = call()
+        if thread_errors() == errors:
+            with self._lock:
+                # The versions read before the call: a write that lands during it
+                # makes the entry stale on its next lookup rather than hiding it
+                self._entries[key] = (versions, now + self.ttl, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        with self._watch_lock:
+            for watcher in self._watchers.values():
+                watcher.close()
+            self._watchers.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = ResultCache()
+
+
+def get_result_cache():
+    return _cache
+
+
+def configure_result_cache(maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+    """Replace the process-wide cache; ``maxsize=0`` turns caching off."""
+    global _cache
+    _cache.clear()
+    _cache = ResultCache(maxsize, ttl)
+    return _cache
+
+
+@contextmanager
+def result_cache_disabled():
+    """Run the block with caching off (process-wide), e.g. to time the queries themselves."""
+    global _cache
+    previous = _cache
+    _cache = ResultCache(maxsize=0)
+    try:
+        yield
+    finally:
+        _cache = previous
+
+
+def clear_result_cache():
+    _cache.clear()
+
+
+def result_cache_stats():
+    return _cache.stats()
+
+
+def _databases():
+    # Articles may live in shard files as well as the catalog
+    shards = get_shards()
+    return (db.DATABASE_NAME,) + (tuple(shards.databases) if shards is not None else ())
+
+
+def _row(obj):
+    return tuple(getattr(obj, column) for column in type(obj).COLUMNS.split(", "))
+
+
+def freeze_models(result):
+    """A model instance, a list of instances or None as immutable row tuples (see thaw_models())."""
+    if result is None:
+        return None
+    if isinstance(result, list):
+        return (False, type(result[0]) if result else None, tuple(_row(obj) for obj in result))
+    return (True, type(result), (_row(result),))
+
+
+def thaw_models(frozen):
+    """Fresh instances, built with the model's ``_from_tuples()``, from freeze_models() output."""
+    if frozen is None:
+        return None
+    single, cls, rows = frozen
+    objects = cls._from_tuples(rows) if cls is not None else []
+    return objects[0] if single else objects
+
+
+def cached_result(name, key=None, freeze=freeze_models, thaw=thaw_models):
+    """Decorator serving a read method's result from the result cache.
+
+    ``key(*args)`` turns the call's arguments into a hashable key; the
+    default drops the first argument (``cls``) and uses the rest. The cache
+    holds ``freeze(result)``, which must be immutable, and every call gets
+    ``thaw()`` of it, so callers can change what they got back (e.g. a
+    model's attributes) without changing later results.
+    """
+    if key is None:
+        def key(owner, *args):
+            return args
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args):
+            return thaw(_cache.get_or_call((name, key(*args)), _databases(), lambda: freeze(method(*args))))
+        return wrapper
+    return decorator
@@ -0,0 +1,251 @@
+# ARTICLES/lib/models/session.py
+"""Unit of work: batch many model writes into one transaction.
+
+Outside a session every ``save()`` commits on its own. Inside one,
+``save()`` (and ``Author.add_article``) only registers the object; the
+session writes everything in dependency order when it is flushed, and
+commits once::
+
+    with Session() as session:
+        author = Author("Jane Doe")
+        magazine = Magazine("Tech Weekly", "Technology")
+        for title in titles:
+            author.add_article(magazine, title)   # nothing written yet
+    # one transaction: the author, the magazine, then every article,
+    # with the new author/magazine ids filled in on the articles
+
+The session holds one read-write connection and binds it to the thread,
+so finders called inside the block see the session's flushed writes. It
+also gets a private identity map; on commit the written objects replace
+any stale copies in the outer map. Leaving the block with an exception
+rolls everything back and resets the ids of rows inserted by it,
+including rows written by bulk_create() / bulk_upsert() / bulk_update()
+called inside the block.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from ..db.connection import bind_connection, get_pool
+from .identity_map import get_identity_map, identity_map_scope, refresh
+
+_current = ContextVar('session', default=None)
+
+
+def current_session():
+    """The Session active in this thread/task, or None."""
+    return _current.get()
+
+
+class Session:
+    """Tracks new and changed model objects and writes them in one transaction.
+
+    Objects are flushed by the model's ``FLUSH_ORDER`` (authors and
+    magazines before articles) and in the order they were added within a
+    level. An object is written on the first flush after it is added and,
+    after that, only if its column values changed since the last flush.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._tracked = {}  # id(obj) -> [obj, snapshot of the last flushed state or None]
+        self._inserted = []  # objects given an id by this transaction
+        self._flushed = []  # objects written by this transaction
+        self._savepoints = 0
+        self._scope = None
+        self._outer_map = None
+        self._bind = None
+        self._token = None
+
+    # --- lifecycle ---
+
+    def __enter__(self):
+        if self._conn is not None:
+            raise RuntimeError("Session is already active")
+        self._outer_map = get_identity_map()
+        self._conn = get_pool().acquire()
+        self._bind = bind_connection(self._conn)
+        self._bind.__enter__()
+        self._scope = identity_map_scope()
+        self._scope.__enter__()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            _current.reset(self._token)
+            self._scope.__exit__(None, None, None)
+            self._bind.__exit__(None, None, None)
+            get_pool().release(self._conn)
+            self._conn = None
+        return False
+
+    @property
+    def connection(self):
+        if self._conn is None:
+            raise RuntimeError("Session is not active; use it as 'with Session() as session:'")
+        return self._conn
+
+    # --- tracking ---
+
+    def add(self, obj):
+        """Track ``obj`` (and any unsaved objects it depends on) for the next flush."""
+        dependencies = getattr(obj, '_dependencies', None)
+        if dependencies is not None:
+            for dependency in dependencies():
+                self.add(dependency)
+        entry = self._tracked.get(id(obj))
+        if entry is None:
+            self._tracked[id(obj)] = [obj, None]
+        else:
+            # Saved again: write it on the next flush even if nothing changed
+            entry[1] = None
+        return obj
+
+    def add_all(self, objects):
+        for obj in objects:
+            self.add(obj)
+
+    def __contains__(self, obj):
+        return id(obj) in self._tracked
+
+    @property
+    def new(self):
+        return [obj for obj, _ in self._tracked.values() if obj.id is None]
+
+    @property
+    def dirty(self):
+        return [
+            obj for obj, snapshot in self._tracked.values()
+            if obj.id is not None and snapshot != obj._state()
+        ]
+
+    # --- writing ---
+
+    def begin(self):
+        """Start the session's transaction if it hasn't started; flush() does this when it has work."""
+        conn = self.connection
+        if not conn.in_transaction:
+            # IMMEDIATE takes the write lock up front, so a later write in this
+            # transaction can't fail with SQLITE_BUSY after earlier reads
+            conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def flush(self):
+        """Write pending changes inside the session's transaction without committing."""
+        pending = [
+            obj for obj, snapshot in self._tracked.values()
+            if obj.id is None or snapshot != obj._state()
+        ]
+        if not pending:
+            return
+        conn = self.begin()
+        pending.sort(key=lambda obj: type(obj).FLUSH_ORDER)
+        for obj in pending:
+            was_new = obj.id is None
+            obj._write(conn)
+            if was_new:
+                self._inserted.append(obj)
+            self._flushed.append(obj)
+            self._tracked[id(obj)][1] = obj._state()
+
+    def commit(self):
+        """Flush and commit; if that fails, everything is rolled back (see rollback()) and the error raised."""
+        conn = self.connection
+        try:
+            self.flush()
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            # The transaction is gone: ids handed out by it must not outlive it
+            self.rollback()
+            raise
+        for obj in self._flushed:
+            refresh(obj, *type(obj).LOOKUP_FIELDS)
+            if self._outer_map is not None:
+                self._outer_map.refresh(obj, *type(obj).LOOKUP_FIELDS)
+        self._inserted.clear()
+        self._flushed.clear()
+
+    def rollback(self):
+        """Undo everything since the last commit; inserted objects lose their ids again."""
+        conn = self.connection
+        if conn.in_transaction:
+            conn.rollback()
+        self._reset_ids(self._inserted)
+        self._inserted.clear()
+        self._flushed.clear()
+        self._tracked.clear()
+
+    def _track_new(self, objects):
+        for obj in objects:
+            if obj.id is None:
+                # Whatever id the bulk write gives it is undone by a rollback
+                self._inserted.append(obj)
+            yield obj
+
+    def _reset_ids(self, inserted):
+        imap = get_identity_map()
+        for obj in inserted:
+            if imap is not None:
+                imap.discard(type(obj), obj.id)
+            obj.id = None
+
+    @contextmanager
+    def savepoint(self):
+        """Nested transaction: an exception inside the block undoes only the block.
+
+        Pending objects are flushed first so the savepoint starts from a
+        known state. On rollback, objects inserted in the block lose their
+        ids, and everything added or written in the block is dropped from
+        the session (its in-memory values are left as they are).
+        """
+        self.flush()
+        conn = self.begin()
+        self._savepoints += 1
+        name = f"session_sp_{self._savepoints}"
+        inserted_mark, flushed_mark = len(self._inserted), len(self._flushed)
+        tracked_before = set(self._tracked)
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield self
+            self.flush()
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            self._reset_ids(self._inserted[inserted_mark:])
+            dropped = (set(self._tracked) - tracked_before) | {id(obj) for obj in self._flushed[flushed_mark:]}
+            for key in dropped:
+                self._tracked.pop(key, None)
+            del self._inserted[inserted_mark:]
+            del self._flushed[flushed_mark:]
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+
+
+def in_session(obj):
+    """Register ``obj`` with the active session; True if there was one."""
+    session = current_session()
+    if session is None:
+        return False
+    session.add(obj)
+    return True
+
+
+def join_bulk(objects):
+    """Make a bulk write part of the active Session's transaction, if there is one.
+
+    Starting the transaction makes lib/db/bulk.py put each chunk in a
+    savepoint instead of committing it. Returns ``objects``, wrapped so
+    that the unsaved ones lose their ids again if the session rolls back.
+    """
+    session = current_session()
+    if session is None:
+        return objects
+    session.begin()
+    return session._track_new(objects)
@@ -0,0 +1,42 @@
+# ARTICLES/lib/models/streaming.py
+import time
+
+from ..db.connection import dedicated_connection
+from ..db.instrument import capture, record
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def iter_batches(name, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """Yield lists of up to ``batch_size`` plain tuples for ``sql``.
+
+    Rows come back as tuples rather than sqlite3.Row so the models can use
+    their positional ``_from_tuples`` path. The pooled connection is held
+    only while the generator is running and is returned as soon as it is
+    exhausted or closed (e.g. on ``break``). Time spent inside SQLite, not
+    in the consumer's loop body, is recorded under ``name``.
+    """
+    capture(name, sql, params)
+    with dedicated_connection(read_only=True) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        elapsed = 0.0
+        rows_seen = 0
+        failed = False
+        try:
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                elapsed += time.perf_counter() - started
+                if not rows:
+                    return
+                rows_seen += len(rows)
+                yield rows
+                started = time.perf_counter()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            cursor.close()
+            record(name, elapsed, rows_seen, error=failed)
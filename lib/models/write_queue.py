@@ -0,0 +1,283 @@
+# ARTICLES/lib/models/write_queue.py
+"""Group commit: one background thread performs every write.
+
+Threads hand model objects to the queue instead of each opening a
+connection and competing for SQLite's write lock. The writer thread
+takes up to ``max_batch`` of them, waiting at most ``max_delay`` seconds
+for more to arrive after the first, writes them all in one transaction
+and commits once::
+
+    queue = start_write_queue(max_batch=500, max_delay=0.005)
+    # from any thread: save() now waits for the group commit
+    author.save()
+    future = queue.submit(Article("Title", "...", author.id, magazine.id))
+    future.result()   # the new id, once committed
+    stop_write_queue()
+
+Each object is written inside its own savepoint, so one that fails (say
+a duplicate name) fails only its own future. When the queue holds
+``maxsize`` objects, submit() waits up to ``put_timeout`` seconds for
+room and then raises sqlite3.OperationalError, like an exhausted pool.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from ..db.connection import get_pool
+from ..db.instrument import record
+from .identity_map import refresh
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_DELAY = 0.005
+DEFAULT_MAXSIZE = 10000
+DEFAULT_PUT_TIMEOUT = 5.0
+
+COMMIT = "write_queue.commit"
+_STOP = object()
+
+
+class WriteQueue:
+    """A bounded queue of model writes served by a single writer thread."""
+
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY,
+                 maxsize=DEFAULT_MAXSIZE, put_timeout=DEFAULT_PUT_TIMEOUT):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize)
+        self._pending = {}  # id(obj) -> Future, for objects submitted but not yet written
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._counters = {
+            'submitted': 0,
+            'committed': 0,
+            'failed': 0,
+            'batches': 0,
+            'largest_batch': 0,
+            'full': 0,
+        }
+
+    # --- lifecycle ---
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("WriteQueue is already running")
+        self._thread = threading.Thread(target=self._run, name="articles-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """Stop accepting writes, let the writer finish what is queued, and stop it."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # --- submitting ---
+
+    def submit(self, obj):
+        """Queue ``obj`` to be inserted or updated; returns a Future of its id.
+
+        Unsaved objects it depends on (an Article's new author or magazine)
+        are queued first, unless they are queued already.
+        """
+        dependencies = getattr(obj, '_dependencies', None)
+        if dependencies is not None:
+            for dependency in dependencies():
+                if id(dependency) not in self._pending:
+                    self.submit(dependency)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("WriteQueue is closed")
+            self._counters['submitted'] += 1
+            self._pending[id(obj)] = future
+        try:
+            self._queue.put((obj, future), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._counters['full'] += 1
+                self._pending.pop(id(obj), None)
+            raise sqlite3.OperationalError(
+                f"Timed out after {self.put_timeout}s waiting for room in the write queue"
+            ) from None
+        return future
+
+    # --- the writer thread ---
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch, then stop
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        pool = get_pool()
+        try:
+            conn = pool.acquire()
+        except sqlite3.Error as e:
+            logger.error("Write queue could not get a connection: %s", e)
+            with self._lock:
+                self._closed = True
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not _STOP:
+                    self._finish(*item, error=e)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._write_batch(conn, batch)
+        finally:
+            pool.release(conn)
+
+    def _write_batch(self, conn, batch):
+        started = time.perf_counter()
+        written = []
+        inserted = []
+        try:
+            # IMMEDIATE: take the write lock once for the whole batch
+            conn.execute("BEGIN IMMEDIATE")
+            for obj, future in batch:
+                was_new = obj.id is None
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    obj._write(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO queued_write")
+                    conn.execute("RELEASE queued_write")
+                    if was_new:
+                        obj.id = None
+                    self._finish(obj, future, error=e)
+                    continue
+                conn.execute("RELEASE queued_write")
+                written.append((obj, future))
+                if was_new:
+                    inserted.append(obj)
+            conn.commit()
+        except BaseException as e:
+            # The transaction is lost: nothing in it was written
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            for obj in inserted:
+                obj.id = None
+            for obj, future in batch:
+                if not future.done():
+                    self._finish(obj, future, error=e)
+            record(COMMIT, time.perf_counter() - started, error=True)
+            logger.error("Write queue batch of %d failed: %s", len(batch), e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        record(COMMIT, time.perf_counter() - started, rows=len(written))
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['largest_batch'] = max(self._counters['largest_batch'], len(batch))
+        for obj, future in written:
+            refresh(obj, *type(obj).LOOKUP_FIELDS)
+            self._finish(obj, future)
+
+    def _finish(self, obj, future, error=None):
+        with self._lock:
+            if self._pending.get(id(obj)) is future:
+                del self._pending[id(obj)]
+            self._counters['failed' if error is not None else 'committed'] += 1
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(obj.id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(
+            queued=self._queue.qsize(),
+            maxsize=self._queue.maxsize,
+            max_batch=self.max_batch,
+            max_delay=self.max_delay,
+            running=self._thread is not None and self._thread.is_alive(),
+        )
+        return stats
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def start_write_queue(max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY,
+                      maxsize=DEFAULT_MAXSIZE, put_timeout=DEFAULT_PUT_TIMEOUT):
+    """Route every model save() outside a Session through a new process-wide WriteQueue."""
+    global _active
+    with _active_lock:
+        if _active is not None:
+            _active.close()
+        _active = WriteQueue(max_batch, max_delay, maxsize, put_timeout).start()
+        return _active
+
+
+def stop_write_queue():
+    """Write what is still queued and go back to saving on the calling thread."""
+    global _active
+    with _active_lock:
+        if _active is not None:
+            _active.close()
+        _active = None
+
+
+def get_write_queue():
+    return _active
+
+
+def in_write_queue(obj):
+    """Save ``obj`` through the active WriteQueue, waiting for its commit; True if there was one.
+
+    Write errors are raised here, on the caller's thread. The written
+    objects are refreshed in the caller's identity map here too: the writer
+    thread can only refresh the process-wide one, not a caller's scope.
+    """
+    active = _active
+    if active is None or threading.current_thread() is active._thread:
+        return False
+    dependencies = getattr(obj, '_dependencies', None)
+    written = [*(dependencies() if dependencies is not None else ()), obj]
+    active.submit(obj).result()
+    for written_obj in written:
+        refresh(written_obj, *type(written_obj).LOOKUP_FIELDS)
+    return True
@@ -1,5 +1,7 @@
+from lib.db.migrations import migrate
 from lib.db.seed import seed_data
 
 if __name__ == "__main__":
     seed_data()
+    migrate(verbose=True)
     print("Database setup complete.")
@@ -3,16 +3,19 @@ from lib.models.author import Author
 from lib.models.magazine import Magazine
 from lib.models.article import Article
 
-from lib.db.connection import get_connection, close_connection, create_tables
+from lib.db.connection import get_connection, close_connection, create_tables, use_database
 import sqlite3
 import pytest
 import os
+import time
 from faker import Faker
 from random import random
 
 if not callable(globals().get("get_connection")):
     from search_db_conn import get_connection
 
+fake = Faker()
+
 def insert_values(tbl, vals={}):
     conn = get_connection()
     cursor = conn.cursor()
@@ -22,9 +25,9 @@ def insert_values(tbl, vals={}):
         col, type = i
         if col in vals or col.count("_id") > 0 or col == 'id': continue
         if hasattr(Faker, col):
-            vals[col] = getattr(Faker(), col)
+            vals[col] = getattr(fake, col)
         elif type == "TEXT":
-            vals[col] = Faker().text(max_nb_chars=10)
+            vals[col] = fake.text(max_nb_chars=10)
         else:
             vals[col] = int(random())
 
@@ -35,27 +38,13 @@ def insert_values(tbl, vals={}):
     conn.commit()
     conn.close()
 
-def init_schema():
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    
-    for dirpath, dirnames, filenames in os.walk("."):
-        for filename in filenames:
-            if filename == "schema.sql":
-                full_path = os.path.join(dirpath, filename)           
-                with open(full_path) as f:
-                    conn.executescript(f.read())
-
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM authors")
-    cursor.execute("DELETE FROM magazines")
-    cursor.execute("DELETE FROM articles")
-    conn.commit()
-    conn.close()
-
-@pytest.fixture(scope="session", autouse=True)
-def setup_before_all_tests():
-    init_schema()
+@pytest.fixture(scope="session")
+def template_database(tmp_path_factory):
+    """A migrated, seeded database file that test databases are cloned from."""
+    from lib.db.migrations import migrate
+    template = str(tmp_path_factory.mktemp("template") / "articles.db")
+    migrate(template)
+    use_database(template)
 
     insert_values("authors", {"name":'Alice'})
     insert_values("authors", {"name":'Bob'})
@@ -66,6 +55,12 @@ def setup_before_all_tests():
     insert_values("articles", {"title":"AI Revolution", "author_id":1, "magazine_id":1})
     insert_values("articles", {"title":"Future of Health", "author_id":1, "magazine_id":2})
     insert_values("articles", {"title":"Cybersecurity Tips", "author_id":2, "magazine_id":1})
+    return template
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_before_all_tests(tmp_path_factory, template_database):
+    # A copy of the template of this run's own rather than the shared articles.db
+    use_database(str(tmp_path_factory.mktemp("db") / "articles.db"), template=template_database)
 
 def clean_up(tbl):
     conn = get_connection()
@@ -212,3 +207,1142 @@ def test_top_author_by_articles():
     row = get_row("articles")
     assert get_value(row, top, 'name') == "Alice"
 
+
+
+### Connection Pool Tests ###
+
+def test_pool_reuses_connections():
+    from lib.db.connection import ConnectionPool, DATABASE_NAME
+    pool = ConnectionPool(DATABASE_NAME, size=2)
+    with pool.connection() as first:
+        with pool.connection() as nested:
+            assert nested is first
+    with pool.connection() as second:
+        assert second is first
+    stats = pool.stats()
+    assert stats['created'] == 1 and stats['reused'] == 1 and stats['in_use'] == 0
+    pool.close()
+
+def test_pool_times_out_when_exhausted():
+    import threading
+    from lib.db.connection import ConnectionPool, DATABASE_NAME
+    pool = ConnectionPool(DATABASE_NAME, size=1, timeout=0.05)
+    held = pool.acquire()
+    errors = []
+    def worker():
+        try:
+            with pool.connection():
+                pass
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    pool.release(held)
+    assert len(errors) == 1 and pool.stats()['timeouts'] == 1
+    pool.close()
+
+
+### Identity Map Tests ###
+
+def test_identity_map_caches_lookups():
+    from lib.models.identity_map import identity_map_scope
+    with identity_map_scope() as imap:
+        article = Article.find_by_title("AI Revolution")
+        assert article.author() is Author.find_by_id(article.author_id)
+        assert Author.find_by_name("Alice") is Author.find_by_id(article.author_id)
+        assert imap.stats()['hits'] >= 2
+
+def test_identity_map_refreshes_on_save():
+    from lib.models.identity_map import identity_map_scope, identity_map_disabled
+    with identity_map_scope():
+        author = Author(name="Eve")
+        author.save()
+        assert Author.find_by_id(author.id) is author
+        author.name = "Eve Renamed"
+        author.save()
+        assert Author.find_by_name("Eve") is None
+        assert Author.find_by_name("Eve Renamed") is author
+        with identity_map_disabled():
+            assert Author.find_by_id(author.id) is not author
+
+def test_global_identity_map_is_opt_in():
+    from lib.models.identity_map import get_identity_map, set_identity_map_enabled
+    assert get_identity_map() is None
+    assert Author.find_by_name("Alice") is not Author.find_by_name("Alice")
+    set_identity_map_enabled(True)
+    try:
+        assert Author.find_by_name("Alice") is Author.find_by_name("Alice")
+    finally:
+        set_identity_map_enabled(False)
+
+def test_identity_map_evicts_lru():
+    from lib.models.identity_map import IdentityMap
+    imap = IdentityMap(maxsize=2)
+    for i in range(3):
+        imap.add(Author(f"A{i}", i + 1000), 'name')
+    assert imap.get(Author, 1000) is None
+    assert imap.get_by(Author, 'name', "A0") is None
+    assert imap.get(Author, 1002).name == "A2"
+    assert imap.stats()['evictions'] == 1
+
+
+### Bulk API Tests ###
+
+def test_bulk_create_assigns_ids():
+    authors = [Author(name=f"Bulk Author {i}") for i in range(5)]
+    stats = Author.bulk_create(authors, chunk_size=2)
+    assert stats.rows == 5 and stats.chunks == 3
+    for author in authors:
+        assert Author.find_by_id(author.id).name == author.name
+    mag = Magazine.find_by_name("Tech Times")
+    articles = [Article(f"Bulk {i}", "body", authors[0].id, mag.id) for i in range(3)]
+    Article.bulk_create(iter(articles))
+    assert [a.title for a in authors[0].articles()] == ["Bulk 0", "Bulk 1", "Bulk 2"]
+
+def test_bulk_update_changes_rows():
+    mags = [Magazine(name=f"Bulk Mag {i}", category="Bulk") for i in range(3)]
+    Magazine.bulk_create(mags)
+    for mag in mags:
+        mag.category = "Bulk Updated"
+    stats = Magazine.bulk_update(mags)
+    assert stats.rows == 3 and stats.rows_per_second > 0
+    assert len(Magazine.find_by_category("Bulk Updated")) == 3
+
+
+### Migration Tests ###
+
+def test_migrations_add_indexes(tmp_path):
+    from lib.db.migrations import migrate, LATEST_VERSION
+    db = str(tmp_path / "migrate.db")
+    assert migrate(db)[-1] == LATEST_VERSION
+    assert migrate(db) == []
+    conn = sqlite3.connect(db)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == LATEST_VERSION
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id, title FROM articles WHERE magazine_id = ?", (1,)))
+    conn.close()
+    assert "USING INDEX" in plan
+
+
+def test_migrated_tables_match_create_tables(tmp_path):
+    from lib.db import connection as db
+    from lib.db.migrations import migrate
+
+    def shape(database):
+        conn = sqlite3.connect(database)
+        try:
+            return {
+                table: (
+                    conn.execute(f"SELECT * FROM pragma_table_info('{table}')").fetchall(),
+                    conn.execute(f"SELECT * FROM pragma_foreign_key_list('{table}')").fetchall(),
+                    "AUTOINCREMENT" in conn.execute(
+                        "SELECT sql FROM sqlite_master WHERE name = ?", (table,)).fetchone()[0].upper(),
+                )
+                for table in ("authors", "magazines", "articles")
+            }
+        finally:
+            conn.close()
+
+    migrated = str(tmp_path / "migrated.db")
+    migrate(migrated)
+    created = str(tmp_path / "created.db")
+    previous = db.DATABASE_NAME
+    db.use_database(created)
+    try:
+        create_tables()
+    finally:
+        db.use_database(previous)
+    assert shape(migrated) == shape(created)
+    assert shape(migrated)["articles"][2]
+
+
+### Prefetch Tests ###
+
+def test_prefetch_uses_one_query_per_relation():
+    from lib.db.connection import connection
+    from lib.models.identity_map import identity_map_disabled
+    mag = Magazine.find_by_name("Tech Times")
+    statements = []
+    with identity_map_disabled(), connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            articles = mag.articles(with_related=("author", "magazine"))
+            names = {a.author().name for a in articles}
+            assert {a.magazine().name for a in articles} == {"Tech Times"}
+        finally:
+            conn.set_trace_callback(None)
+    assert {"Alice", "Bob"} <= names
+    assert len(statements) == 3
+
+
+### Streaming Tests ###
+
+def test_iter_by_magazine_id_streams_and_releases_connection():
+    from lib.db.connection import pool_stats
+    mag = Magazine.find_by_name("Tech Times")
+    expected = [a.title for a in Article.find_by_magazine_id(mag.id)]
+    assert [a.title for a in Article.iter_by_magazine_id(mag.id, batch_size=1)] == expected
+    stream = Article.iter_by_magazine_id(mag.id, batch_size=1)
+    next(stream)
+    assert pool_stats(read_only=True)['in_use'] == 1
+    stream.close()
+    assert pool_stats(read_only=True)['in_use'] == 0
+    assert [m.name for m in Magazine.iter_by_category("Technology")] == ["Tech Times"]
+
+
+### Compact Model Tests ###
+
+def test_models_use_slots_and_tuple_path():
+    article = Article("T", "C", 1, 2)
+    assert not hasattr(article, '__dict__')
+    built = Article._from_tuples([(7, "T", "C", 1, 2)])[0]
+    assert (built.id, built.title, built.content, built.author_id, built.magazine_id) == (7, "T", "C", 1, 2)
+    assert Magazine._from_tuples([(3, "M", "Cat")])[0].category == "Cat"
+    assert Author._from_tuples([(4, "A")])[0].name == "A"
+
+
+### Full-Text Search Tests ###
+
+def test_article_search_ranks_and_snippets():
+    author = Author.find_by_name("Alice")
+    mag = Magazine.find_by_name("Health Weekly")
+    Article("Sleep Science", "Deep sleep helps memory consolidation.", author.id, mag.id).save()
+    Article("Diet Notes", "Sleep matters, but so does diet.", author.id, mag.id).save()
+    results = Article.search("sleep")
+    assert [r['article'].title for r in results[:2]] == ["Sleep Science", "Diet Notes"]
+    assert "[Sleep]" in results[1]['snippet']
+    assert Article.search("sleep", magazine_id=mag.id + 1000) == []
+    article = results[0]['article']
+    article.content = "Rewritten without the keyword."
+    article.title = "Renamed"
+    article.save()
+    assert [r['article'].title for r in Article.search("consolidation")] == []
+    assert Article.search("memory: consolidation!") == []
+    assert len(Article.search("sleep OR diet", raw=True)) == 1
+
+
+### Pagination Tests ###
+
+def test_keyset_pagination_walks_all_rows():
+    author = Author(name="Pager")
+    author.save()
+    mags = [Magazine(name=f"Pager Mag {i}", category="Paging") for i in range(5)]
+    Magazine.bulk_create(mags)
+    Article.bulk_create(Article(f"Page {i}", "", author.id, mags[i % 5].id) for i in range(7))
+
+    titles, token = [], None
+    while True:
+        page = Article.find_page_by_author_id(author.id, page_size=3, after=token)
+        titles += [a.title for a in page.items]
+        token = page.next_token
+        if token is None:
+            break
+    assert titles == [f"Page {i}" for i in range(7)]
+
+    first = author.magazines_page(page_size=2)
+    rest = author.magazines_page(page_size=10, after=first.next_token)
+    assert [m.id for m in first.items + rest.items] == [m.id for m in mags]
+    assert rest.next_token is None
+    assert len(Magazine.find_page_by_category("Paging", page_size=5).items) == 5
+    with pytest.raises(ValueError):
+        Magazine.find_page_by_category("Other", after=first.next_token)
+
+
+### Summary Table Tests ###
+
+def test_summary_tables_follow_article_changes():
+    from lib.db.aggregates import check_aggregates
+    from lib.db.connection import connection
+    first, second = Author(name="Stat A"), Author(name="Stat B")
+    Author.bulk_create([first, second])
+    mag = Magazine(name="Stat Mag", category="Stats")
+    mag.save()
+    article = Article("Stat 1", "", first.id, mag.id)
+    article.save()
+    assert mag.id not in [m.id for m in Magazine.with_multiple_authors()]
+    Article("Stat 2", "", second.id, mag.id).save()
+    assert mag.id in [m.id for m in Magazine.with_multiple_authors()]
+    counts = {c['name']: c['article_count'] for c in Magazine.article_counts()}
+    assert counts["Stat Mag"] == 2
+    article.author_id = second.id
+    article.save()
+    assert mag.id not in [m.id for m in Magazine.with_multiple_authors()]
+    with connection() as conn:
+        conn.execute("DELETE FROM articles WHERE magazine_id = ?", (mag.id,))
+        conn.commit()
+        assert check_aggregates(conn) == {}
+    counts = {c['name']: c['article_count'] for c in Magazine.article_counts()}
+    assert counts["Stat Mag"] == 0
+
+
+### Asyncio Tests ###
+
+def test_async_model_methods_run_concurrently():
+    import asyncio
+    from lib.db.aio import shutdown_executor
+
+    async def main():
+        alice = await Author.afind_by_name("Alice")
+        results = await asyncio.gather(*[alice.aarticles() for _ in range(20)], Author.atop_author())
+        mag = await Magazine.afind_by_name("Tech Times")
+        names = {a.name for a in await mag.acontributing_authors()}
+        return results, names
+
+    results, names = asyncio.run(main())
+    shutdown_executor()
+    assert all(len(r) == len(results[0]) for r in results[:-1])
+    assert results[-1].id == Author.top_author().id
+    assert {"Alice", "Bob"} <= names
+
+def test_async_cancellation_interrupts_query():
+    import asyncio
+    from lib.db.aio import DatabaseExecutor
+
+    def slow_query():
+        from lib.db.connection import connection
+        with connection() as conn:
+            return conn.execute("""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+                SELECT COUNT(*) FROM n
+            """).fetchone()
+
+    executor = DatabaseExecutor(max_workers=1)
+
+    async def main():
+        task = asyncio.ensure_future(executor.run(slow_query))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The worker is free again once the interrupted query unwinds
+        return await executor.run(lambda: 42)
+
+    assert asyncio.run(main()) == 42
+    executor.shutdown()
+
+
+def test_async_failed_save_releases_the_write_lock():
+    import asyncio
+    from lib.db.aio import DatabaseExecutor
+    from lib.db.connection import DATABASE_NAME
+    Author("Async Taken Name").save()
+    executor = DatabaseExecutor(max_workers=1)
+    duplicate = Author("Async Taken Name")
+    asyncio.run(executor.run(duplicate.save))
+    assert duplicate.id is None
+    # The worker's connection must not still hold the failed INSERT's transaction
+    other = sqlite3.connect(DATABASE_NAME, timeout=0.1)
+    try:
+        other.execute("BEGIN IMMEDIATE")
+        other.rollback()
+    finally:
+        other.close()
+    assert asyncio.run(executor.run(lambda: 42)) == 42
+    executor.shutdown()
+
+def test_async_jobs_fail_when_workers_cannot_connect(tmp_path):
+    import asyncio
+    from lib.db.aio import DatabaseExecutor
+    # A directory can't be opened as a database, so the worker never gets a connection
+    executor = DatabaseExecutor(max_workers=1, database=str(tmp_path))
+
+    async def main():
+        jobs = [executor.run(lambda: 42) for _ in range(3)]
+        return await asyncio.wait_for(asyncio.gather(*jobs, return_exceptions=True), 5)
+
+    assert all(isinstance(result, sqlite3.OperationalError) for result in asyncio.run(main()))
+    with pytest.raises(sqlite3.OperationalError):
+        executor.submit(lambda: 42).result(timeout=5)
+    executor.shutdown()
+
+### Instrumentation Tests ###
+
+def test_queries_are_instrumented():
+    from lib.db.instrument import configure_instrumentation, query_stats, reset_query_stats, slow_queries
+    from lib.models.identity_map import identity_map_disabled
+    reset_query_stats()
+    configure_instrumentation(slow_query_ms=0)
+    try:
+        with identity_map_disabled():
+            author = Author.find_by_name("Alice")
+            Article.find_by_author_id(author.id)
+    finally:
+        configure_instrumentation(slow_query_ms=100.0)
+    stats = query_stats()
+    assert stats["Author.find_by_name"]["count"] == 1
+    assert stats["Article.find_by_author_id"]["rows"] >= 2
+    assert stats["pool.acquire"]["count"] >= 2
+    assert sum(stats["Article.find_by_author_id"]["histogram"].values()) == 1
+    slow = {entry['name']: entry for entry in slow_queries()}
+    assert slow["Article.find_by_author_id"]["plan"]
+
+
+### Benchmark Tests ###
+
+def test_benchmark_dataset_is_deterministic_and_suite_runs(tmp_path):
+    from benchmarks.datagen import DatasetSpec, generate
+    from benchmarks.suite import run
+    from lib.db import connection as db
+
+    def dump(path):
+        conn = sqlite3.connect(path)
+        rows = conn.execute("SELECT * FROM articles ORDER BY id").fetchall()
+        conn.close()
+        return rows
+
+    spec = DatasetSpec(300, seed=7)
+    generate(str(tmp_path / "a.db"), spec)
+    generate(str(tmp_path / "b.db"), spec)
+    rows = dump(tmp_path / "a.db")
+    assert len(rows) == 300 and rows == dump(tmp_path / "b.db")
+    per_author = {}
+    for row in rows:
+        per_author[row[3]] = per_author.get(row[3], 0) + 1
+    assert max(per_author.values()) > 300 / spec.authors * 3  # skewed, not uniform
+
+    previous = db.DATABASE_NAME
+    results = run(str(tmp_path / "a.db"), repeat=3)
+    assert db.DATABASE_NAME == previous
+    assert {"Author.top_author", "Magazine.article_counts", "Article.search"} <= set(results['results'])
+    assert all(result['calls'] == 3 for result in results['results'].values())
+
+
+def test_ensure_dataset_only_replaces_generated_datasets(tmp_path):
+    from benchmarks.datagen import DatasetSpec, ensure_dataset, read_spec
+    from lib.db.migrations import migrate
+    real = str(tmp_path / "real.db")
+    migrate(real)
+    conn = sqlite3.connect(real)
+    conn.execute("INSERT INTO authors (name) VALUES ('Keep Me')")
+    conn.commit()
+    conn.close()
+    with pytest.raises(FileExistsError, match="not a generated benchmark dataset"):
+        ensure_dataset(real, DatasetSpec(50))
+    conn = sqlite3.connect(real)
+    assert conn.execute("SELECT name FROM authors").fetchall() == [("Keep Me",)]
+    conn.close()
+
+    bench = str(tmp_path / "bench.db")
+    assert ensure_dataset(bench, DatasetSpec(50)) is not None
+    assert ensure_dataset(bench, DatasetSpec(50)) is None
+    assert ensure_dataset(bench, DatasetSpec(60)) is not None
+    assert read_spec(bench).articles == 60
+
+
+### WAL / Connection Role Tests ###
+
+def test_wal_readers_run_alongside_writer(tmp_path):
+    from lib.db.connection import ConnectionPool, ConnectionProfile
+    from lib.db.migrations import migrate
+    database = str(tmp_path / "wal.db")
+    migrate(database)
+    profile = ConnectionProfile(busy_timeout=0.2)
+    writers = ConnectionPool(database, size=1, profile=profile)
+    readers = ConnectionPool(database, size=2, profile=profile, read_only=True)
+    with writers.connection() as writer, readers.connection() as reader:
+        assert writer.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert reader.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("INSERT INTO authors (name) VALUES ('nope')")
+        reader.rollback()
+        # A long-running read transaction does not block the writer's commit...
+        reader.execute("BEGIN")
+        assert reader.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 0
+        with writer:
+            writer.execute("INSERT INTO authors (name) VALUES ('Wendy')")
+        # ...and keeps its snapshot until it ends
+        assert reader.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 0
+        reader.execute("COMMIT")
+        assert reader.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 1
+    writers.close()
+    readers.close()
+
+
+### Session Tests ###
+
+def test_session_flushes_in_dependency_order_with_one_commit():
+    from lib.db.connection import connection
+    from lib.models.identity_map import identity_map_scope
+    from lib.models.session import Session
+    statements = []
+    with identity_map_scope():
+        with Session() as session:
+            conn = session.connection
+            conn.set_trace_callback(statements.append)
+            author = Author("Session Author")
+            magazine = Magazine("Session Monthly", "Technology")
+            articles = [author.add_article(magazine, f"Session piece {i}", "body") for i in range(5)]
+            assert author.id is None and set(session.new) >= {author, magazine, *articles}
+            session.flush()
+            assert author.id and magazine.id
+            assert {a.author_id for a in articles} == {author.id}
+            assert [a.title for a in Article.find_by_author_id(author.id)] == [a.title for a in articles]
+            author.name = "Session Author Renamed"
+            assert session.dirty == [author]
+        conn.set_trace_callback(None)
+        assert sum(sql.startswith("COMMIT") for sql in statements) == 1
+        with connection() as conn:
+            assert conn.execute("SELECT name FROM authors WHERE id = ?", (author.id,)).fetchone()[0] == "Session Author Renamed"
+            assert conn.execute("SELECT COUNT(*) FROM articles WHERE magazine_id = ?", (magazine.id,)).fetchone()[0] == 5
+        # The commit refreshed the enclosing map
+        assert Author.find_by_name("Session Author Renamed") is author
+
+def test_session_savepoint_and_rollback():
+    from lib.db.connection import connection
+    from lib.models.session import Session
+    with Session() as session:
+        kept = Author("Kept Author")
+        kept.save()
+        with pytest.raises(RuntimeError):
+            with session.savepoint():
+                dropped = Author("Dropped Author")
+                dropped.save()
+                session.flush()
+                assert dropped.id is not None
+                raise RuntimeError("undo the savepoint")
+        assert dropped.id is None and dropped not in session
+    with pytest.raises(ValueError):
+        with Session():
+            lost = Author("Lost Author")
+            lost.save()
+            raise ValueError("roll back the whole session")
+    assert lost.id is None
+    with connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM authors")}
+    assert "Kept Author" in names and not {"Dropped Author", "Lost Author"} & names
+
+def test_session_failed_commit_resets_ids():
+    from lib.models.session import Session
+    Author("Taken Session Name").save()
+    with pytest.raises(sqlite3.IntegrityError):
+        with Session():
+            fresh = Author("Fresh Session Author")
+            fresh.save()
+            Author("Taken Session Name").save()
+    assert fresh.id is None
+    fresh.save()
+    assert fresh.id is not None and Author.find_by_name("Fresh Session Author").id == fresh.id
+
+def test_bulk_writes_inside_a_session_roll_back_with_it():
+    from lib.db.connection import connection
+    from lib.models.session import Session
+    existing = Author("Bulk Session Existing")
+    existing.save()
+    with pytest.raises(RuntimeError):
+        with Session() as session:
+            flushed = Author("Bulk Session Flushed")
+            flushed.save()
+            session.flush()
+            bulk = [Author(f"Bulk Session {i}") for i in range(5)]
+            Author.bulk_create(bulk, chunk_size=2)
+            upserted = [Author("Bulk Session Existing"), Author("Bulk Session Upserted")]
+            Author.bulk_upsert(upserted)
+            assert all(a.id is not None for a in bulk + upserted) and upserted[0].id == existing.id
+            raise RuntimeError("roll back the whole session")
+    with connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM authors WHERE name LIKE 'Bulk Session%'")}
+    assert names == {"Bulk Session Existing"}
+    assert flushed.id is None and all(a.id is None for a in bulk + upserted)
+    # Outside a session every chunk still commits on its own
+    Author.bulk_create(bulk)
+    with connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM authors WHERE name LIKE 'Bulk Session _'").fetchone()[0] == 5
+
+
+### Ingest / Export Tests ###
+
+def test_ingest_csv_and_export_jsonl_round_trip(tmp_path):
+    import csv
+    import json
+    from lib.models.ingest import export_file, ingest_file
+    feed = tmp_path / "feed.csv"
+    with open(feed, "w", newline="") as f:
+        writer = csv.DictWriter(f, ["title", "content", "author", "magazine", "category"])
+        writer.writeheader()
+        for i in range(25):
+            writer.writerow({"title": f"Feed story {i}", "content": "text", "author": f"Feed Writer {i % 3}",
+                             "magazine": "Feed Gazette", "category": "News"})
+        writer.writerow({"title": "", "author": "Nobody", "magazine": "Feed Gazette"})
+        writer.writerow({"title": "Bob files one", "content": "x", "author": "Bob", "magazine": "Tech Times"})
+    seen = []
+    stats = ingest_file(str(feed), chunk_size=7, progress=lambda s: seen.append(s.rows))
+    assert stats.rows == 26 and stats.skipped == 1 and seen[-1] == 26
+    assert stats.authors_created == 3 and stats.magazines_created == 1  # Bob and Tech Times already exist
+    assert len(Author.find_by_name("Feed Writer 1").articles()) == 8
+    assert "Bob files one" in [a.title for a in Author.find_by_name("Bob").articles()]
+
+    out = tmp_path / "articles.jsonl"
+    exported = export_file(str(out), batch_size=10)
+    with open(out) as f:
+        records = [json.loads(line) for line in f]
+    assert exported.rows == len(records) and exported.chunks >= 3
+    story = next(r for r in records if r["title"] == "Feed story 4")
+    assert story["author"] == "Feed Writer 1" and story["magazine"] == "Feed Gazette" and story["category"] == "News"
+
+
+### Compression Tests ###
+
+def test_article_content_compression_is_transparent_and_lazy():
+    from lib.db.compression import configure_compression, content_stats, convert
+    from lib.db.connection import connection
+    from lib.models.identity_map import identity_map_disabled
+    body = "Compressed quokka paragraph. " * 40
+    configure_compression("zlib", threshold=256)
+    try:
+        long_article = Article("Squeezed", body, 1, 1)
+        short_article = Article("Not squeezed", "tiny quokka", 1, 1)
+        long_article.save()
+        short_article.save()
+    finally:
+        configure_compression(None)
+    with connection() as conn:
+        kinds = dict(conn.execute(
+            "SELECT id, typeof(content) FROM articles WHERE id IN (?, ?)", (long_article.id, short_article.id)))
+    assert kinds == {long_article.id: "blob", short_article.id: "text"}
+
+    with identity_map_disabled():
+        loaded = Article.find_by_id(long_article.id)
+    assert isinstance(loaded._content, bytes) and loaded._text is None
+    assert loaded.content == body and loaded._text == body
+    hits = Article.search("quokka paragraph")
+    assert [hit['article'].id for hit in hits] == [long_article.id]
+    assert "[quokka]" in hits[0]['snippet']
+
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        assert convert(conn, None) >= 1
+        conn.commit()
+        assert content_stats(conn)['compressed_rows'] == 0
+    assert Article.search("quokka paragraph")[0]['article'].id == long_article.id
+
+
+
+def test_compressed_search_index_needs_no_functions_in_the_schema(tmp_path):
+    from lib.db.compression import configure_compression, register_functions
+    from lib.db import connection as db
+    from lib.models.identity_map import identity_map_disabled
+    from lib.db.migrations import migrate
+    database = str(tmp_path / "foreign.db")
+    migrate(database)
+    # A client without article_text() can write articles
+    plain = sqlite3.connect(database)
+    plain.execute("INSERT INTO authors (name) VALUES ('Plain')")
+    plain.execute("INSERT INTO magazines (name, category) VALUES ('Plain Mag', 'Misc')")
+    plain.execute("INSERT INTO articles (title, content, author_id, magazine_id) VALUES ('Foreign', 'wombat text', 1, 1)")
+    plain.commit()
+    assert not plain.execute("SELECT name FROM sqlite_master WHERE sql LIKE '%article_text(%' "
+                             "AND type = 'trigger'").fetchall()
+    previous = db.DATABASE_NAME
+    db.use_database(database)
+    configure_compression("zlib", threshold=64)
+    try:
+        with identity_map_disabled():
+            article = Article("Squeezed", "Compressed wombat paragraph. " * 10, 1, 1)
+            article.save()
+            article.content = "Compressed numbat paragraph. " * 10
+            article.save()
+            assert [hit['article'].id for hit in Article.search("numbat")] == [article.id]
+            assert Article.search("wombat paragraph") == []
+    finally:
+        configure_compression(None)
+        db.use_database(previous)
+    plain.execute("UPDATE articles SET title = 'Foreign, edited' WHERE title = 'Foreign'")
+    plain.execute("DELETE FROM articles WHERE id = 1")
+    plain.commit()
+    plain.close()
+    conn = register_functions(sqlite3.connect(database))
+    # FTS5 compares the index with the articles_text view
+    conn.execute("INSERT INTO articles_fts (articles_fts, rank) VALUES ('integrity-check', 1)")
+    conn.execute("DELETE FROM articles WHERE id = ?", (article.id,))
+    conn.execute("INSERT INTO articles_fts (articles_fts, rank) VALUES ('integrity-check', 1)")
+    assert conn.execute("SELECT COUNT(*) FROM articles_fts WHERE articles_fts MATCH 'numbat'").fetchone()[0] == 0
+    conn.close()
+
+### Deferred Column Tests ###
+
+def test_deferred_columns_load_once_per_result_set():
+    from lib.db.instrument import query_stats, reset_query_stats
+    mag = Magazine.find_by_name("Tech Times")
+    full = {a.id: a for a in Article.find_by_magazine_id(mag.id)}
+    reset_query_stats()
+    listing = Article.find_by_magazine_id(mag.id, only=("id", "title"))
+    assert [a.title for a in listing] == [full[a.id].title for a in listing]
+    assert "Article.load_deferred" not in query_stats()
+    assert [a.content for a in listing] == [full[a.id].content for a in listing]
+    assert [a.author_id for a in listing] == [full[a.id].author_id for a in listing]
+    # One query per deferred field for the whole list, not one per article
+    assert query_stats()["Article.load_deferred"]["count"] == 2
+    page = Article.find_page_by_magazine_id(mag.id, page_size=1, defer=("content",))
+    assert page.items[0].title == full[page.items[0].id].title
+    with pytest.raises(AttributeError):
+        listing[0].nonexistent
+    with pytest.raises(ValueError):
+        Article.find_by_author_id(1, only=("title", "nope"))
+
+
+def test_saving_a_deferred_article_loads_what_it_writes():
+    from lib.db.connection import connection
+    mag = Magazine.find_by_name("Tech Times")
+    article = Article.find_by_magazine_id(mag.id, only=("id", "title"))[0]
+    query = "SELECT title, content, author_id, magazine_id FROM articles WHERE id = ?"
+    with connection() as conn:
+        before = tuple(conn.execute(query, (article.id,)).fetchone())
+    article.title = "Renamed While Deferred"
+    article.save()
+    try:
+        with connection() as conn:
+            assert tuple(conn.execute(query, (article.id,)).fetchone()) == ("Renamed While Deferred",) + before[1:]
+    finally:
+        article.title = before[0]
+        article.save()
+
+
+### Sharding Tests ###
+
+def test_sharded_articles_route_and_scatter_gather(tmp_path):
+    from benchmarks.datagen import DatasetSpec, generate
+    from lib.db import connection as db
+    from lib.db.instrument import query_stats
+    from lib.db.sharding import configure_sharding, shard_stats, split
+    from lib.models.identity_map import identity_map_disabled
+
+    catalog = str(tmp_path / "catalog.db")
+    generate(catalog, DatasetSpec(400, seed=3))
+    shards = [str(tmp_path / f"shard{i}.db") for i in range(3)]
+    previous = db.DATABASE_NAME
+    db.DATABASE_NAME = catalog
+
+    def snapshot():
+        author = Author.find_by_id(1)
+        return {
+            'articles': sorted((a.id, a.title) for a in author.articles()),
+            'magazines': sorted(m.id for m in author.magazines()),
+            'top': Author.top_author().id,
+            'counts': sorted((c['name'], c['article_count']) for c in Magazine.article_counts()),
+            'multi': [m.id for m in Magazine.with_multiple_authors()],
+            'contributors': sorted(a.id for a in Magazine.find_by_id(2).contributing_authors()),
+            'magazine': sorted(a.id for a in Article.find_by_magazine_id(4)),
+        }
+
+    try:
+        with identity_map_disabled():
+            expected = snapshot()
+            moved = split(catalog, shards)
+            assert sum(moved) == 400 and all(moved)
+            configure_sharding(shards, workers=2)
+            assert snapshot() == expected
+            assert query_stats()["Author.top_author"]["count"] >= 1
+            article = Author.find_by_id(1).add_article(Magazine.find_by_id(5), "Sharded hello", "body")
+            assert article.id > 400
+            assert Article.find_by_id(article.id).title == "Sharded hello"
+            assert [s['articles'] for s in shard_stats(shards)] == [
+                moved[0], moved[1], moved[2] + 1
+            ]
+            # Moving it to another magazine moves it to that magazine's shard
+            article.magazine_id = 6
+            article.save()
+            assert [s['articles'] for s in shard_stats(shards)] == [moved[0] + 1, moved[1], moved[2]]
+            assert Article.find_by_id(article.id).magazine_id == 6
+            assert Article.find_by_title("Sharded hello").id == article.id
+            # A title on several shards resolves to its lowest id
+            first = Author.find_by_id(1).add_article(Magazine.find_by_id(4), "Twin title", "body")
+            Author.find_by_id(1).add_article(Magazine.find_by_id(3), "Twin title", "body")
+            assert Article.find_by_title("Twin title").id == first.id
+
+            def directory_size():
+                conn = get_connection()
+                n = conn.execute("SELECT COUNT(*) FROM article_shards").fetchone()[0]
+                conn.close()
+                return n
+
+            # A failed shard write leaves no directory entry behind
+            failing = sqlite3.connect(shards[2])
+            failing.execute("CREATE TRIGGER refuse BEFORE INSERT ON articles WHEN NEW.title = 'Doomed' "
+                            "BEGIN SELECT RAISE(ABORT, 'refused'); END")
+            failing.commit()
+            failing.close()
+            entries = directory_size()
+            doomed = Article("Doomed", "body", 1, 5)
+            doomed.save()
+            assert doomed.id is None and directory_size() == entries
+            page = Article.find_page_by_author_id(1, page_size=5)
+            assert [a.id for a in page.items] == [id for id, _ in expected['articles']][:5]
+            with pytest.raises(RuntimeError):
+                Article.search("anything")
+    finally:
+        configure_sharding(None)
+        db.DATABASE_NAME = previous
+
+
+### Upsert Tests ###
+
+def test_get_or_create_and_bulk_upsert_resolve_names_once():
+    from concurrent.futures import ThreadPoolExecutor
+    from lib.models.identity_map import identity_map_disabled
+
+    def count(table, name):
+        conn = get_connection()
+        n = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+        conn.close()
+        return n
+
+    with identity_map_disabled():
+        assert Author.get_or_create("Alice").id == Author.find_by_name("Alice").id
+        # Racing callers all resolve to the one row
+        with ThreadPoolExecutor(8) as pool:
+            ids = set(pool.map(lambda _: Author.get_or_create("Racer").id, range(16)))
+        assert len(ids) == 1 and count("authors", "Racer") == 1
+        tech = Magazine.get_or_create("Tech Times", "Ignored")
+        assert tech.category == "Technology"
+        # Existing rows are only read: nothing is committed to the file
+        watcher = get_connection()
+        version = watcher.execute("PRAGMA data_version").fetchone()[0]
+        Author.get_or_create("Alice")
+        Magazine.get_or_create("Tech Times", "Ignored")
+        assert watcher.execute("PRAGMA data_version").fetchone()[0] == version
+        watcher.close()
+
+        authors = [Author("Alice"), Author("Upsert New"), Author("Upsert New")]
+        Author.bulk_upsert(authors)
+        assert authors[0].id == Author.find_by_name("Alice").id
+        assert authors[1].id == authors[2].id and count("authors", "Upsert New") == 1
+        Magazine.bulk_upsert([Magazine("Tech Times", "Renamed")])
+        assert Magazine.find_by_name("Tech Times").category == "Technology"
+        Magazine.bulk_upsert([Magazine("Tech Times", "Renamed")], update_category=True)
+        assert Magazine.find_by_name("Tech Times").category == "Renamed"
+        Magazine.bulk_upsert([Magazine("Tech Times", "Technology")], update_category=True)
+
+
+def test_legacy_database_with_duplicate_names_fails_loudly(tmp_path):
+    from lib.db import connection as db
+    from lib.db.migrations import MigrationRequiredError, current_version, main
+    legacy = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(legacy)
+    with open(os.path.join("lib", "db", "schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.executescript("""
+        INSERT INTO authors (id, name) VALUES (1, 'Ann'), (2, 'Ann'), (3, 'Ben');
+        INSERT INTO magazines (id, name, category) VALUES (1, 'Mag', 'A');
+        INSERT INTO articles (title, content, author_id, magazine_id) VALUES ('x', 'body', 1, 1);
+    """)
+    conn.close()
+    previous = db.DATABASE_NAME
+    db.use_database(legacy)
+    try:
+        # Not an sqlite3.Error, so the finders can't swallow it and return nothing
+        with pytest.raises(MigrationRequiredError, match="--merge-duplicates"):
+            Author.find_by_id(3)
+        with pytest.raises(MigrationRequiredError):
+            Article.find_by_author_id(1)
+        assert main([legacy, "--merge-duplicates"]) == 0
+        assert Author.find_by_id(3).name == "Ben"
+        assert [a.title for a in Article.find_by_author_id(1)] == ["x"]
+    finally:
+        db.use_database(previous)
+    conn = sqlite3.connect(legacy)
+    assert current_version(conn) > 7
+    conn.close()
+
+
+def test_unique_names_migration_reports_duplicates_and_merges_on_request(tmp_path):
+    from lib.db.compression import register_functions
+    from lib.db.migrations import DuplicateNamesError, LATEST_VERSION, current_version, main, migrate
+    db = str(tmp_path / "dupes.db")
+    migrate(db, target=6)
+    conn = register_functions(sqlite3.connect(db))
+    conn.executescript("""
+        INSERT INTO authors (id, name) VALUES (1, 'Ann'), (2, 'Ann'), (3, 'Ben');
+        INSERT INTO magazines (id, name, category) VALUES (1, 'Mag', 'A'), (2, 'Mag', 'B');
+        INSERT INTO articles (title, content, author_id, magazine_id) VALUES ('x', '', 2, 2), ('y', '', 3, 1);
+    """)
+    conn.close()
+    # Automatic migration must not pick winners: it stops and leaves every row alone
+    with pytest.raises(DuplicateNamesError, match="'Ann' \\(ids 1, 2\\)"):
+        migrate(db)
+    conn = sqlite3.connect(db)
+    assert current_version(conn) == 6
+    assert conn.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 3
+    assert conn.execute("SELECT category FROM magazines ORDER BY id").fetchall() == [('A',), ('B',)]
+    conn.close()
+
+    assert main([db, "--merge-duplicates"]) == 0
+    conn = sqlite3.connect(db)
+    assert current_version(conn) == LATEST_VERSION
+    assert conn.execute("SELECT id, name FROM authors ORDER BY id").fetchall() == [(1, 'Ann'), (3, 'Ben')]
+    assert conn.execute("SELECT author_id, magazine_id FROM articles ORDER BY title").fetchall() == [(1, 1), (3, 1)]
+    assert conn.execute("SELECT author_id, article_count FROM author_stats ORDER BY author_id").fetchall() == [(1, 1), (3, 1)]
+    assert conn.execute("SELECT article_count, author_count FROM magazine_stats").fetchall() == [(2, 2)]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO magazines (name, category) VALUES ('Mag', 'C')")
+    conn.close()
+
+
+### Result Cache Tests ###
+
+def test_result_cache_serves_until_any_process_writes():
+    import asyncio
+    import subprocess
+    import sys
+    from lib.db.connection import DATABASE_NAME, connection
+    from lib.db.instrument import query_stats, reset_query_stats
+    from lib.models.result_cache import configure_result_cache, result_cache_stats
+    from lib.models.session import Session
+
+    def tech_count():
+        return {c['name']: c['article_count'] for c in Magazine.article_counts()}["Tech Times"]
+
+    configure_result_cache(maxsize=2, ttl=60)
+    try:
+        reset_query_stats()
+        before = tech_count()
+        assert tech_count() == before
+        assert query_stats()["Magazine.article_counts"]["count"] == 1
+        assert result_cache_stats()['hits'] == 1
+        # A commit on another connection invalidates the entry...
+        tech = Magazine.find_by_name("Tech Times")
+        insert_values("articles", {"title": "Cache Buster", "author_id": 2, "magazine_id": tech.id})
+        assert tech_count() == before + 1
+        # ...and so does one from another process
+        subprocess.run([sys.executable, "-c", (
+            "import sqlite3; from lib.db.compression import register_functions; "
+            "conn = register_functions(sqlite3.connect(%r)); "
+            "conn.execute(\"DELETE FROM articles WHERE title = 'Cache Buster'\"); conn.commit()"
+        ) % DATABASE_NAME], check=True)
+        assert tech_count() == before
+        assert result_cache_stats()['stale'] == 2
+        # Reads that may see uncommitted writes bypass the cache...
+        with Session() as session:
+            session.add(tech)
+            session.flush()
+            tech_count()
+        assert result_cache_stats()['bypassed'] == 1
+        with connection() as conn:
+            conn.execute("UPDATE magazines SET category = category WHERE id = ?", (tech.id,))
+            tech_count()
+            conn.rollback()
+        assert result_cache_stats()['bypassed'] == 2
+        # ...but a Session or async worker that hasn't written reads through it
+        tech_count()
+        hits = result_cache_stats()['hits']
+        with Session():
+            tech_count()
+        asyncio.run(Magazine.aarticle_counts())
+        asyncio.run(Magazine.aarticle_counts())
+        assert result_cache_stats()['hits'] == hits + 3 and result_cache_stats()['bypassed'] == 2
+        # Bounded LRU keyed on the instance's id
+        for magazine in Magazine.find_by_category("Technology") + Magazine.find_by_category("Health"):
+            magazine.contributing_authors()
+        assert result_cache_stats()['evictions'] >= 1
+        configure_result_cache(ttl=0)
+        tech_count()
+        tech_count()
+        assert result_cache_stats()['expired'] == 1 and result_cache_stats()['hits'] == 0
+    finally:
+        configure_result_cache()
+
+
+def test_result_cache_hands_out_fresh_instances():
+    from lib.db.connection import connection
+    from lib.models.result_cache import configure_result_cache, result_cache_stats
+    # Open the pools first: their first open may switch the file to WAL, which counts as a write
+    with connection():
+        Author.top_author()
+    configure_result_cache(maxsize=16, ttl=60)
+    try:
+        top = Author.top_author()
+        name = top.name
+        top.name = "MUTATED"
+        alice = Author.find_by_name("Alice")
+        alice.magazines()[0].name = "MUTATED"
+        tech = Magazine.find_by_name("Tech Times")
+        tech.contributing_authors()[0].name = "MUTATED"
+        Magazine.with_multiple_authors()[0].category = "MUTATED"
+        Magazine.article_counts()[0]['article_count'] = -1
+        hits = result_cache_stats()['hits']
+        assert Author.top_author().name == name and Author.top_author() is not top
+        assert "MUTATED" not in [m.name for m in alice.magazines()]
+        assert "MUTATED" not in [a.name for a in tech.contributing_authors()]
+        assert "MUTATED" not in [m.category for m in Magazine.with_multiple_authors()]
+        assert -1 not in [c['article_count'] for c in Magazine.article_counts()]
+        assert result_cache_stats()['hits'] == hits + 6
+    finally:
+        configure_result_cache()
+
+### Batch Lookup Tests ###
+
+def test_find_by_ids_and_names_batch_in_input_order():
+    from lib.db.instrument import query_stats, reset_query_stats
+    from lib.models.identity_map import identity_map_disabled, identity_map_scope
+    authors = [Author(f"Batch {i}") for i in range(1200)]
+    Author.bulk_create(authors)
+    ids = [a.id for a in reversed(authors)] + [-1]
+    with identity_map_disabled():
+        reset_query_stats()
+        found = Author.find_by_ids(ids)
+        assert list(found) == ids and found[-1] is None
+        assert [found[a.id].name for a in authors[:3]] == ["Batch 0", "Batch 1", "Batch 2"]
+        assert query_stats()["Author.load_by_ids"]["count"] == 3  # 1200 ids in chunks of 500
+        names = Author.find_by_names(["Batch 7", "Nobody", "Alice"])
+        assert list(names) == ["Batch 7", "Nobody", "Alice"]
+        assert names["Batch 7"].id == authors[7].id and names["Nobody"] is None
+        assert query_stats()["Author.find_by_names"]["count"] == 1
+    with identity_map_scope():
+        tech = Magazine.find_by_name("Tech Times")
+        assert Magazine.find_by_ids([tech.id, 0]) == {tech.id: tech, 0: None}
+        assert Magazine.find_by_names(["Tech Times"])["Tech Times"] is tech
+
+
+### Write Queue Tests ###
+
+def test_write_queue_group_commits_concurrent_saves():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from lib.models.identity_map import identity_map_scope
+    from lib.models.write_queue import WriteQueue, get_write_queue, start_write_queue, stop_write_queue
+
+    queue = start_write_queue(max_batch=50, max_delay=0.02)
+    try:
+        def save_many(thread):
+            authors = [Author(f"Queued {thread}-{i}") for i in range(25)]
+            for author in authors:
+                author.save()
+            return authors
+
+        with ThreadPoolExecutor(8) as pool:
+            authors = [a for batch in pool.map(save_many, range(8)) for a in batch]
+        assert all(a.id is not None for a in authors) and len({a.id for a in authors}) == 200
+        stats = queue.stats()
+        assert stats['committed'] == 200 and stats['batches'] < 200
+        # add_article through the queue; a failing item fails only its own future
+        author, mag = authors[0], Magazine.find_by_name("Tech Times")
+        article = author.add_article(mag, "Queued article", "text")
+        assert Article.find_by_id(article.id).title == "Queued article"
+        futures = [queue.submit(Author("Queued ok")), queue.submit(Author("Alice"))]
+        assert futures[0].result() is not None
+        with pytest.raises(sqlite3.IntegrityError):
+            futures[1].result()
+    finally:
+        stop_write_queue()
+    assert get_write_queue() is None
+
+    # Backpressure: with the writer stuck on a slow write, the queue fills up
+    class SlowWrite:
+        id = None
+        LOOKUP_FIELDS = ()
+        taken = threading.Event()
+        release = threading.Event()
+
+        def _write(self, conn):
+            self.taken.set()
+            assert self.release.wait(5)
+
+    with WriteQueue(maxsize=1, put_timeout=0.05) as queue:
+        first = queue.submit(SlowWrite())
+        assert SlowWrite.taken.wait(5)  # the writer has taken it off the queue
+        second = queue.submit(Author("Blocked 2"))
+        with pytest.raises(sqlite3.OperationalError):
+            queue.submit(Author("Blocked 3"))
+        SlowWrite.release.set()
+        first.result()
+        assert second.result() is not None
+    assert queue.stats()['full'] == 1
+
+    # A save through the queue keeps the caller's own identity map consistent
+    queue = start_write_queue()
+    try:
+        with identity_map_scope():
+            renamed = Author("Queued Old Name")
+            renamed.save()
+            assert Author.find_by_name("Queued Old Name") is renamed
+            renamed.name = "Queued New Name"
+            renamed.save()
+            assert Author.find_by_name("Queued Old Name") is None
+            assert Author.find_by_name("Queued New Name") is renamed
+    finally:
+        stop_write_queue()
+
+
+### Query Plan Audit Tests ###
+
+def test_query_plan_audit_flags_hot_path_full_scans(tmp_path):
+    from lib.db import connection as db
+    from lib.db.migrations import LATEST_VERSION, migrate
+    from lib.models.audit import audit, collect_statements, main
+    previous = db.DATABASE_NAME
+    statements = collect_statements()
+    assert db.DATABASE_NAME == previous
+    names = {name for name, sql, params in statements}
+    assert {"Author.find_by_name", "Article.find_by_author_id", "Article.iter_by_magazine_id",
+            "Magazine.article_counts", "authors.bulk_upsert"} <= names
+
+    target = str(tmp_path / "audit.db")
+    migrate(target)
+    report = audit(target, statements, schema_only=True)
+    assert report['failures'] == 0
+    assert report['schema_only'] and report['schema_version'] == LATEST_VERSION
+    by_name = {entry['name']: entry for entry in report['statements']}
+    assert by_name["Author.find_by_name"]['covering_indexes'] == ["idx_authors_name_unique"]
+    assert by_name["Author.magazines"]['temp_btrees'] == ["DISTINCT"]
+
+    conn = sqlite3.connect(target)
+    conn.execute("DROP INDEX idx_articles_author_id")
+    conn.execute("DROP INDEX idx_articles_author_magazine")
+    conn.close()
+    report = audit(target, statements, schema_only=True)
+    failed = {entry['name'] for entry in report['statements'] if entry['status'] == "FAIL"}
+    assert "Article.find_by_author_id" in failed
+    assert main([target, "--schema-only"]) == 1
+
+
+### Database Target Tests ###
+
+def test_memory_and_template_targets_are_isolated(tmp_path):
+    import threading
+    from contextlib import closing
+    from lib.db import connection as db
+    from lib.db.migrations import migrate
+    from lib.models.identity_map import identity_map_scope
+    template = str(tmp_path / "template.db")
+    migrate(template)
+    conn = sqlite3.connect(template)
+    conn.execute("INSERT INTO authors (name) VALUES ('Template Author')")
+    conn.commit()
+    conn.close()
+
+    previous = db.DATABASE_NAME
+    try:
+        memory = db.use_database(db.MEMORY)
+        assert memory.startswith("file:") and db.DATABASE_NAME == memory
+        with identity_map_scope():
+            Author("Memory Author").save()
+            assert Author.find_by_name("Memory Author") is not None
+            assert Author.find_by_name("Template Author") is None
+        # A read overlapping a write waits for it (busy_timeout) rather than failing at once
+        writer = db.connect(memory, isolation_level=None, check_same_thread=False)
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO authors (name) VALUES ('Committed Later')")
+        committer = threading.Timer(0.2, writer.execute, ("COMMIT",))
+        committer.start()
+        with closing(db.connect(memory, timeout=5.0)) as reader:
+            assert reader.execute("SELECT COUNT(*) FROM authors WHERE name = 'Committed Later'").fetchone()[0] == 1
+        committer.join()
+        writer.close()
+
+        first = db.use_database(template=template)
+        assert first != memory and memory not in db._memory_databases
+        with identity_map_scope():
+            Author("Only In First").save()
+            assert Author.find_by_name("Template Author") is not None
+            assert Author.find_by_name("Memory Author") is None
+
+        db.use_database(str(tmp_path / "worker.db"), template=template)
+        assert first not in db._memory_databases
+        with identity_map_scope():
+            assert Author.find_by_name("Template Author") is not None
+            assert Author.find_by_name("Only In First") is None
+        with pytest.raises(FileExistsError):
+            db.clone_database(template, str(tmp_path / "worker.db"))
+    finally:
+        db.use_database(previous)
+    assert db.DATABASE_NAME == previous